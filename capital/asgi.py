@@ -10,12 +10,28 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter
+from django.urls import path, re_path
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'capital.settings')
 
 # application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Import consumers after the apps registry is ready
+from marketsdata.export import ExportConsumer  # noqa
+from marketsdata.consumers import PriceConsumer  # noqa
+from trading.consumers import AccountConsumer  # noqa
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-})
\ No newline at end of file
+    "http": URLRouter([
+        path("export/<str:exid>/<str:source>", AuthMiddlewareStack(ExportConsumer.as_asgi())),
+        re_path(r"", django_application),
+    ]),
+    "websocket": AllowedHostsOriginValidator(AuthMiddlewareStack(URLRouter([
+        path("ws/prices/<str:exid>", PriceConsumer.as_asgi()),
+        path("ws/accounts/<int:pk>", AccountConsumer.as_asgi()),
+    ]))),
+})
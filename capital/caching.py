@@ -0,0 +1,58 @@
+import hashlib
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from capital.methods import *
+
+
+# Return seconds until prices of the next hour are ingested
+def seconds_to_next_hour():
+    now = dt_aware_now()
+    return max(1, int((now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1) - now).total_seconds()))
+
+
+class ConditionalMixin:
+    #
+    # Answer 304 when the data behind a page did not change since the client copy, and let
+    # a front cache keep anonymous public pages until the next hourly update
+    #
+    cache_public = False
+
+    # Return the datetime of the latest change of the data displayed, None disables validation
+    def get_last_modified(self):
+        return None
+
+    def get_etag(self, last_modified):
+        user = self.request.user.pk if self.request.user.is_authenticated else 0
+        key = '{0}|{1}|{2}'.format(self.request.get_full_path(), user, last_modified.isoformat())
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def dispatch(self, request, *args, **kwargs):
+
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        self.request, self.args, self.kwargs = request, args, kwargs
+        last_modified = self.get_last_modified()
+        if last_modified is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = self.get_etag(last_modified)
+        timestamp = int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(timestamp)
+
+        # Pages of authenticated users display their name
+        if self.cache_public and not request.user.is_authenticated:
+            patch_cache_control(response, public=True, max_age=seconds_to_next_hour())
+        else:
+            patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+        patch_vary_headers(response, ['Cookie'])
+
+        return response
@@ -15,8 +15,8 @@ from django.dispatch import receiver
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'capital.settings')
 
-# define Celery instance
-app = Celery('capital', broker='redis://localhost:6379/0')
+# define Celery instance, tasks are profiled against their query budget (see capital.queries)
+app = Celery('capital', broker='redis://localhost:6379/0', task_cls='capital.queries:ProfiledTask')
 
 # Using a string here means the worker doesn't have to serialize
 # the configuration object to child processes.
@@ -47,6 +47,12 @@ default_routing_key = 'default'
 slow_queue_name = 'slow'
 slow_routing_key = 'slow'
 
+orders_queue_name = 'orders'
+orders_routing_key = 'orders'
+
+ingestion_queue_name = 'ingestion'
+ingestion_routing_key = 'ingestion'
+
 default_exchange = Exchange(default_exchange_name, type='direct')
 
 default_queue = Queue(
@@ -59,12 +65,93 @@ slow_queue = Queue(
     default_exchange,
     routing_key=slow_routing_key)
 
-app.conf.task_queues = (default_queue, slow_queue)
+orders_queue = Queue(
+    orders_queue_name,
+    default_exchange,
+    routing_key=orders_routing_key)
+
+ingestion_queue = Queue(
+    ingestion_queue_name,
+    default_exchange,
+    routing_key=ingestion_routing_key)
+
+app.conf.task_queues = (orders_queue, default_queue, ingestion_queue, slow_queue)
 
 app.conf.task_default_queue = default_queue_name
 app.conf.task_default_exchange = default_exchange_name
 app.conf.task_default_routing_key = default_routing_key
 
+# Redis emulates priorities with one list per step, 0 is consumed first
+app.conf.broker_transport_options = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+app.conf.task_default_priority = 5
+
+###########################
+# Route tasks by families #
+###########################
+
+# Order placement and fill handling, served by a dedicated pool so that they
+# never wait behind the ingestion burst at the top of the hour
+orders_tasks = {
+    'Trading_____Send_create_order': 0,
+    'Trading_____Send_cancel_order': 0,
+    'Trading_____Send_fetch_orderid': 1,
+    'Trading_____Send_fetch_open_orders': 1,
+    'Trading_____Send_fetch_all_open_orders': 1,
+    'Trading_____Send_transfer_funds': 1,
+    'Trading_____Market_sell': 1,
+    'Trading_____Market_close': 1,
+    'Trading_____Transfer_to_spot': 1,
+    'Trading_____Update_orders': 2,
+    'Trading_____Cancel_orders': 2,
+    'Trading_____Sync_orders': 2,
+    'Trading_____Rebalance_account': 3,
+    'Trading_____Bulk_update_orders': 3,
+    'Trading_Bulk_rebalance_accounts': 3,
+}
+
+# Market data ingestion, hourly prices first
+ingestion_tasks = {
+    'Markets_____Bulk_update_prices': 2,
+    'Markets_____Update_exchange_prices': 2,
+    'Markets_____Update_dataframe': 3,
+    'Markets_____Bulk_preload_dataframes': 4,
+    'Markets_____Preload_dataframe': 4,
+    'Markets_____Bulk_update_information': 6,
+    'Markets_____Bulk_update_status': 6,
+    'Markets_____Update_exchange_status': 6,
+    'Markets_____Bulk_update_properties': 7,
+    'Markets_____Update_exchange_properties': 7,
+    'Markets_____Bulk_update_currencies': 7,
+    'Markets_____Update_exchange_currencies': 7,
+    'Markets_____Bulk_update_markets': 7,
+    'Markets_____Update_exchange_markets': 7,
+}
+
+# Backfills that can run for minutes
+slow_tasks = {
+    'Markets_____Fetch candle history': 8,
+    'Markets_____Bulk_sync_candles': 8,
+    'Markets_____Sync_candles': 9,
+}
+
+# Other tasks (balances, positions, stats and metrics) stay in the default queue
+app.conf.task_routes = {
+    **{name: dict(queue=orders_queue_name, routing_key=orders_routing_key, priority=priority)
+       for name, priority in orders_tasks.items()},
+    **{name: dict(queue=ingestion_queue_name, routing_key=ingestion_routing_key, priority=priority)
+       for name, priority in ingestion_tasks.items()},
+    **{name: dict(queue=slow_queue_name, routing_key=slow_routing_key, priority=priority)
+       for name, priority in slow_tasks.items()},
+}
+
+# Collect task telemetry and query budgets (see capital.metrics and capital.queries)
+# and register the claim check serializer of large payloads (see capital.claimcheck)
+from capital import metrics, queries, claimcheck  # noqa
+
 
 @setup_logging.connect
 def receiver_setup_logging(loglevel, logfile, format, colorize, **kwargs):
@@ -0,0 +1,84 @@
+import threading
+import uuid
+import zlib
+import redis
+from celery.signals import task_success
+from django.conf import settings
+from kombu.serialization import register
+from kombu.utils.json import dumps, loads
+import structlog
+
+log = structlog.get_logger(__name__)
+
+prefix = 'claimcheck'
+content_type = 'application/x-claimcheck+json'
+
+local = threading.local()
+
+
+def get_redis():
+    if not hasattr(local, 'redis'):
+        local.redis = redis.Redis.from_url(settings.CLAIM_CHECK_REDIS_URL)
+    return local.redis
+
+
+# Serialize to JSON and keep payloads above CLAIM_CHECK_THRESHOLD bytes in a compressed
+# side store, the broker (or result backend) then only carries the key
+def encode(obj):
+
+    body = dumps(obj)
+    if len(body) <= settings.CLAIM_CHECK_THRESHOLD:
+        return body
+
+    key = '{0}:{1}'.format(prefix, uuid.uuid4().hex)
+    data = zlib.compress(body.encode(), 6)
+    try:
+        get_redis().set(key, data, ex=settings.CLAIM_CHECK_TTL)
+    except redis.RedisError as e:
+        log.warning('Unable to store payload, send it inline', exception=str(e), size=len(body))
+        return body
+
+    log.debug('Payload stored', key=key, size=len(body), compressed=len(data))
+    return dumps({'__claimcheck__': key})
+
+
+# Deserialize a payload and fetch it from the side store when it carries a key
+def decode(body):
+
+    obj = loads(body)
+    if not (isinstance(obj, dict) and len(obj) == 1 and '__claimcheck__' in obj):
+        if is_task_message(obj):
+            local.key = None
+        return obj
+
+    key = obj['__claimcheck__']
+    data = get_redis().get(key)
+    if data is None:
+        raise LookupError('Payload {0} expired or missing from the claim check store'.format(key))
+
+    # Results can be read several times and expire with CLAIM_CHECK_TTL, arguments of the
+    # task about to run in this thread are deleted when it succeeds
+    obj = loads(zlib.decompress(data).decode())
+    if is_task_message(obj):
+        local.key = key
+    return obj
+
+
+# Return True if a payload is the body of a task message (args, kwargs and embedded callbacks)
+def is_task_message(obj):
+    return isinstance(obj, list) and len(obj) == 3 and isinstance(obj[2], dict) and 'chord' in obj[2]
+
+
+# Delete the stored arguments of a task once it succeeded, failed tasks keep them until CLAIM_CHECK_TTL
+@task_success.connect
+def task_success_handler(sender=None, **kwargs):
+    key = getattr(local, 'key', None)
+    if key:
+        local.key = None
+        try:
+            get_redis().delete(key)
+        except redis.RedisError as e:
+            log.warning('Unable to delete payload', key=key, exception=str(e))
+
+
+register('claimcheck', encode, decode, content_type=content_type, content_encoding='utf-8')
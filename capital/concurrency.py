@@ -0,0 +1,34 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+
+
+# Give the connections of a pool thread their own lifetime so that the following calls reuse them
+def init_thread():
+    for connection in connections.all():
+        connection.settings_dict = dict(connection.settings_dict, CONN_MAX_AGE=settings.ASYNC_VIEW_CONN_MAX_AGE)
+
+
+# Bounded pool of threads running the ORM work of async views, each thread holds one database connection
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_VIEW_THREADS, thread_name_prefix='orm',
+                              initializer=init_thread)
+
+
+# Close only connections that are broken or older than ASYNC_VIEW_CONN_MAX_AGE after a call
+def call(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        for connection in connections.all():
+            connection.close_if_unusable_or_obsolete()
+
+
+# Run a synchronous function in the pool without blocking the event loop, with the context
+# variables of the caller (e.g. the query profiler of the request)
+async def run_sync(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, call, func, *args, **kwargs))
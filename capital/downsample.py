@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+
+# Return indices of the points kept by Largest-Triangle-Three-Buckets to draw a series with threshold points
+def lttb(x, y, threshold):
+
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+
+    for i in range(threshold - 2):
+
+        # Candidates of the bucket and average point of the next bucket
+        lo, hi = int(i * every) + 1, int((i + 1) * every) + 1
+        next_hi = min(int((i + 2) * every) + 1, n)
+        avg_x, avg_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+
+        # Keep the candidate forming the largest triangle with the previous point and the average
+        areas = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        indices[i + 1] = a
+
+    return indices
+
+
+# Return a series indexed by datetime reduced to points, missing values are dropped
+def downsample(series, points):
+    series = series.dropna()
+    if len(series) <= points:
+        return series
+    x = series.index.view('int64') / 1e9
+    return series.iloc[lttb(x, series.values, points)]
+
+
+# Return the resolution of Metric rows needed to draw a range with points
+def get_resolution(start, end, points):
+    hours = (end - start).total_seconds() / 3600
+    if hours <= points * 4:
+        return '1h'
+    if hours <= points * 24 * 4:
+        return '1d'
+    return '1w'
+
+
+# Return x (ISO 8601 strings) and y lists of a series for a chart
+def to_chart(series):
+    return pd.DatetimeIndex(series.index).strftime('%Y-%m-%dT%H:%M:%SZ').tolist(), series.round(4).tolist()
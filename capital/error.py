@@ -16,4 +16,8 @@ class StrategyError(ApplicationError):
 
 
 class TradingError(ApplicationError):
-    pass
\ No newline at end of file
+    pass
+
+
+class QueryBudgetExceeded(ApplicationError):
+    pass
@@ -0,0 +1,167 @@
+from django.conf import settings
+from graphene_django.views import GraphQLView
+from graphql import parse, GraphQLError
+from graphql.error import GraphQLSyntaxError
+from graphql.execution import ExecutionResult
+from graphql.language import ast
+from graphql.type import GraphQLList, GraphQLNonNull
+from promise import Promise
+from promise.dataloader import DataLoader
+import structlog
+
+log = structlog.get_logger(__name__)
+
+# Arguments bounding the rows of a list field, the declared default applies when omitted
+ROW_ARGUMENTS = ['first', 'hours']
+
+# Rows counted for lists without such argument (e.g. positions of an account)
+LIST_ROWS = 100
+
+
+# Return the loader of a request, created on first use so that batches and caches live for one request
+def get_loader(info, name, factory):
+    loaders = info.context.__dict__.setdefault('loaders', dict())
+    if name not in loaders:
+        loaders[name] = factory()
+    return loaders[name]
+
+
+class ModelLoader(DataLoader):
+    #
+    # Load objects of a queryset by primary key with a single query per batch
+    #
+    def __init__(self, queryset):
+        super().__init__()
+        self.queryset = queryset
+
+    def batch_load_fn(self, keys):
+        objects = self.queryset.in_bulk(set(keys))
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+class GroupLoader(DataLoader):
+    #
+    # Load lists of objects by the value of a field (e.g. positions of accounts) with a single query per batch
+    #
+    def __init__(self, queryset, field):
+        super().__init__()
+        self.queryset = queryset
+        self.field = field
+
+    def batch_load_fn(self, keys):
+        groups = {key: [] for key in keys}
+        for obj in self.queryset.filter(**{'{0}__in'.format(self.field): set(keys)}):
+            groups[getattr(obj, self.field)].append(obj)
+        return Promise.resolve([groups[key] for key in keys])
+
+
+# Return the integer value of an argument literal or variable
+def get_argument(field, name, variables):
+    for argument in field.arguments or []:
+        if argument.name.value == name:
+            if isinstance(argument.value, ast.Variable):
+                value = (variables or dict()).get(argument.value.name.value)
+            else:
+                value = getattr(argument.value, 'value', None)
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+# Return the named type of a field type and whether it is a list
+def unwrap(field_type):
+    is_list = False
+    while isinstance(field_type, (GraphQLList, GraphQLNonNull)):
+        is_list = is_list or isinstance(field_type, GraphQLList)
+        field_type = field_type.of_type
+    return field_type, is_list
+
+
+# Return the rows a field can return, from its arguments or their declared defaults
+def get_rows(selection, definition, variables):
+
+    field_type, is_list = unwrap(definition.type)
+    for name in ROW_ARGUMENTS:
+        if name in definition.args:
+            value = get_argument(selection, name, variables)
+            if value is None:
+                value = definition.args[name].default_value
+            return max(value or 1, 1)
+
+    return LIST_ROWS if is_list else 1
+
+
+# Return depth and complexity of a selection set of a type, object fields count once per row they can return
+def measure(selection_set, parent_type, schema, fragments, variables, visited=()):
+
+    depth, complexity = 0, 0
+    for selection in selection_set.selections if selection_set else []:
+
+        if isinstance(selection, ast.FragmentSpread):
+            name = selection.name.value
+            if name in visited or name not in fragments:
+                continue
+            fragment = fragments[name]
+            fragment_type = schema.get_type(fragment.type_condition.name.value)
+            d, c = measure(fragment.selection_set, fragment_type, schema, fragments, variables, visited + (name,))
+
+        elif isinstance(selection, ast.InlineFragment):
+            fragment_type = schema.get_type(selection.type_condition.name.value) \
+                if selection.type_condition else parent_type
+            d, c = measure(selection.selection_set, fragment_type, schema, fragments, variables, visited)
+
+        else:
+            fields = getattr(parent_type, 'fields', None) or dict()
+            definition = fields.get(selection.name.value)
+            if definition is None or selection.selection_set is None:
+                # Scalars are read from rows already counted (introspection fields such as __typename too)
+                d, c = 1, 0
+            else:
+                field_type, _ = unwrap(definition.type)
+                d, c = measure(selection.selection_set, field_type, schema, fragments, variables, visited)
+                d, c = d + 1, (1 + c) * get_rows(selection, definition, variables)
+
+        depth = max(depth, d)
+        complexity += c
+
+    return depth, complexity
+
+
+class LimitedGraphQLView(GraphQLView):
+    #
+    # Reject queries deeper or more complex than GRAPHQL_MAX_DEPTH and GRAPHQL_MAX_COMPLEXITY before execution
+    #
+    def execute_graphql_request(self, request, data, query, variables, operation_name, *args, **kwargs):
+
+        if query:
+            try:
+                document = parse(query)
+            except GraphQLSyntaxError:
+                document = None
+
+            if document:
+                fragments = {d.name.value: d for d in document.definitions if isinstance(d, ast.FragmentDefinition)}
+                for definition in document.definitions:
+                    if not isinstance(definition, ast.OperationDefinition):
+                        continue
+
+                    if definition.operation == 'mutation':
+                        root = self.schema.get_mutation_type()
+                    elif definition.operation == 'subscription':
+                        root = self.schema.get_subscription_type()
+                    else:
+                        root = self.schema.get_query_type()
+
+                    depth, complexity = measure(definition.selection_set, root, self.schema, fragments, variables)
+                    if depth > settings.GRAPHQL_MAX_DEPTH:
+                        log.warning('GraphQL query rejected', depth=depth)
+                        return ExecutionResult(errors=[GraphQLError('Query depth {0} exceeds {1}'.format(
+                            depth, settings.GRAPHQL_MAX_DEPTH))], invalid=True)
+                    if complexity > settings.GRAPHQL_MAX_COMPLEXITY:
+                        log.warning('GraphQL query rejected', complexity=complexity)
+                        return ExecutionResult(errors=[GraphQLError('Query complexity {0} exceeds {1}'.format(
+                            complexity, settings.GRAPHQL_MAX_COMPLEXITY))], invalid=True)
+
+        return super().execute_graphql_request(request, data, query, variables, operation_name, *args, **kwargs)
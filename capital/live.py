@@ -0,0 +1,75 @@
+import asyncio
+import time
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+# Return the names of the groups receiving prices of an exchange and events of an account
+def get_prices_group(exid):
+    return 'prices_{0}'.format(exid)
+
+
+def get_account_group(account_id):
+    return 'account_{0}'.format(account_id)
+
+
+# Send an event to the consumers of a group, events with the same key replace each other until the next frame
+def publish(group, kind, data, key=None):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(group, dict(type='live.event', kind=kind, key=key or kind, data=data))
+    except Exception as e:
+        log.warning('Unable to publish live event', group=group, kind=kind, exception=str(e))
+
+
+class LiveConsumer(AsyncJsonWebsocketConsumer):
+    #
+    # Push events of a group to a websocket, coalesced into at most one frame per interval
+    #
+    interval = None
+
+    # Return the group of the connection, None closes it (e.g. unauthorized user)
+    async def get_group(self):
+        return None
+
+    async def connect(self):
+        self.group = await self.get_group()
+        if not self.group:
+            await self.close(code=4003)
+            return
+
+        self.pending = dict()
+        self.flusher = None
+        self.sent = 0
+        self.interval = self.interval or settings.LIVE_INTERVAL
+
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if getattr(self, 'group', None):
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+        if getattr(self, 'flusher', None):
+            self.flusher.cancel()
+
+    # Keep the latest event of each key and schedule a frame, immediately if the last one is older than interval
+    async def live_event(self, event):
+        self.pending[event['key']] = dict(type=event['kind'], data=event['data'])
+        if self.flusher is None:
+            delay = max(0, self.sent + self.interval - time.monotonic())
+            self.flusher = asyncio.ensure_future(self.flush(delay))
+
+    async def flush(self, delay):
+        await asyncio.sleep(delay)
+        events = list(self.pending.values())
+        self.pending = dict()
+        self.flusher = None
+        self.sent = time.monotonic()
+        await self.send_json(dict(events=events))
@@ -0,0 +1,399 @@
+import hmac
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import ccxt
+import redis
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_retry, worker_init, worker_ready
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+import picklefield.fields
+import structlog
+
+log = structlog.get_logger(__name__)
+
+prefix = 'metrics'
+
+buckets_seconds = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+buckets_queries = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000]
+buckets_bytes = [1024, 10240, 102400, 1048576, 10485760, 104857600]
+
+# Histograms and counters exposed on the metrics endpoint
+metrics = {
+    'celery_task_queue_wait_seconds': ('histogram', buckets_seconds, 'Time between publication and start of a task'),
+    'celery_task_run_seconds': ('histogram', buckets_seconds, 'Run time of a task'),
+    'celery_task_db_queries': ('histogram', buckets_queries, 'Database queries executed by a task'),
+    'celery_task_db_seconds': ('histogram', buckets_seconds, 'Time spent in database queries by a task'),
+    'celery_task_api_calls': ('histogram', buckets_queries, 'Exchange API calls made by a task'),
+    'celery_task_pickled_bytes': ('histogram', buckets_bytes, 'Bytes pickled to the database by a task'),
+    'celery_task_retries_total': ('counter', None, 'Retries of a task'),
+    'celery_task_busy_seconds_total': ('counter', None, 'Run time of tasks by 5 minutes slot of the hour'),
+    'ccxt_request_seconds': ('histogram', buckets_seconds, 'Latency of exchange API calls by ccxt method'),
+    'celery_queue_length': ('gauge', None, 'Messages waiting in a queue'),
+    'celery_queue_oldest_seconds': ('gauge', None, 'Age of the oldest message waiting in a queue'),
+}
+
+# Running tasks and observations flushed by task_postrun
+local = threading.local()
+
+# Exchange of accounts already resolved in this process
+account_exchanges = dict()
+
+
+def get_redis():
+    if not hasattr(local, 'redis'):
+        local.redis = redis.Redis.from_url(getattr(settings, 'METRICS_REDIS_URL', settings.CELERY_BROKER_URL))
+    return local.redis
+
+
+def get_broker():
+    if not hasattr(local, 'broker'):
+        local.broker = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return local.broker
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+# Add an observation of a histogram or a counter to the current batch
+def observe(name, value, **labels):
+
+    kind, buckets, _ = metrics[name]
+    key = json.dumps(labels, sort_keys=True)
+    batch = get_batch()
+
+    if kind == 'counter':
+        batch[(name, key, '')] += value
+    else:
+        for le in buckets:
+            if value <= le:
+                batch[(name, key, str(le))] += 1
+        batch[(name, key, '+Inf')] += 1
+        batch[(name, key, 'sum')] += value
+
+
+# Return statistics of running tasks (outermost first)
+def get_tasks():
+    if not hasattr(local, 'tasks'):
+        local.tasks = []
+    return local.tasks
+
+
+def get_batch():
+    if not hasattr(local, 'batch'):
+        local.batch = defaultdict(float)
+    return local.batch
+
+
+# Write the current batch to Redis with a single round trip
+def flush():
+
+    batch = get_batch()
+    if not batch:
+        return
+
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for (name, key, field), value in batch.items():
+            pipe.hincrbyfloat('{0}:{1}'.format(prefix, name), '{0}|{1}'.format(key, field), value)
+        pipe.execute()
+
+    except redis.RedisError as e:
+        log.warning('Unable to flush metrics', exception=str(e))
+
+    batch.clear()
+
+
+# Return length and age of the oldest message of broker queues, read at scrape time
+def get_queues():
+
+    from capital.celery import app
+
+    steps = app.conf.broker_transport_options.get('priority_steps', [0])
+    sep = app.conf.broker_transport_options.get('sep', ':')
+    client = get_broker()
+    now = time.time()
+    queues = dict()
+
+    try:
+        for queue in app.conf.task_queues:
+            # Messages are pushed on the left of one list per priority step
+            keys = [queue.name if step == 0 else '{0}{1}{2}'.format(queue.name, sep, step) for step in steps]
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.llen(key)
+                pipe.lindex(key, -1)
+            replies = pipe.execute()
+
+            length, oldest = 0, 0
+            for count, message in zip(replies[::2], replies[1::2]):
+                length += count
+                if message:
+                    try:
+                        published_at = json.loads(message)['headers'].get('published_at')
+                    except (ValueError, KeyError, TypeError):
+                        published_at = None
+                    if published_at:
+                        oldest = max(oldest, now - published_at)
+
+            queues[queue.name] = (length, oldest)
+
+    except redis.RedisError as e:
+        log.warning('Unable to read queues', exception=str(e))
+
+    return queues
+
+
+# Return metrics of all processes in Prometheus text format
+def render():
+
+    client = get_redis()
+    queues = get_queues()
+    lines = []
+
+    for name, (kind, buckets, description) in metrics.items():
+
+        lines.append('# HELP {0} {1}'.format(name, description))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+
+        if kind == 'gauge':
+            index = 0 if name == 'celery_queue_length' else 1
+            for queue, values in sorted(queues.items()):
+                lines.append('{0}{1} {2}'.format(name, format_labels(dict(queue=queue)), round(values[index], 3)))
+            continue
+
+        values = client.hgetall('{0}:{1}'.format(prefix, name))
+        series = defaultdict(dict)
+        for field, value in values.items():
+            key, suffix = field.decode().rsplit('|', 1)
+            series[key][suffix] = float(value)
+
+        for key, data in sorted(series.items()):
+            labels = json.loads(key)
+            if kind == 'counter':
+                lines.append('{0}{1} {2}'.format(name, format_labels(labels), data.get('', 0)))
+            else:
+                for le in [str(b) for b in buckets] + ['+Inf']:
+                    lines.append('{0}_bucket{1} {2}'.format(name, format_labels(dict(labels, le=le)),
+                                                            data.get(le, 0)))
+                lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), data.get('sum', 0)))
+                lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), data.get('+Inf', 0)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if labels:
+        return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('"', '\\"')) for k, v in
+                              sorted(labels.items())) + '}'
+    return ''
+
+
+# Delete all metrics
+def reset():
+    client = get_redis()
+    client.delete(*['{0}:{1}'.format(prefix, name) for name, (kind, _, _) in metrics.items() if kind != 'gauge'])
+
+
+# Return exid from task arguments (exid or account id)
+def get_task_exchange(task, args):
+
+    if not args:
+        return ''
+
+    arg = args[0][0] if isinstance(args[0], list) and args[0] else args[0]
+    if isinstance(arg, str):
+        return arg
+
+    elif isinstance(arg, int) and task.name.startswith('Trading'):
+        if arg not in account_exchanges:
+            from trading.models import Account
+            account_exchanges[arg] = Account.objects.filter(id=arg).values_list('exchange__exid', flat=True).first()
+        return account_exchanges[arg] or ''
+
+    return ''
+
+
+###################
+# Instrumentation #
+###################
+
+# Count queries and time spent in the database
+def query_wrapper(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        for stats in get_tasks():
+            stats['queries'] += 1
+            stats['db_seconds'] += time.perf_counter() - start
+
+
+# Return the name of the unified ccxt method (outermost frame of ccxt) issuing a REST call
+def get_ccxt_method(frame):
+    name = None
+    while frame is not None:
+        if frame.f_globals.get('__name__', '').startswith('ccxt.'):
+            name = frame.f_code.co_name
+        elif name:
+            break
+        frame = frame.f_back
+    return name or 'unknown'
+
+
+# Measure latency of every ccxt REST call, labelled by unified method (e.g. fetch_tickers)
+def instrument_ccxt():
+
+    fetch2 = ccxt.Exchange.fetch2
+
+    def wrapper(self, path, api='public', method='GET', params={}, headers=None, body=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fetch2(self, path, api, method, params, headers, body, *args, **kwargs)
+        finally:
+            observe('ccxt_request_seconds', time.perf_counter() - start,
+                    exchange=self.id, method=get_ccxt_method(sys._getframe(1)))
+            for stats in get_tasks():
+                stats['api_calls'] += 1
+
+    ccxt.Exchange.fetch2 = wrapper
+
+
+# Count bytes written by PickledObjectField
+def instrument_picklefield():
+
+    dbsafe_encode = picklefield.fields.dbsafe_encode
+
+    def wrapper(*args, **kwargs):
+        value = dbsafe_encode(*args, **kwargs)
+        for stats in get_tasks():
+            stats['pickled_bytes'] += len(value)
+        return value
+
+    picklefield.fields.dbsafe_encode = wrapper
+
+
+@before_task_publish.connect
+def before_task_publish_handler(headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def task_prerun_handler(task_id=None, task=None, args=None, **kwargs):
+
+    if not is_enabled():
+        return
+
+    stats = dict(name=task.name, start=time.perf_counter(), queries=0, db_seconds=0, api_calls=0,
+                 pickled_bytes=0, exchange=get_task_exchange(task, args))
+
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at:
+        delivery_info = task.request.delivery_info or dict()
+        observe('celery_task_queue_wait_seconds', max(0, time.time() - published_at),
+                task=task.name, exchange=stats['exchange'], queue=delivery_info.get('routing_key') or '')
+
+    # Eager tasks are nested in the running task
+    tasks = get_tasks()
+    if not tasks:
+        connection.execute_wrappers.append(query_wrapper)
+    tasks.append(stats)
+
+
+@task_postrun.connect
+def task_postrun_handler(task_id=None, task=None, state=None, **kwargs):
+
+    tasks = get_tasks()
+    if not tasks:
+        return
+
+    stats = tasks.pop()
+    if not tasks and query_wrapper in connection.execute_wrappers:
+        connection.execute_wrappers.remove(query_wrapper)
+
+    labels = dict(task=stats['name'], exchange=stats['exchange'])
+    elapsed = time.perf_counter() - stats['start']
+
+    observe('celery_task_run_seconds', elapsed, state=state or '', **labels)
+    observe('celery_task_db_queries', stats['queries'], **labels)
+    observe('celery_task_db_seconds', stats['db_seconds'], **labels)
+    observe('celery_task_api_calls', stats['api_calls'], **labels)
+    observe('celery_task_pickled_bytes', stats['pickled_bytes'], **labels)
+    observe('celery_task_busy_seconds_total', elapsed, minute=time.gmtime().tm_min // 5 * 5, **labels)
+
+    if not tasks:
+        flush()
+
+
+@task_retry.connect
+def task_retry_handler(sender=None, request=None, **kwargs):
+    if is_enabled():
+        observe('celery_task_retries_total', 1, task=sender.name,
+                exchange=get_task_exchange(sender, request.args if request else None))
+
+
+# Return True if an Authorization header carries METRICS_TOKEN
+def has_token(authorization):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization, 'Bearer {0}'.format(token))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if getattr(settings, 'METRICS_TOKEN', None) and not has_token(self.headers.get('Authorization')):
+            self.send_response(403)
+            self.end_headers()
+            return
+
+        payload = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve metrics on a sidecar port of the main process of one worker pool, metrics of all
+# pools are aggregated in Redis so a single endpoint is enough
+@worker_ready.connect
+def worker_ready_handler(sender=None, **kwargs):
+    port = getattr(settings, 'METRICS_PORT', None)
+    if not port or not is_enabled():
+        return
+
+    worker = getattr(settings, 'METRICS_WORKER', None)
+    hostname = getattr(sender, 'hostname', '') or ''
+    if worker and hostname.split('@')[0] != worker:
+        return
+
+    host = getattr(settings, 'METRICS_HOST', '127.0.0.1')
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info('Serve metrics on {0}:{1}'.format(host, port))
+
+
+# Instrument ccxt and picklefield before the pool processes are forked
+@worker_init.connect
+def worker_init_handler(**kwargs):
+    if is_enabled():
+        instrument_ccxt()
+        instrument_picklefield()
+
+
+# Metrics endpoint of the web application, restricted to staff users and scrapers with METRICS_TOKEN
+def metrics_view(request):
+    if not (request.user.is_staff or has_token(request.META.get('HTTP_AUTHORIZATION'))):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
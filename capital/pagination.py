@@ -0,0 +1,172 @@
+import base64
+import json
+from functools import reduce
+from urllib.parse import urlencode
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.http import JsonResponse
+
+
+# Return an opaque token from the ordering values of a row
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+# Return ordering values from a token, None if the token is invalid
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class KeysetPage:
+    #
+    # Rows after (or before) a cursor with the cursors of the adjacent pages
+    #
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = paginator.get_cursor(object_list[-1]) if object_list and has_next else None
+        self.previous_cursor = paginator.get_cursor(object_list[0]) if object_list and has_previous else None
+        self.next_url = None
+        self.previous_url = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    #
+    # Seek pagination over a unique ordering of non-null indexed columns, e.g. ('-id',) or ('exchange_id', 'id'),
+    # so that a page costs an index range scan whatever its depth
+    #
+    def __init__(self, queryset, keys, per_page):
+        self.queryset = queryset
+        self.keys = keys
+        self.per_page = per_page
+
+    def get_cursor(self, obj):
+        return encode_cursor([getattr(obj, key.lstrip('-')) for key in self.keys])
+
+    # Return ordering values of a cursor converted to the types of the key fields, None if the cursor is invalid
+    def get_values(self, cursor):
+
+        values = decode_cursor(cursor) if cursor else None
+        if values is None or len(values) != len(self.keys):
+            return None
+
+        converted = []
+        for key, value in zip(self.keys, values):
+            if value is None or isinstance(value, (list, dict)):
+                return None
+            try:
+                field = self.queryset.model._meta.get_field(key.lstrip('-'))
+                value = field.to_python(value)
+            except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+                return None
+            if value is None:
+                return None
+            converted.append(value)
+        return converted
+
+    # Return a filter selecting rows after values in the ordering (before them if reverse)
+    def get_filter(self, values, reverse=False):
+        clauses = []
+        for i, key in enumerate(self.keys):
+            field = key.lstrip('-')
+            descending = key.startswith('-') != reverse
+            clause = Q(**{'{0}__{1}'.format(field, 'lt' if descending else 'gt'): values[i]})
+            for previous, value in zip(self.keys[:i], values[:i]):
+                clause &= Q(**{previous.lstrip('-'): value})
+            clauses.append(clause)
+        return reduce(lambda a, b: a | b, clauses)
+
+    def page(self, cursor=None, direction='next'):
+
+        values = self.get_values(cursor)
+
+        reverse = direction == 'previous' and values is not None
+        ordering = [key[1:] if key.startswith('-') else '-' + key for key in self.keys] if reverse else self.keys
+
+        qs = self.queryset
+        if values is not None:
+            qs = qs.filter(self.get_filter(values, reverse))
+
+        rows = list(qs.order_by(*ordering)[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            return KeysetPage(rows, self, has_next=True, has_previous=more)
+
+        return KeysetPage(rows, self, has_next=more, has_previous=values is not None)
+
+    # Return the page of a request with the URLs of the adjacent pages keeping other query parameters
+    def page_request(self, request):
+
+        page = self.page(request.GET.get('cursor'), request.GET.get('direction', 'next'))
+        params = {k: v for k, v in request.GET.items() if k not in ['cursor', 'direction', 'page']}
+
+        if page.next_cursor:
+            page.next_url = '?' + urlencode(dict(params, cursor=page.next_cursor, direction='next'))
+        if page.previous_cursor:
+            page.previous_url = '?' + urlencode(dict(params, cursor=page.previous_cursor, direction='previous'))
+        return page
+
+
+class KeysetPaginationMixin:
+    #
+    # Keyset pagination, filters and a JSON variant (?format=json) for list views
+    #
+    keyset = ('id',)
+    filters = dict()  # query parameter: lookup
+    json_fields = ('id',)
+
+    def filter_queryset(self, qs):
+        for param, lookup in self.filters.items():
+            value = self.request.GET.get(param)
+            if value:
+                qs = qs.filter(**{lookup: value})
+        return qs
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, self.keyset, page_size)
+        page = paginator.page_request(self.request)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_json_row(self, obj):
+        row = dict()
+        for field in self.json_fields:
+            value = obj
+            for attr in field.split('__'):
+                value = getattr(value, attr, None) if value is not None else None
+            row[field] = value
+        return row
+
+    def render_json(self, context):
+        page = context['page_obj']
+        return JsonResponse(dict(results=[self.get_json_row(obj) for obj in context['object_list']],
+                                 next=page.next_url if page else None,
+                                 previous=page.previous_url if page else None))
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get('format') == 'json':
+            return self.render_json(context)
+        return super().render_to_response(context, **response_kwargs)
@@ -0,0 +1,223 @@
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from celery import Task
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from capital.error import QueryBudgetExceeded
+import structlog
+
+log = structlog.get_logger(__name__)
+
+# Profiler of the current request, copied to the ORM threads of async views (see capital.concurrency)
+current = contextvars.ContextVar('query_profiler', default=None)
+
+
+# Replace variable length IN lists so identical queries share a template
+def get_template(sql):
+    return re.sub(r'\((?:%s, )+%s\)', '(%s, ...)', sql)
+
+
+# Return the innermost frame of our code that executed a query
+def get_call_site():
+    root = settings.BASE_DIR
+    for frame in reversed(traceback.extract_stack()[:-3]):
+        filename = frame.filename
+        if filename.startswith(root) and 'site-packages' not in filename and not filename.endswith('queries.py'):
+            return '{0}:{1} in {2}'.format(os.path.relpath(filename, root), frame.lineno, frame.name)
+    return 'unknown'
+
+
+# Return the query budget of a task or view declared in settings or with @query_budget
+def get_budget(name, obj=None):
+    budgets = getattr(settings, 'QUERY_BUDGETS', dict())
+    if name in budgets:
+        return budgets[name]
+    return getattr(obj, 'query_budget', None)
+
+
+def is_profiling():
+    return getattr(settings, 'QUERY_PROFILING', False)
+
+
+# Declare the maximum number of queries of a task or a view
+def query_budget(budget):
+    def decorator(func):
+        func.query_budget = budget
+        return func
+    return decorator
+
+
+class QueryProfiler:
+    #
+    # Group SQL templates executed in a block, record their call sites and check a query budget
+    #
+    def __init__(self, name, budget=None, mode=None, threshold=None, call_sites=None, enabled=True):
+        self.name = name
+        self.budget = budget
+        self.mode = mode or getattr(settings, 'QUERY_BUDGET_MODE', 'warn')
+        self.threshold = threshold or getattr(settings, 'QUERY_REPEAT_THRESHOLD', 5)
+        self.call_sites = is_profiling() if call_sites is None else call_sites
+        self.enabled = enabled
+        self.count = 0
+        self.seconds = 0
+        self.templates = Counter()
+        self.sites = defaultdict(Counter)
+        self.lock = threading.Lock()
+
+    # Execute wrapper
+    def __call__(self, execute, sql, params, many, context):
+        if not self.enabled:
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            template = get_template(sql)
+            site = get_call_site() if self.call_sites else None
+            with self.lock:
+                self.count += 1
+                self.seconds += elapsed
+                self.templates[template] += 1
+                if site:
+                    self.sites[template][site] += 1
+
+    def __enter__(self):
+        connection.execute_wrappers.append(self)
+        return self
+
+    def __exit__(self, *args):
+        connection.execute_wrappers.remove(self)
+
+    # Return templates executed at least threshold times with their call sites
+    def get_repeated(self):
+        return [(template, count, dict(self.sites[template]))
+                for template, count in self.templates.most_common() if count >= self.threshold]
+
+    def is_over_budget(self):
+        return self.budget is not None and self.count > self.budget
+
+    # Log repeated queries and enforce the budget
+    def report(self):
+
+        for template, count, sites in self.get_repeated():
+            log.warning('Repeated query in {0}'.format(self.name), count=count, sql=template[:300], sites=sites)
+
+        if self.is_over_budget():
+            message = '{0} executed {1} queries (budget {2})'.format(self.name, self.count, self.budget)
+            if self.mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            log.warning(message, seconds=round(self.seconds, 3))
+
+        elif is_profiling():
+            log.info('{0} executed {1} queries in {2}s'.format(self.name, self.count, round(self.seconds, 3)))
+
+
+# Fail when a block executes more queries than budget (tests)
+@contextmanager
+def assert_max_queries(budget, name='block'):
+    with QueryProfiler(name, budget, call_sites=True) as profiler:
+        yield profiler
+
+    if profiler.is_over_budget():
+        repeated = '\n'.join('{0}x {1} {2}'.format(count, template, sites)
+                             for template, count, sites in profiler.get_repeated())
+        raise AssertionError('{0} executed {1} queries (budget {2})\n{3}'.format(
+            name, profiler.count, budget, repeated))
+
+
+# Execute wrapper of every connection, delegating to the profiler of the current request
+def context_wrapper(execute, sql, params, many, context):
+    profiler = current.get()
+    if profiler is None:
+        return execute(sql, params, many, context)
+    return profiler(execute, sql, params, many, context)
+
+
+# Install the wrapper on connections of all threads, including the ORM pool of async views
+@connection_created.connect
+def connection_created_handler(connection=None, **kwargs):
+    if context_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(context_wrapper)
+
+
+class QueryProfilerMiddleware:
+    #
+    # Profile views with a query budget or all views when QUERY_PROFILING is enabled. The profiler
+    # wraps the whole handler so that view middleware, atomic requests and exception handling still
+    # run, and lives in a context variable to follow async views into their ORM threads
+    #
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        profiler = QueryProfiler('request', enabled=False)
+        token = current.set(profiler)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(profiler, response)
+
+    async def __acall__(self, request):
+        profiler = QueryProfiler('request', enabled=False)
+        token = current.set(profiler)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(profiler, response)
+
+    # Name the profiler after the resolved view and enable it when the view has a budget
+    def process_view(self, request, view_func, view_args, view_kwargs):
+
+        profiler = current.get()
+        if profiler is None:
+            return None
+
+        view = getattr(view_func, 'view_class', view_func)
+        name = request.resolver_match.view_name if request.resolver_match else view.__name__
+        profiler.name = 'view {0}'.format(name)
+        profiler.budget = get_budget(name, view)
+        profiler.enabled = profiler.budget is not None or is_profiling()
+        return None
+
+    def finish(self, profiler, response):
+        if profiler.enabled:
+            profiler.report()
+        return response
+
+
+class ProfiledTask(Task):
+    #
+    # Base task class profiling tasks with a query budget (or all tasks when QUERY_PROFILING is enabled)
+    # around their execution, so that QueryBudgetExceeded fails the task in raise mode
+    #
+    def __call__(self, *args, **kwargs):
+
+        budget = get_budget(self.name, self.run)
+        if budget is None and not is_profiling():
+            return super().__call__(*args, **kwargs)
+
+        with QueryProfiler('task {0}'.format(self.name), budget) as profiler:
+            result = super().__call__(*args, **kwargs)
+
+        profiler.report()
+        return result
@@ -0,0 +1,10 @@
+import graphene
+import marketsdata.schema
+import trading.schema
+
+
+class Query(marketsdata.schema.Query, trading.schema.Query, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=Query)
@@ -56,6 +56,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_structlog.middlewares.RequestMiddleware',
     'django_structlog.middlewares.CeleryMiddleware',
+    'capital.queries.QueryProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'capital.urls'
@@ -147,13 +148,35 @@ CELERY_WORKER_REDIRECT_STDOUTS_LEVEL = 'WARNING'  # The log level output to stdo
 CELERY_WORKER_REDIRECT_STDOUTS = False  # If enabled stdout and stderr will be redirected to the current logger.
 CELERY_BROKER_URL = 'redis://localhost:6379/0'  # /0 for first database
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'  # The backend used to store task results (tombstones). Disabled by default.
-CELERY_ACCEPT_CONTENT = ['application/json']
-CELERY_RESULT_SERIALIZER = 'json'
-CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['application/json', 'application/x-claimcheck+json']
+CELERY_RESULT_SERIALIZER = 'claimcheck'  # JSON, large payloads are stored aside (see capital.claimcheck)
+CELERY_TASK_SERIALIZER = 'claimcheck'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_DISABLE_RATE_LIMITS = True
 CELERY_SEND_EVENTS = True
 
+# Arguments and results larger than CLAIM_CHECK_THRESHOLD bytes are compressed in a Redis database apart from
+# the broker, arguments are deleted once their task succeeded and other payloads expire after CLAIM_CHECK_TTL
+# seconds (long enough for retries and chords to read them)
+CLAIM_CHECK_THRESHOLD = env.int('CLAIM_CHECK_THRESHOLD', default=32 * 1024)
+CLAIM_CHECK_TTL = env.int('CLAIM_CHECK_TTL', default=3600)
+CLAIM_CHECK_REDIS_URL = env('CLAIM_CHECK_REDIS_URL', default='redis://localhost:6379/2')
+
+# Task telemetry aggregated in Redis and served on /metrics to staff users or with the bearer METRICS_TOKEN,
+# and on METRICS_HOST:METRICS_PORT by the worker pool named METRICS_WORKER (node name before @)
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_REDIS_URL = env('METRICS_REDIS_URL', default=CELERY_BROKER_URL)
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+METRICS_HOST = env('METRICS_HOST', default='127.0.0.1')
+METRICS_PORT = env.int('METRICS_PORT', default=None)
+METRICS_WORKER = env('METRICS_WORKER', default='default')
+
+# Log repeated SQL templates with call sites and warn (or raise) when a query budget is exceeded
+QUERY_PROFILING = env.bool('QUERY_PROFILING', default=False)
+QUERY_REPEAT_THRESHOLD = env.int('QUERY_REPEAT_THRESHOLD', default=5)
+QUERY_BUDGET_MODE = env('QUERY_BUDGET_MODE', default='warn')
+QUERY_BUDGETS = {}
+
 # CELERY_REDIS_RETRY_ON_TIMEOUT = True
 # CELERY_RESULT_EXPIRES = 2
 # CELERY_TASK_DEFAULT_DELIVERY_MODE = 'transient'
@@ -272,9 +295,36 @@ NOTEBOOK_ARGUMENTS = [
 ]
 
 GRAPHENE = {
-    "SCHEMA": "django_root.schema.schema"
+    "SCHEMA": "capital.schema.schema"
 }
 
+# Queries deeper or requesting more objects (lists count once per requested row) are rejected
+GRAPHQL_MAX_DEPTH = env.int('GRAPHQL_MAX_DEPTH', default=8)
+GRAPHQL_MAX_COMPLEXITY = env.int('GRAPHQL_MAX_COMPLEXITY', default=20000)
+
 DJANGO_TABLES2_TEMPLATE = "django_tables2/bootstrap.html"
 
 ASGI_APPLICATION = 'capital.asgi.application'
+
+# Channel layer of websocket consumers, workers publish prices, ledger and order events to it
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [env('CHANNELS_REDIS_URL', default=CELERY_BROKER_URL)]},
+    },
+}
+
+# Points per series of charts, longer series are downsampled
+CHART_POINTS = env.int('CHART_POINTS', default=500)
+
+# Threads running the ORM work of async views
+ASYNC_VIEW_THREADS = env.int('ASYNC_VIEW_THREADS', default=8)
+
+# Seconds the threads of async views keep their database connection open between calls
+ASYNC_VIEW_CONN_MAX_AGE = env.int('ASYNC_VIEW_CONN_MAX_AGE', default=600)
+
+# Seconds between two frames pushed to a websocket, events received meanwhile are coalesced
+LIVE_INTERVAL = env.float('LIVE_INTERVAL', default=1.0)
+
+# Seconds the admin caches the freshness of exchanges dataframes
+ADMIN_SUMMARY_TTL = env.int('ADMIN_SUMMARY_TTL', default=60)
@@ -0,0 +1,144 @@
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from graphql import parse
+from capital import claimcheck
+from capital.celery import app
+from capital.error import QueryBudgetExceeded
+from capital.downsample import lttb, downsample, get_resolution
+from capital.graphql import measure
+from capital.pagination import encode_cursor, decode_cursor
+from capital.queries import query_budget
+from capital.schema import schema
+
+
+@app.task(name='Capital_____Count_users')
+@query_budget(1)
+def count_users():
+    return User.objects.count() + User.objects.filter(is_staff=True).count()
+
+
+class CursorTestCase(SimpleTestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor([3, 'BTC'])), [3, 'BTC'])
+
+    def test_invalid(self):
+        self.assertIsNone(decode_cursor('not base64 !'))
+        self.assertIsNone(decode_cursor(encode_cursor({'id': 1})))
+
+
+class DownsampleTestCase(SimpleTestCase):
+
+    def test_lttb_keeps_ends_and_peaks(self):
+        y = np.zeros(1000)
+        y[500] = 10
+        indices = lttb(np.arange(1000), y, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+        self.assertIn(500, indices)
+
+    def test_downsample_short_series(self):
+        series = pd.Series([1.0, np.nan, 3.0], index=pd.date_range('2022-01-01', periods=3, freq='H'))
+        self.assertEqual(downsample(series, 10).tolist(), [1.0, 3.0])
+
+    def test_resolution(self):
+        start = pd.Timestamp('2022-01-01', tz='UTC')
+        self.assertEqual(get_resolution(start, start + pd.Timedelta(days=7), 500), '1h')
+        self.assertEqual(get_resolution(start, start + pd.Timedelta(days=365), 500), '1d')
+        self.assertEqual(get_resolution(start, start + pd.Timedelta(days=3650), 500), '1w')
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = dict()
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@override_settings(CLAIM_CHECK_THRESHOLD=100, CLAIM_CHECK_TTL=60)
+class ClaimCheckTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('capital.claimcheck.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_small_payload_inline(self):
+        body = claimcheck.encode(['binance', {'BTC/USDT': 1}])
+        self.assertNotIn('__claimcheck__', body)
+        self.assertEqual(claimcheck.decode(body), ['binance', {'BTC/USDT': 1}])
+        self.assertEqual(self.redis.data, dict())
+
+    def test_large_payload_stored(self):
+        tickers = {'C{0:04d}/USDT'.format(i): dict(bid=i, ask=i + 1) for i in range(100)}
+        body = claimcheck.encode(['binance', tickers])
+        self.assertIn('__claimcheck__', body)
+        self.assertLess(len(body), 100)
+        self.assertEqual(claimcheck.decode(body), ['binance', tickers])
+
+    # Arguments are deleted once their task succeeded, results are kept for other readers
+    def test_arguments_deleted_on_success(self):
+        message = [['binance', list(range(100))], dict(), dict(callbacks=None, errbacks=None, chain=None, chord=None)]
+        result = dict(status='SUCCESS', result=list(range(100)), task_id='id')
+        message_body, result_body = claimcheck.encode(message), claimcheck.encode(result)
+        self.assertEqual(claimcheck.decode(result_body), result)
+        self.assertEqual(claimcheck.decode(message_body), message)
+
+        claimcheck.task_success_handler()
+        self.assertEqual(len(self.redis.data), 1)
+        self.assertEqual(claimcheck.decode(result_body), result)
+
+    def test_expired_payload(self):
+        body = claimcheck.encode(list(range(100)))
+        self.redis.data.clear()
+        with self.assertRaises(LookupError):
+            claimcheck.decode(body)
+
+
+class MeasureTestCase(SimpleTestCase):
+
+    def measure(self, query, variables=None):
+        document = parse(query)
+        return measure(document.definitions[0].selection_set, schema.get_query_type(), schema, dict(),
+                       variables or dict())
+
+    def test_omitted_first_counts_default(self):
+        self.assertEqual(self.measure('{ markets { id } }'), (2, 100))
+        self.assertEqual(self.measure('{ markets(first: 10) { id } }'), (2, 10))
+        self.assertEqual(self.measure('query($n: Int) { markets(first: $n) { id } }', dict(n=5)), (2, 5))
+
+    def test_series_counts_hours(self):
+        self.assertEqual(self.measure('{ market(id: 1) { series { last } } }'), (3, 25))
+        self.assertEqual(self.measure('{ market(id: 1) { series(hours: 100) { last } } }'), (3, 101))
+
+    # A full page of markets with their latest price and default series stays within the limits
+    def test_markets_series_accepted(self):
+        depth, complexity = self.measure('{ markets(first: 500) { id latest series { last } } }')
+        self.assertLessEqual(depth, settings.GRAPHQL_MAX_DEPTH)
+        self.assertLessEqual(complexity, settings.GRAPHQL_MAX_COMPLEXITY)
+
+
+@override_settings(QUERY_BUDGET_MODE='raise')
+class TaskBudgetTestCase(TestCase):
+
+    # The budget is enforced inside the task so that raise mode fails it
+    def test_over_budget_task_raises(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            count_users.apply(throw=True)
+
+    @override_settings(QUERY_BUDGETS={'Capital_____Count_users': 2})
+    def test_budget_from_settings(self):
+        self.assertEqual(count_users.apply(throw=True).get(), 0)
@@ -3,8 +3,9 @@ from django.urls import include, path
 from django.conf.urls import include, url
 from trading.models import Account
 import structlog
-from graphene_django.views import GraphQLView
+from capital.graphql import LimitedGraphQLView
 from django.views import generic
+from capital.metrics import metrics_view
 
 log = structlog.get_logger(__name__)
 
@@ -18,7 +19,8 @@ urlpatterns = [
     path('users/', include('users.urls')),
     path("users/", include("django.contrib.auth.urls")),
 
-    path("graphql", GraphQLView.as_view(graphiql=True)),
+    path("graphql", LimitedGraphQLView.as_view(graphiql=True)),
+    path("metrics", metrics_view, name='metrics'),
 ]
 
 
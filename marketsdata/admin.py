@@ -1,4 +1,10 @@
 from django.contrib import admin
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Subquery, Func, F, IntegerField, Prefetch
+from django.db.models.expressions import RawSQL
+from django.db.models.fields.json import KeyTransform, KeyTextTransform
+from django.db.models.functions import Coalesce
 from datetime import timedelta, datetime
 from marketsdata.models import Exchange, Market, Candle, Currency, Tickers, Candles
 import structlog
@@ -14,6 +20,25 @@ locale.setlocale(locale.LC_ALL, '')
 log = structlog.get_logger(__name__)
 
 
+# Return a dictionary of exid and True if the dataframe of the exchange is updated, cached a few seconds
+# so that exchange.data is unpickled once per period instead of once per row and page view
+def get_exchanges_freshness():
+    key = 'admin:exchanges:freshness'
+    freshness = cache.get(key)
+    if freshness is None:
+        freshness = dict()
+        for exchange in Exchange.objects.only('exid', 'data').iterator(chunk_size=1):
+            freshness[exchange.exid] = exchange.is_data_updated()
+        cache.set(key, freshness, getattr(settings, 'ADMIN_SUMMARY_TTL', 60))
+    return freshness
+
+
+# Return a subquery counting rows of a model related to the outer object
+def count_subquery(qs, field):
+    return Coalesce(Subquery(qs.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+        n=Count('pk')).values('n')[:1], output_field=IntegerField()), 0)
+
+
 @admin.register(Exchange)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('name', 'get_status', "timeout", "rate_limit", "updated_at", "get_df_latest_index",
@@ -27,6 +52,12 @@ class CustomerAdmin(admin.ModelAdmin):
     save_as = True
     save_on_top = True
 
+    # Count related objects in the changelist query and skip pickled dataframes
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).defer('df', 'data')
+        return qs.annotate(currencies_count=count_subquery(Currency.exchange.through.objects, 'exchange'),
+                           markets_count=count_subquery(Market.objects, 'exchange'))
+
     ###########
     # Columns #
     ###########
@@ -38,17 +69,19 @@ class CustomerAdmin(admin.ModelAdmin):
     get_status.short_description = "Status"
 
     def get_currencies(self, obj):
-        return Currency.objects.filter(exchange=obj).count()
+        return obj.currencies_count
 
     get_currencies.short_description = "Currencies"
+    get_currencies.admin_order_field = 'currencies_count'
 
     def get_markets(self, obj):
-        return Market.objects.filter(exchange=obj).count()
+        return obj.markets_count
 
     get_markets.short_description = "Markets"
+    get_markets.admin_order_field = 'markets_count'
 
     def get_df_latest_index(self, obj):
-        return obj.is_data_updated()
+        return get_exchanges_freshness().get(obj.exid, False)
         # if hasattr(obj, 'data'):
         #     if isinstance(obj.data, pd.DataFrame):
         #         log.info('Last row'.format(list(obj.data.index[-1])))
@@ -141,6 +174,11 @@ class CustomerAdmin(admin.ModelAdmin):
     save_as = True
     save_on_top = True
 
+    def get_queryset(self, request):
+        # Load only the code of exchanges, not their pickled dataframes and options
+        return super().get_queryset(request).prefetch_related(Prefetch('exchange',
+                                                                       queryset=Exchange.objects.only('id', 'exid')))
+
     ###########
     # Columns #
     ###########
@@ -177,6 +215,11 @@ class CustomerAdmin(admin.ModelAdmin):
     save_as = True
     save_on_top = True
 
+    # Market.__str__ needs the exchange, not its dataframes
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('exchange', 'margined').defer('exchange__df',
+                                                                                           'exchange__data')
+
     ###########
     # Columns #
     ###########
@@ -220,15 +263,24 @@ class CustomerAdmin(admin.ModelAdmin):
     save_as = True
     actions = ['update_candles', ]
 
+    # Measure arrays in the database instead of loading them
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related('market__exchange').defer('market__exchange__df',
+                                                                                    'market__exchange__data')
+        if request.resolver_match and request.resolver_match.url_name.endswith('changelist'):
+            qs = qs.defer('data').annotate(
+                records=Func(F('data'), function='jsonb_array_length', output_field=IntegerField()),
+                latest=KeyTextTransform('0', KeyTransform('-1', 'data')))
+        return qs
+
     def count_records(self, obj):
-        if obj.data:
-            return len(obj.data)
+        return getattr(obj, 'records', None)
 
     count_records.short_description = 'Records'
 
     def latest_timestamp(self, obj):
-        if obj.data:
-            return obj.data[-1][0][:16]
+        if getattr(obj, 'latest', None):
+            return obj.latest[:16]
 
     latest_timestamp.short_description = 'Latest'
 
@@ -244,14 +296,24 @@ class CustomerAdmin(admin.ModelAdmin):
     list_filter = ('year', 'semester', 'market__base__code')
     ordering = ('-year', '-semester', 'market',)
 
+    # Count and sort keys in the database instead of loading dictionaries
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related('market__exchange').defer('market__exchange__df',
+                                                                                    'market__exchange__data')
+        if request.resolver_match and request.resolver_match.url_name.endswith('changelist'):
+            table = Tickers._meta.db_table
+            qs = qs.defer('data').annotate(
+                records=RawSQL('SELECT count(*) FROM jsonb_object_keys({0}.data)'.format(table), []),
+                latest=RawSQL('SELECT max(k) FROM jsonb_object_keys({0}.data) AS k'.format(table), []))
+        return qs
+
     def count_records(self, obj):
-        if obj.data:
-            return len(obj.data)
+        return getattr(obj, 'records', None)
 
     count_records.short_description = 'Records'
 
     def latest_timestamp(self, obj):
-        if obj.data:
-            return # obj.data[-1][0][:16]
+        if getattr(obj, 'latest', None):
+            return obj.latest[:16]
 
     latest_timestamp.short_description = 'Latest'
@@ -0,0 +1,296 @@
+import json
+import os
+import platform
+import subprocess
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+from timeit import default_timer as timer
+import numpy as np
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from capital.celery import app
+from capital.methods import *
+from marketsdata.models import Exchange, Market, Currency, Candles, Tickers
+from marketsdata.simulator import create_server
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+class Benchmark:
+    #
+    # Collect timings, query counts and memory of benchmarked code paths
+    #
+    def __init__(self, name, params=None, trace_memory=False, counters=None):
+        self.name = name
+        self.params = params or dict()
+        self.trace_memory = trace_memory
+        self.counters = counters or dict()
+        self.results = []
+
+    # Measure the enclosed block and append a result
+    @contextmanager
+    def measure(self, step, **labels):
+
+        if self.trace_memory:
+            tracemalloc.start()
+
+        result = dict(step=step, **labels)
+        counters = {k: f() for k, f in self.counters.items()}
+        peak = reset_peak_rss()
+        with CaptureQueriesContext(connection) as queries:
+            start = timer()
+            try:
+                yield result
+            finally:
+                result['seconds'] = round(timer() - start, 4)
+
+        result['queries'] = len(queries)
+        for k, f in self.counters.items():
+            result[k] = f() - counters[k]
+        result['rss_peak_kb'] = get_peak_rss_kb() if peak else None
+
+        if self.trace_memory:
+            result['alloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+
+        self.results.append(result)
+        log.info('Benchmark {0} {1}s {2} queries'.format(step, result['seconds'], result['queries']), **labels)
+
+    # Return p50, p95 and p99 of the metrics of each step and labels
+    def summary(self):
+
+        metrics = ['seconds', 'queries'] + list(self.counters)
+        groups = dict()
+        for result in self.results:
+            key = tuple((k, v) for k, v in result.items() if k not in metrics + ['rss_peak_kb', 'alloc_peak_kb'])
+            groups.setdefault(key, []).append(result)
+
+        summary = []
+        for key, results in groups.items():
+            row = dict(key, count=len(results))
+            for metric in metrics:
+                values = [r[metric] for r in results]
+                for p in [50, 95, 99]:
+                    row['{0}_p{1}'.format(metric, p)] = round(float(np.percentile(values, p)), 4)
+            summary.append(row)
+        return summary
+
+    # Return a dictionary with metadata and results
+    def to_dict(self):
+        try:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return dict(benchmark=self.name,
+                    dt=dt_aware_now().strftime(datetime_directive_ISO_8601),
+                    commit=commit,
+                    python=platform.python_version(),
+                    database=connection.vendor,
+                    params=self.params,
+                    summary=self.summary(),
+                    results=self.results
+                    )
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        log.info('Benchmark results saved to {0}'.format(filename))
+
+    # Return steps slower or issuing more queries than a baseline file (median of runs)
+    def compare(self, filename, threshold=0.2):
+
+        with open(filename) as f:
+            baseline = json.load(f)
+
+        def key(row):
+            return tuple(sorted((k, v) for k, v in row.items() if k != 'count' and '_p' not in k))
+
+        previous = {key(row): row for row in baseline['summary']}
+        regressions = []
+
+        for row in self.summary():
+            if key(row) in previous:
+                old = previous[key(row)]
+                if row['seconds_p50'] > old['seconds_p50'] * (1 + threshold) or \
+                        row['queries_p50'] > old['queries_p50']:
+                    regressions.append(dict(row, baseline_seconds_p50=old['seconds_p50'],
+                                            baseline_queries_p50=old['queries_p50']))
+        return regressions
+
+
+# Reset the peak resident set size of the process to its current size, False where /proc is not available
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# Return the peak resident set size of the process in KB since the last reset
+def get_peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+# Record calls of a task .delay() instead of running them, to measure chained tasks as separate steps
+@contextmanager
+def deferred(task):
+    calls = []
+
+    def delay(*args, **kwargs):
+        calls.append((args, kwargs))
+
+    task.delay = delay
+    try:
+        yield calls
+    finally:
+        del task.delay
+
+
+# Create a scratch test database and destroy it on exit
+@contextmanager
+def scratch_database(keepdb=False):
+    name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0, keepdb=keepdb)
+
+
+# Run a simulator in a daemon thread and return it with its url
+@contextmanager
+def running_simulator(simulator, host='127.0.0.1', port=0):
+    server = create_server(simulator, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://{0}:{1}'.format(*server.server_address)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Return synthetic base codes
+def get_synthetic_codes(count):
+    return ['C{0:04d}'.format(i) for i in range(count)]
+
+
+# Create an exchange with spot and perpetual markets pointing to a simulator
+def create_synthetic_exchange(simulator, api_url, exid='binance', hours=24 * 7):
+
+    Exchange.objects.filter(exid=exid).delete()
+    exchange = Exchange.objects.create(exid=exid,
+                                       name=exid,
+                                       wallets='spot,future',
+                                       api_url=api_url,
+                                       status='ok',
+                                       enable=True,
+                                       enable_rate_limit=False,
+                                       timeout=30000,
+                                       limit_ohlcv=1000,
+                                       start_date=dt_aware_now(0) - timedelta(hours=hours),
+                                       supported_quotes=','.join(simulator.quotes),
+                                       supported_stablecoins='USDT,BUSD',
+                                       has={'fetchTickers': True, 'fetchOHLCV': True},
+                                       credentials={'apiKey': True, 'secret': True, 'password': False}
+                                       )
+
+    codes = simulator.codes + [q for q in simulator.quotes if q not in simulator.codes]
+    existing = Currency.objects.filter(code__in=codes).values_list('code', flat=True)
+    Currency.objects.bulk_create([Currency(code=code, stable_coin=code in ['USDT', 'BUSD'])
+                                  for code in set(codes) - set(existing)])
+    currencies = {c.code: c for c in Currency.objects.filter(code__in=codes)}
+    exchange.currency.add(*currencies.values())
+
+    limits = dict(amount=dict(min=0.001, max=9000000), price=dict(min=None, max=None), cost=dict(min=10, max=None))
+    precision = dict(amount=3, price=4, base=8, quote=8)
+
+    markets = []
+    for symbol, (base, quote) in simulator.spot.items():
+        markets.append(Market(exchange=exchange, type='spot', wallet='spot', symbol='{0}/{1}'.format(base, quote),
+                              base=currencies[base], quote=currencies[quote], trading=True, updated=True,
+                              status='trading', limits=limits, precision=precision, response=dict(id=symbol)))
+
+    for symbol, (base, quote) in simulator.futu.items():
+        markets.append(Market(exchange=exchange, type='derivative', wallet='future', contract_type='perpetual',
+                              symbol='{0}/{1}'.format(base, quote), base=currencies[base],
+                              quote=currencies[quote], margined=currencies[quote], trading=True, updated=True,
+                              status='trading', limits=limits, precision=precision, response=dict(id=symbol)))
+
+    Market.objects.bulk_create(markets, batch_size=1000)
+    return exchange
+
+
+# Insert hourly candles and tickers of the last hours for all markets
+def seed_history(exchange, simulator, hours, batch_size=100):
+
+    now = dt_aware_now(0)
+    timestamps = [now - timedelta(hours=h) for h in range(hours, 0, -1)]
+    candles, tickers = [], []
+
+    for market in Market.objects.filter(exchange=exchange).select_related('base', 'quote').iterator():
+
+        symbol = market.response['id']
+        periods = dict()
+        for dt in timestamps:
+            periods.setdefault((dt.year, 1 if dt.month <= 6 else 2), []).append(dt)
+
+        for (year, semester), dts in periods.items():
+
+            data_candles, data_tickers = [], dict()
+            for dt in dts:
+                ts = dt.timestamp()
+                op = simulator.get_symbol_price(symbol, ts)
+                cl = simulator.get_symbol_price(symbol, ts + 3600)
+                volume = 1000000 / op
+                dt_string = dt.strftime(datetime_directive_ISO_8601)
+                data_candles.append([dt_string, op, max(op, cl), min(op, cl), cl, volume])
+                data_tickers[dt_string] = dict(bid=cl * 0.9995, ask=cl * 1.0005, last=cl, bidVolume=10,
+                                               askVolume=10, quoteVolume=volume * cl, baseVolume=volume,
+                                               timestamp=int(ts))
+
+            candles.append(Candles(market=market, year=year, semester=semester, data=data_candles))
+            tickers.append(Tickers(market=market, year=year, semester=semester, data=data_tickers))
+
+        if len(candles) >= batch_size:
+            Candles.objects.bulk_create(candles)
+            Tickers.objects.bulk_create(tickers)
+            candles, tickers = [], []
+
+    Candles.objects.bulk_create(candles)
+    Tickers.objects.bulk_create(tickers)
+
+
+# Execute Celery tasks in the current process
+@contextmanager
+def eager_tasks():
+    always_eager = app.conf.task_always_eager
+    app.conf.task_always_eager = True
+    try:
+        yield
+    finally:
+        app.conf.task_always_eager = always_eager
+
+
+# Run a block in a temporary working directory
+@contextmanager
+def working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,13 @@
+from channels.db import database_sync_to_async
+from capital.live import LiveConsumer, get_prices_group
+from marketsdata.models import Exchange
+
+
+class PriceConsumer(LiveConsumer):
+    #
+    # Push latest prices of an exchange after each update
+    #
+    async def get_group(self):
+        exid = self.scope['url_route']['kwargs']['exid']
+        exists = await database_sync_to_async(Exchange.objects.filter(exid=exid).exists)()
+        return get_prices_group(exid) if exists else None
@@ -0,0 +1,255 @@
+import io
+import re
+import zlib
+from datetime import datetime
+from urllib.parse import parse_qs
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.generic.http import AsyncHttpConsumer
+from django.db import connection
+from django.db.models import Q
+from capital.methods import *
+from marketsdata.models import Candles, Tickers
+import structlog
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+log = structlog.get_logger(__name__)
+
+columns = dict(candles=['open', 'high', 'low', 'close', 'volume'],
+               tickers=['bid', 'ask', 'last', 'quoteVolume', 'baseVolume'])
+
+content_types = dict(csv='text/csv; charset=utf-8', arrow='application/vnd.apache.arrow.stream')
+
+# Length of content is unknown until the end of the stream, ranges are buffered up to this size
+# (larger and open ranges are answered with the full content)
+MAX_RANGE = 64 * 1024 * 1024
+
+
+class ExportError(Exception):
+    def __init__(self, status, msg):
+        super().__init__(msg)
+        self.status = status
+        self.msg = msg
+
+
+# Return an aware datetime from '2021-01-01' or '2021-01-01T00:00:00Z'
+def parse_dt(string):
+    dt = datetime.fromisoformat(string.replace('Z', '+00:00'))
+    return dt if dt.tzinfo else dt.replace(tzinfo=pytz.UTC)
+
+
+# Yield symbol, type and rows (dt string + values) of each Candles or Tickers object in range
+def iter_history(exid, source, start, end, symbol=None, market_type=None, chunk_size=10):
+
+    model = Candles if source == 'candles' else Tickers
+    qs = model.objects.filter(Q(market__type='spot') | Q(market__type='derivative',
+                                                         market__contract_type='perpetual'),
+                              market__exchange__exid=exid,
+                              year__in=get_list_years(start, end)
+                              )
+    if symbol:
+        qs = qs.filter(market__symbol=symbol)
+    if market_type:
+        qs = qs.filter(market__type=market_type)
+
+    start_string = start.strftime(datetime_directive_ISO_8601)
+    end_string = end.strftime(datetime_directive_ISO_8601)
+
+    # Server-side cursor on PostgreSQL
+    qs = qs.order_by('market__symbol', 'market__type', 'year', 'semester')
+    for symbol, market_type, data in qs.values_list('market__symbol', 'market__type', 'data'
+                                                    ).iterator(chunk_size=chunk_size):
+
+        if source == 'candles':
+            rows = [row for row in data or [] if start_string <= row[0] <= end_string]
+        else:
+            rows = [[dt] + [ticker.get(c) for c in columns['tickers']] for dt, ticker in (data or dict()).items()
+                    if start_string <= dt <= end_string]
+
+        if rows:
+            yield symbol, market_type, rows
+
+
+# Yield CSV chunks, one per object
+def encode_csv(source, history):
+
+    yield (','.join(['dt', 'symbol', 'type'] + columns[source]) + '\n').encode()
+
+    for symbol, market_type, rows in history:
+        prefix = ',{0},{1},'.format(symbol, market_type)
+        yield ''.join(row[0] + prefix + ','.join('' if v is None else repr(v) for v in row[1:]) + '\n'
+                      for row in rows).encode()
+
+
+# Yield Arrow IPC stream chunks, one record batch per object
+def encode_arrow(source, history):
+
+    fields = [pa.field('dt', pa.timestamp('s', tz='UTC')), pa.field('symbol', pa.string()),
+              pa.field('type', pa.string())] + [pa.field(c, pa.float64()) for c in columns[source]]
+    schema = pa.schema(fields)
+
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def flush():
+        value = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return value
+
+    yield flush()
+
+    for symbol, market_type, rows in history:
+        arrays = [pa.array([datetime.strptime(r[0], datetime_directive_ISO_8601) for r in rows],
+                           pa.timestamp('s', tz='UTC')),
+                  pa.array([symbol] * len(rows), pa.string()),
+                  pa.array([market_type] * len(rows), pa.string())]
+        arrays += [pa.array([r[i + 1] for r in rows], pa.float64()) for i in range(len(columns[source]))]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        yield flush()
+
+    writer.close()
+    yield flush()
+
+
+# Yield gzip compressed chunks
+def compress(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# Return bytes first to last (inclusive) of chunks and the total length if the content ends in the range
+def read_range(chunks, first, last):
+    position, data = 0, []
+    for chunk in chunks:
+        begin, end = position, position + len(chunk)
+        position = end
+        if end <= first:
+            continue
+        if begin > last:
+            return b''.join(data), None
+        data.append(chunk[max(0, first - begin):last - begin + 1])
+    return b''.join(data), position
+
+
+# Return first and last bytes of a 'bytes=first-last' header, None for open ranges answered in full
+def parse_range(header):
+    match = re.fullmatch(r'bytes=(\d+)-(\d*)', header.strip())
+    if not match:
+        raise ExportError(416, 'Only single byte ranges with a start are supported')
+
+    first = int(match.group(1))
+    if not match.group(2):
+        return None
+
+    last = int(match.group(2))
+    if last < first:
+        raise ExportError(416, 'Range end precedes its start')
+    if last - first + 1 > MAX_RANGE:
+        return None
+    return first, last
+
+
+class ExportConsumer(AsyncHttpConsumer):
+    #
+    # Stream history of an exchange or a market as CSV or Arrow with constant memory
+    #
+    async def handle(self, body):
+
+        try:
+            user = self.scope.get('user')
+            if not user or not user.is_authenticated:
+                raise ExportError(401, 'Authentication required')
+
+            kwargs = self.scope['url_route']['kwargs']
+            headers = {k.decode().lower(): v.decode() for k, v in self.scope['headers']}
+            params = {k: v[-1] for k, v in parse_qs(self.scope['query_string'].decode()).items()}
+
+            source = kwargs['source']
+            fmt = params.get('format', 'csv')
+            if source not in columns:
+                raise ExportError(404, 'Unknown source {0}'.format(source))
+            if fmt not in content_types:
+                raise ExportError(400, 'Unknown format {0}'.format(fmt))
+            if fmt == 'arrow' and pa is None:
+                raise ExportError(406, 'Arrow format requires pyarrow')
+
+            try:
+                start = parse_dt(params['start'])
+                end = parse_dt(params.get('end', dt_aware_now(0).strftime(datetime_directive_ISO_8601)))
+            except (KeyError, ValueError):
+                raise ExportError(400, 'Parameters start (and end) must be ISO 8601 dates')
+
+            byte_range = parse_range(headers['range']) if 'range' in headers else None
+
+        except ExportError as e:
+            response = [(b'Content-Type', b'text/plain')]
+            if e.status == 416:
+                response.append((b'Content-Range', b'bytes */*'))
+            await self.send_response(e.status, e.msg.encode(), headers=response)
+            return
+
+        filename = '{0}_{1}_{2}.{3}'.format(kwargs['exid'], source, start.strftime('%Y%m%d'), fmt)
+        response = [(b'Content-Type', content_types[fmt].encode()),
+                    (b'Content-Disposition', 'attachment; filename="{0}"'.format(filename).encode()),
+                    (b'Accept-Ranges', b'bytes')]
+
+        # Ranges apply to the identity encoding
+        gzip = 'gzip' in headers.get('accept-encoding', '') and byte_range is None
+        if gzip:
+            response.append((b'Content-Encoding', b'gzip'))
+
+        args = (kwargs['exid'], source, fmt, start, end, params.get('symbol'), params.get('type'))
+
+        # Buffer the range to send its actual last byte (and length when the content ends in it)
+        if byte_range:
+            first, last = byte_range
+            data, total = await sync_to_async(self.read, thread_sensitive=False)(*args, first, last)
+            if not data:
+                await self.send_response(416, b'Range starts after the end of the content',
+                                         headers=[(b'Content-Type', b'text/plain'),
+                                                  (b'Content-Range', 'bytes */{0}'.format(
+                                                      '*' if total is None else total).encode())])
+                return
+
+            response.append((b'Content-Range', 'bytes {0}-{1}/{2}'.format(
+                first, first + len(data) - 1, '*' if total is None else total).encode()))
+            await self.send_response(206, data, headers=response)
+            return
+
+        await self.send_headers(status=200, headers=response)
+
+        # Query and encode in a dedicated thread holding the cursor, chunks are sent as they are produced
+        await sync_to_async(self.stream, thread_sensitive=False)(*args, gzip)
+        await self.send_body(b'', more_body=False)
+
+    def get_chunks(self, exid, source, fmt, start, end, symbol, market_type):
+        log.info('Export {0} of {1}'.format(source, exid), symbol=symbol, start=str(start), end=str(end))
+        history = iter_history(exid, source, start, end, symbol, market_type)
+        return encode_csv(source, history) if fmt == 'csv' else encode_arrow(source, history)
+
+    def read(self, exid, source, fmt, start, end, symbol, market_type, first, last):
+        try:
+            return read_range(self.get_chunks(exid, source, fmt, start, end, symbol, market_type), first, last)
+        finally:
+            connection.close()
+
+    def stream(self, exid, source, fmt, start, end, symbol, market_type, gzip):
+        try:
+            chunks = self.get_chunks(exid, source, fmt, start, end, symbol, market_type)
+            if gzip:
+                chunks = compress(chunks)
+
+            for chunk in chunks:
+                if chunk:
+                    async_to_sync(self.send_body)(chunk, more_body=True)
+
+        finally:
+            connection.close()
@@ -0,0 +1,111 @@
+import tempfile
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from capital.methods import *
+from marketsdata.benchmark import Benchmark, scratch_database, running_simulator, get_synthetic_codes, \
+    create_synthetic_exchange, seed_history, eager_tasks, working_directory, deferred
+from marketsdata.models import Exchange, Candles
+from marketsdata.simulator import Simulator
+from marketsdata.tasks import update_prices, update_dataframe, fetch_candle_history, bulk_sync_candles
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark price ingestion and dataframe loading against synthetic exchanges in a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--markets', default='100,1000,5000',
+                            help='Comma separated list of synthetic market counts (codes per wallet)')
+        parser.add_argument('--hours', default='168,8760,26280',
+                            help='Comma separated list of history depths in hours')
+        parser.add_argument('--fetch-hours', type=int, default=48,
+                            help='Depth of candles downloaded by fetch_candle_history')
+        parser.add_argument('--load-hours', type=int, default=24 * 30, help='Length of dataframes loaded')
+        parser.add_argument('--latency', type=float, default=0, help='Simulator latency in milliseconds')
+        parser.add_argument('--output', default='benchmark_ingestion.json')
+        parser.add_argument('--baseline', help='Previous results file to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Tolerated slowdown versus baseline')
+        parser.add_argument('--trace-memory', action='store_true', help='Record peak Python allocations per step')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the scratch database between runs')
+
+    def handle(self, *args, **options):
+
+        sizes = [int(i) for i in options['markets'].split(',')]
+        depths = [int(i) for i in options['hours'].split(',')]
+
+        benchmark = Benchmark('ingestion', params=dict(markets=sizes, hours=depths,
+                                                       fetch_hours=options['fetch_hours'],
+                                                       load_hours=options['load_hours'],
+                                                       latency=options['latency']),
+                              trace_memory=options['trace_memory'])
+
+        with scratch_database(options['keepdb']) as database, eager_tasks(), \
+                tempfile.TemporaryDirectory() as tmp, working_directory(tmp):
+
+            log.info('Benchmark database {0}'.format(database))
+
+            for size in sizes:
+                for hours in depths:
+                    self.run(benchmark, size, hours, options)
+
+        benchmark.save(options['output'])
+
+        if options['baseline']:
+            regressions = benchmark.compare(options['baseline'], options['threshold'])
+            for r in regressions:
+                log.warning('Regression {0}'.format(r['step']), **r)
+            if regressions:
+                raise CommandError('{0} regression(s) versus {1}'.format(len(regressions), options['baseline']))
+
+    def run(self, benchmark, size, hours, options):
+
+        labels = dict(markets=size, hours=hours)
+        codes = get_synthetic_codes(size)
+        simulator = Simulator(codes=codes, quotes=['USDT'], latency=options['latency'], weight_limit=10 ** 9)
+
+        with running_simulator(simulator) as url:
+
+            with benchmark.measure('create_exchange', **labels):
+                exchange = create_synthetic_exchange(simulator, url, hours=options['fetch_hours'])
+
+            with benchmark.measure('seed_history', **labels):
+                seed_history(exchange, simulator, hours)
+
+            length = min(options['load_hours'], hours)
+            start = (dt_aware_now(0) - timedelta(hours=length)).strftime('%Y-%m-%d %H:%M:%S')
+
+            with benchmark.measure('load_data', **labels):
+                exchange.load_data(length, codes)
+
+            for wallet in exchange.get_wallets():
+                with benchmark.measure('update_prices', wallet=wallet, **labels):
+                    update_prices(exchange.exid, wallet)
+
+            with benchmark.measure('update_dataframe', **labels):
+                update_dataframe(exchange.exid)
+
+            for source in ['candles', 'tickers']:
+                for market_type in ['spot', 'future']:
+                    exchange = Exchange.objects.get(id=exchange.id)
+                    with benchmark.measure('load_df', source=source, market_type=market_type, **labels):
+                        exchange.load_df(length, 'USDT', codes, market_type, source, clear=True, start=start)
+
+            for dtype in ['prices', 'volumes']:
+                with benchmark.measure('save_csv_file', dtype=dtype, **labels):
+                    exchange.save_csv_file('USDT', dtype)
+
+            # Download candles of all markets from the simulator since exchange.start_date
+            Candles.objects.filter(market__exchange=exchange).delete()
+
+            # Measure the synchronization chained by fetch_candle_history separately
+            with deferred(bulk_sync_candles) as calls:
+                with benchmark.measure('fetch_candle_history', fetch_hours=options['fetch_hours'], **labels):
+                    fetch_candle_history(exchange.exid)
+
+            for args, kwargs in calls:
+                with benchmark.measure('bulk_sync_candles', fetch_hours=options['fetch_hours'], **labels):
+                    bulk_sync_candles(*args, **kwargs)
+
+            Exchange.objects.filter(id=exchange.id).delete()
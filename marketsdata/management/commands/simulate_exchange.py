@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+from marketsdata.models import Exchange
+from marketsdata.simulator import Simulator, create_server
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run a local Binance-compatible exchange simulator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--codes', default='BTC,ETH,BNB,ADA,XRP,SOL,DOT,DOGE,LTC,LINK',
+                            help='Comma separated list of base currencies')
+        parser.add_argument('--quotes', default='USDT,BUSD', help='Comma separated list of spot quotes')
+        parser.add_argument('--spot', type=float, default=100000, help='Initial spot balance of each quote')
+        parser.add_argument('--future', type=float, default=0, help='Initial USDT balance of future wallet')
+        parser.add_argument('--latency', type=float, default=0, help='Response latency in milliseconds')
+        parser.add_argument('--jitter', type=float, default=0, help='Latency jitter in milliseconds')
+        parser.add_argument('--weight-limit', type=int, default=1200, help='Request weight per minute')
+        parser.add_argument('--ban-after', type=int, default=3, help='Requests over limit before a 418 ban')
+        parser.add_argument('--ban-seconds', type=int, default=120)
+        parser.add_argument('--fill', default='instant', choices=['instant', 'partial', 'random', 'never'],
+                            help='Fill model of limit orders')
+        parser.add_argument('--fill-ratio', type=float, default=0.5, help='Fraction filled per match (partial)')
+        parser.add_argument('--fill-probability', type=float, default=0.5, help='Probability of fill (random)')
+        parser.add_argument('--fee', type=float, default=0.001)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--exchange', help='Point the api_url of this exchange exid to the simulator')
+
+    def handle(self, *args, **options):
+
+        quotes = options['quotes'].split(',')
+        simulator = Simulator(codes=options['codes'].split(','),
+                              quotes=quotes,
+                              balances=dict(spot={q: options['spot'] for q in quotes},
+                                            future=dict(USDT=options['future'])),
+                              latency=options['latency'],
+                              jitter=options['jitter'],
+                              weight_limit=options['weight_limit'],
+                              ban_after=options['ban_after'],
+                              ban_seconds=options['ban_seconds'],
+                              fill=options['fill'],
+                              fill_ratio=options['fill_ratio'],
+                              fill_probability=options['fill_probability'],
+                              fee=options['fee'],
+                              seed=options['seed'])
+
+        server = create_server(simulator, options['host'], options['port'])
+        url = 'http://{0}:{1}'.format(options['host'], options['port'])
+
+        if options['exchange']:
+            try:
+                exchange = Exchange.objects.get(exid=options['exchange'])
+            except Exchange.DoesNotExist:
+                raise CommandError('Exchange {0} does not exist'.format(options['exchange']))
+            exchange.api_url = url
+            exchange.save()
+            log.info('Exchange {0} points to simulator'.format(exchange.exid))
+
+        log.info('Simulator listening on {0}'.format(url))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if options['exchange']:
+                Exchange.objects.filter(exid=options['exchange']).update(api_url=None)
+                log.info('Exchange {0} points to live API'.format(options['exchange']))
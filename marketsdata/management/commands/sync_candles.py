@@ -0,0 +1,48 @@
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as timer
+from django.db import connections
+from django.core.management.base import BaseCommand
+from marketsdata.sync import sync_range, get_market_ranges
+from marketsdata.tasks import bulk_sync_candles
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Expand Candles objects into Candle rows, resuming from objects not synced yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exchange', help='Exid of an exchange (default all exchanges)')
+        parser.add_argument('--workers', type=int, default=1, help='Parallel processes, one per range of markets')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per bulk insert')
+        parser.add_argument('--chunk-size', type=int, default=20, help='Candles objects fetched per cursor round trip')
+        parser.add_argument('--full', action='store_true', help='Insert all rows instead of rows after the latest')
+        parser.add_argument('--celery', action='store_true', help='Dispatch ranges to Celery workers instead')
+
+    def handle(self, *args, **options):
+
+        if options['celery']:
+            bulk_sync_candles.delay(options['exchange'], options['workers'], options['full'])
+            log.info('Sync candles dispatched to Celery')
+            return
+
+        begin = timer()
+        kwargs = dict(exid=options['exchange'], batch_size=options['batch_size'], chunk_size=options['chunk_size'],
+                      full=options['full'])
+
+        if options['workers'] > 1:
+            ranges = get_market_ranges(options['workers'], options['exchange'])
+
+            # Forked processes must not share database connections
+            connections.close_all()
+
+            with ProcessPoolExecutor(max_workers=len(ranges) or 1) as executor:
+                futures = [executor.submit(sync_range, first, last, **kwargs) for first, last in ranges]
+                results = [future.result() for future in futures]
+        else:
+            results = [sync_range(**kwargs)]
+
+        log.info('Sync candles complete in {0}s'.format(round(timer() - begin, 1)),
+                 objects=sum(r['objects'] for r in results),
+                 candles=sum(r['candles'] for r in results))
@@ -6,6 +6,7 @@ from datetime import datetime
 from pprint import pprint
 import pandas as pd
 import pytz
+import re
 
 log = structlog.get_logger(__name__)
 
@@ -392,3 +393,12 @@ def get_derivative_listing_date(exid, values):
     return False
 
 
+def set_api_url(urls, api_url):
+    #
+    # Replace scheme and host of ccxt API urls (simulator)
+    #
+    if isinstance(urls, dict):
+        return {k: set_api_url(v, api_url) for k, v in urls.items()}
+    elif isinstance(urls, str):
+        return re.sub(r'^https?://[^/]+', api_url.rstrip('/'), urls)
+    return urls
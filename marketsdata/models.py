@@ -3,6 +3,7 @@ from datetime import datetime, date
 import ccxt
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.db import models
+from django.db.models.fields.json import KeyTransform
 from django_pandas.managers import DataFrameManager
 from capital.methods import *
 from marketsdata.methods import *
@@ -37,6 +38,7 @@ class Exchange(models.Model):
     precision_mode = models.IntegerField(null=True, blank=True)
     status_at, eta = [models.DateTimeField(blank=True, null=True) for i in range(2)]
     url = models.URLField(blank=True, null=True)
+    api_url = models.URLField(blank=True, null=True)
     start_date = models.DateTimeField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -115,8 +117,8 @@ class Exchange(models.Model):
                                                                                                   int(seconds)))
             return False
 
-    # Return exchange class (ccxt)
-    def get_ccxt_client(self, account=None, wallet=None):
+    # Return exchange class (ccxt), options are saved unless save is False
+    def get_ccxt_client(self, account=None, wallet=None, save=True):
 
         client = getattr(ccxt, self.exid)
         client = client({
@@ -139,8 +141,13 @@ class Exchange(models.Model):
             if 'defaultType' in client.options:
                 client.options['defaultType'] = wallet
 
-        self.options = client.options
-        self.save()
+        # Send requests to a local simulator
+        if self.api_url:
+            client.urls['api'] = set_api_url(client.urls['api'], self.api_url)
+
+        if save:
+            self.options = client.options
+            self.save()
 
         return client
 
@@ -171,6 +178,9 @@ class Exchange(models.Model):
             if 'defaultType' in client.options:
                 client.options['defaultType'] = market.type
 
+        if self.api_url:
+            client.urls['api'] = set_api_url(client.urls['api'], self.api_url)
+
         # create a new method
         def get_market_types(client):
             return list(set(Market.objects.filter(exchange=self).values_list('type', flat=True)))
@@ -692,6 +702,81 @@ class Exchange(models.Model):
             log.error('Instance has not data attribute', exid=self.exid)
             return False
 
+    # Return True if prices of all markets needed by a strategy are updated
+    def are_strategy_markets_updated(self, strategy, quote, dt=None):
+
+        if not dt:
+            dt = dt_aware_now(0)
+
+        symbols_long = list(set([c + '/' + quote for c in strategy.get_codes_long()]))
+        symbols_short = list(set([c + '/' + quote for c in strategy.get_codes_short()]))
+
+        # Count updated markets with a single query
+        updated = Market.objects.filter(models.Q(symbol__in=symbols_long, type='spot') |
+                                        models.Q(symbol__in=symbols_short,
+                                                 type='derivative',
+                                                 contract_type='perpetual'),
+                                        exchange=self,
+                                        last_price_update_dt=dt
+                                        ).count()
+
+        return updated >= len(symbols_long) + len(symbols_short)
+
+    # Return dictionaries of latest spot bid/ask (or key) and perpetual last prices with a single query
+    def get_latest_prices(self, codes, quote, key=None):
+
+        now = dt_aware_now(0).strftime(datetime_directive_ISO_8601)
+
+        # Select only the current hour from tickers objects
+        qs = Tickers.objects.filter(models.Q(market__base__code__in=codes, market__quote__code=quote) |
+                                    models.Q(market__base__code=quote, market__quote__code__in=codes),
+                                    models.Q(market__type='spot') |
+                                    models.Q(market__type='derivative', market__contract_type='perpetual'),
+                                    market__exchange=self,
+                                    year=get_year(),
+                                    semester=get_semester()
+                                    ).annotate(ticker=KeyTransform(now, 'data')
+                                               ).values('market__base__code',
+                                                        'market__quote__code',
+                                                        'market__type',
+                                                        'ticker')
+
+        spot, futu = dict(), dict()
+        spot_flip, futu_flip = dict(), dict()
+
+        for row in qs:
+
+            # Flip base and quote like get_spot_market() and get_perp_market()
+            flip = row['market__base__code'] == quote
+            code = row['market__quote__code'] if flip else row['market__base__code']
+
+            if not row['ticker']:
+                log.error('Key {0} not found'.format(now), code=code, type=row['market__type'])
+                continue
+
+            if row['market__type'] == 'spot':
+                if key:
+                    # Return a single key like get_latest_price()
+                    if flip:
+                        spot_flip[code] = row['ticker'][key]
+                    else:
+                        spot[code] = row['ticker'][key]
+                    continue
+
+                bid, ask = row['ticker']['bid'], row['ticker']['ask']
+                if flip:
+                    spot_flip[code] = (ask, bid)
+                else:
+                    spot[code] = (bid, ask)
+            else:
+                if flip:
+                    futu_flip[code] = row['ticker']['last']
+                else:
+                    futu[code] = row['ticker']['last']
+
+        # Market with the desired quote has priority over flipped market
+        return {**spot_flip, **spot}, {**futu_flip, **futu}
+
     # Return a spot market
     def get_spot_market(self, base, quote):
         try:
@@ -839,7 +924,7 @@ class Market(models.Model):
 
     delivery_date = models.DateTimeField(null=True, blank=True)
     onboard_date = models.DateTimeField(null=True, blank=True)
-    dt_created = models.DateTimeField(auto_now=True)
+    dt_created = models.DateTimeField(auto_now=True, db_index=True)
 
     margined = models.ForeignKey(Currency, on_delete=models.CASCADE,
                                  related_name='market_margined',
@@ -867,6 +952,7 @@ class Market(models.Model):
     updated = models.BooleanField(null=True, default=False)
     funding_rate = models.JSONField(null=True, blank=True)
     top = models.BooleanField(null=True, default=None)
+    last_price_update_dt = models.DateTimeField(null=True, blank=True, db_index=True)
     objects = models.Manager()
 
     class Meta:
@@ -909,18 +995,8 @@ class Market(models.Model):
 
     # Return True if prices and volume are updated
     def is_updated(self):
-
-        # Determine datetime and semester
         dt = timezone.now().replace(minute=0, second=0, microsecond=0)
-        now = dt.strftime(datetime_directive_ISO_8601)
-        semester = 1 if dt.month <= 6 else 2
-
-        ticker = Tickers.objects.get(year=dt.year, semester=semester, market=self)
-
-        if now in ticker.data.keys():
-            return True
-        else:
-            return False
+        return self.last_price_update_dt == dt
 
     #######################
 
@@ -1066,6 +1142,7 @@ class Candles(models.Model):
     market = models.ForeignKey(Market, on_delete=models.CASCADE, related_name='candles', null=True)
     data = models.JSONField(null=True, blank=True)
     dt_created = models.DateTimeField(auto_now=True)
+    synced = models.DateTimeField(null=True, blank=True)  # dt_created of the data expanded into Candle
     objects = DataFrameManager()  # activate custom manager
 
     class Meta:
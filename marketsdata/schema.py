@@ -1,8 +1,191 @@
 import graphene
+from graphene_django import DjangoObjectType
+from promise import Promise
+from promise.dataloader import DataLoader
+from django.db.models.fields.json import KeyTransform
+from django.db.models.functions import Coalesce
+from capital.graphql import get_loader, ModelLoader
+from capital.methods import *
+from marketsdata.models import Exchange, Market, Currency, Tickers, Candle
+
+# Rows of a list and hours of a series a query can request
+MAX_ROWS = 500
+MAX_HOURS = 7 * 24
+
+# Hours looked back for the latest ticker of a market
+LATEST_HOURS = 24
+
+
+class LatestTickerLoader(DataLoader):
+    #
+    # Load the most recent ticker of markets within LATEST_HOURS with a single query, so that the
+    # previous hour is served from the top of the hour until ingestion completes
+    #
+    def batch_load_fn(self, keys):
+
+        now = dt_aware_now(0)
+        dts = [now - timedelta(hours=h) for h in range(LATEST_HOURS)]
+        ticker = Coalesce(*[KeyTransform(dt.strftime(datetime_directive_ISO_8601), 'data') for dt in dts])
+
+        # Rows of later semesters hold later hours and replace earlier ones
+        qs = Tickers.objects.filter(market_id__in=set(keys), year__in={dt.year for dt in dts}
+                                    ).annotate(ticker=ticker).filter(ticker__isnull=False).order_by('year', 'semester')
+        tickers = dict(qs.values_list('market_id', 'ticker'))
+        return Promise.resolve([tickers.get(key) for key in keys])
+
+
+class SeriesLoader(DataLoader):
+    #
+    # Load hourly series of markets with one query per requested range, keys are (market_id, end, hours, source)
+    #
+    def batch_load_fn(self, keys):
+
+        series = dict()
+        for end, hours, source in set(key[1:] for key in keys):
+            ids = set(key[0] for key in keys if key[1:] == (end, hours, source))
+            dts = [end - timedelta(hours=h) for h in reversed(range(hours))]
+
+            if source == 'candles':
+                points = {i: [] for i in ids}
+                for market_id, dt, close, volume in Candle.objects.filter(market_id__in=ids, dt__gte=dts[0],
+                                                                          dt__lte=end
+                                                                          ).order_by('dt').values_list(
+                                                                          'market_id', 'dt', 'close', 'volume'):
+                    points[market_id].append(dict(dt=dt, close=close, last=close, volume=volume))
+
+            else:
+                # Select only the hours of the range from tickers objects
+                strings = [dt.strftime(datetime_directive_ISO_8601) for dt in dts]
+                annotations = {'h{0}'.format(i): KeyTransform(s, 'data') for i, s in enumerate(strings)}
+                tickers = {i: dict() for i in ids}
+                for row in Tickers.objects.filter(market_id__in=ids, year__in={dt.year for dt in dts}
+                                                  ).annotate(**annotations).values('market_id', *annotations):
+                    for i, dt in enumerate(dts):
+                        if row['h{0}'.format(i)]:
+                            tickers[row['market_id']][dt] = row['h{0}'.format(i)]
+
+                points = {i: [dict(dt=dt, bid=t.get('bid'), ask=t.get('ask'), last=t.get('last'),
+                                   volume=t.get('quoteVolume')) for dt, t in sorted(tickers[i].items())] for i in ids}
+
+            for market_id in ids:
+                series[(market_id, end, hours, source)] = points[market_id]
+
+        return Promise.resolve([series[key] for key in keys])
+
+
+# Loaders of a request
+def exchange_loader(info):
+    return get_loader(info, 'exchange', lambda: ModelLoader(Exchange.objects.defer('df', 'data')))
+
+
+def currency_loader(info):
+    return get_loader(info, 'currency', lambda: ModelLoader(Currency.objects.all()))
+
+
+def market_loader(info):
+    return get_loader(info, 'market', lambda: ModelLoader(Market.objects.all()))
+
+
+class ExchangeType(DjangoObjectType):
+    class Meta:
+        model = Exchange
+        fields = ('id', 'exid', 'name', 'status', 'precision_mode', 'rate_limit', 'supported_quotes',
+                  'last_price_update_dt')
+
+
+class CurrencyType(DjangoObjectType):
+    class Meta:
+        model = Currency
+        fields = ('id', 'code', 'name', 'stable_coin')
+
+
+class PointType(graphene.ObjectType):
+    dt = graphene.DateTime()
+    bid = graphene.Float()
+    ask = graphene.Float()
+    last = graphene.Float()
+    close = graphene.Float()
+    volume = graphene.Float()
+
+
+class MarketType(DjangoObjectType):
+    class Meta:
+        model = Market
+        fields = ('id', 'symbol', 'type', 'wallet', 'contract_type', 'status', 'trading', 'maker', 'taker',
+                  'contract_value', 'limits', 'precision')
+
+    exchange = graphene.Field(ExchangeType)
+    base = graphene.Field(CurrencyType)
+    quote = graphene.Field(CurrencyType)
+    latest = graphene.Float(key=graphene.String(default_value='last'))
+    series = graphene.List(PointType,
+                           hours=graphene.Int(default_value=24),
+                           end=graphene.DateTime(),
+                           source=graphene.String(default_value='tickers'))
+
+    def resolve_exchange(self, info):
+        return exchange_loader(info).load(self.exchange_id) if self.exchange_id else None
+
+    def resolve_base(self, info):
+        return currency_loader(info).load(self.base_id) if self.base_id else None
+
+    def resolve_quote(self, info):
+        return currency_loader(info).load(self.quote_id) if self.quote_id else None
+
+    def resolve_latest(self, info, key):
+        loader = get_loader(info, 'latest', LatestTickerLoader)
+        return loader.load(self.id).then(lambda ticker: ticker.get(key) if ticker else None)
+
+    def resolve_series(self, info, hours, source, end=None):
+        end = (end or dt_aware_now(0)).replace(minute=0, second=0, microsecond=0)
+        loader = get_loader(info, 'series', SeriesLoader)
+        return loader.load((self.id, end, min(max(hours, 1), MAX_HOURS), source))
 
 
 class Query(graphene.ObjectType):
-    hello = graphene.String(default_value="Hi!")
+    exchanges = graphene.List(ExchangeType)
+    exchange = graphene.Field(ExchangeType, exid=graphene.String(required=True))
+    currencies = graphene.List(CurrencyType,
+                               exchange=graphene.String(),
+                               first=graphene.Int(default_value=100),
+                               after=graphene.Int())
+    markets = graphene.List(MarketType,
+                            exchange=graphene.String(),
+                            type=graphene.String(),
+                            quote=graphene.String(),
+                            status=graphene.String(),
+                            first=graphene.Int(default_value=100),
+                            after=graphene.Int())
+    market = graphene.Field(MarketType, id=graphene.Int(required=True))
+
+    def resolve_exchanges(self, info):
+        return Exchange.objects.defer('df', 'data').order_by('id')
+
+    def resolve_exchange(self, info, exid):
+        return Exchange.objects.defer('df', 'data').filter(exid=exid).first()
+
+    # Lists are paginated after the id of the last row received
+    def resolve_currencies(self, info, first, exchange=None, after=None):
+        qs = Currency.objects.order_by('id')
+        if exchange:
+            qs = qs.filter(exchange__exid=exchange)
+        if after:
+            qs = qs.filter(id__gt=after)
+        return qs[:min(first, MAX_ROWS)]
 
+    def resolve_markets(self, info, first, exchange=None, type=None, quote=None, status=None, after=None):
+        qs = Market.objects.order_by('id')
+        if exchange:
+            qs = qs.filter(exchange__exid=exchange)
+        if type:
+            qs = qs.filter(type=type)
+        if quote:
+            qs = qs.filter(quote__code=quote)
+        if status:
+            qs = qs.filter(status=status)
+        if after:
+            qs = qs.filter(id__gt=after)
+        return qs[:min(first, MAX_ROWS)]
 
-schema = graphene.Schema(query=Query)
+    def resolve_market(self, info, id):
+        return market_loader(info).load(id)
@@ -1,7 +1,8 @@
 import time
 import structlog
 from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.dispatch import receiver, Signal
+from capital.methods import dt_aware_now
 from marketsdata.models import Exchange
 from trading.models import Account
 from strategy.tasks import bulk_update_strategies
@@ -10,6 +11,9 @@ from billiard.process import current_process
 
 log = structlog.get_logger(__name__)
 
+# Sent when prices of all markets of a strategy are updated for the current hour
+markets_updated = Signal()
+
 
 @task_postrun.connect
 def task_postrun_handler(task_id=None, task=None, args=None, state=None, retval=None, **kwargs):
@@ -26,4 +30,14 @@ def task_postrun_handler(task_id=None, task=None, args=None, state=None, retval=
 
     if task.name == 'Markets_____Update_exchange_prices':
         if state == 'SUCCESS':
-            pass
+
+            from strategy.models import Strategy
+            exchange = Exchange.objects.get(exid=args[0])
+            dt = dt_aware_now(0)
+
+            # Notify subscribers of strategies whose markets are now updated
+            for strategy in Strategy.objects.filter(exchange=exchange, production=True):
+                quotes = Account.objects.filter(strategy=strategy, active=True).values_list('quote', flat=True)
+                for quote in set(quotes):
+                    if exchange.are_strategy_markets_updated(strategy, quote, dt):
+                        markets_updated.send(sender=exchange, strategy_id=strategy.id, quote=quote, dt=dt)
@@ -0,0 +1,622 @@
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from collections import deque, Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+import structlog
+
+log = structlog.get_logger(__name__)
+
+intervals = {'1m': 60, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '4h': 14400, '1d': 86400}
+
+# Request weight of endpoints not weighted 1
+weights = {
+    ('GET', '/api/v3/exchangeInfo'): 10,
+    ('GET', '/fapi/v1/exchangeInfo'): 1,
+    ('GET', '/api/v3/ticker/24hr'): 40,
+    ('GET', '/fapi/v1/ticker/24hr'): 40,
+    ('GET', '/api/v3/account'): 10,
+    ('GET', '/fapi/v2/account'): 5,
+    ('GET', '/fapi/v1/account'): 5,
+    ('GET', '/fapi/v1/positionRisk'): 5,
+    ('GET', '/fapi/v2/positionRisk'): 5,
+    ('GET', '/api/v3/openOrders'): 40,
+    ('GET', '/fapi/v1/openOrders'): 40,
+    ('GET', '/api/v3/order'): 2,
+    ('GET', '/sapi/v1/capital/config/getall'): 10,
+}
+
+
+class SimulatorError(Exception):
+
+    def __init__(self, code, msg, status=400):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+        self.status = status
+
+
+class Simulator:
+    #
+    # In-memory Binance exchange serving spot and USDT-margined perpetual markets
+    #
+    def __init__(self, codes, quotes=('USDT',), balances=None, latency=0, jitter=0, weight_limit=1200,
+                 ban_after=3, ban_seconds=120, fill='instant', fill_ratio=0.5, fill_probability=0.5,
+                 fee=0.001, seed=0):
+
+        self.codes = list(codes)
+        self.quotes = list(quotes)
+        self.latency = latency
+        self.jitter = jitter
+        self.weight_limit = weight_limit
+        self.ban_after = ban_after
+        self.ban_seconds = ban_seconds
+        self.fill = fill
+        self.fill_ratio = fill_ratio
+        self.fill_probability = fill_probability
+        self.fee = fee
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+
+        # Markets
+        self.spot = {code + quote: (code, quote) for code in self.codes for quote in self.quotes}
+        self.futu = {code + 'USDT': (code, 'USDT') for code in self.codes}
+
+        # Account state of each API key
+        self.initial_balances = dict(spot=dict(), future=dict())
+        for wallet, amounts in (balances or dict(spot={q: 100000 for q in self.quotes})).items():
+            self.initial_balances[wallet] = {k: float(v) for k, v in amounts.items()}
+        self.accounts = dict()
+        self.select_account(None)
+        self.order_id = 0
+        self.transfer_id = 0
+        self.calls = Counter()
+
+        # Rate limits
+        self.requests = deque()
+        self.overflows = 0
+        self.banned_until = 0
+
+    ##########
+    # Prices #
+    ##########
+
+    # Return a deterministic price of a base at timestamp (seconds)
+    def get_price(self, code, ts):
+        h = zlib.crc32(code.encode())
+        p0 = 1 + h % 50000
+        phase = (h % 360) * math.pi / 180
+        return p0 * (1 + 0.05 * math.sin(ts / 86400 + phase) + 0.01 * math.sin(ts / 3600 + 2 * phase))
+
+    # Return the price of a symbol at timestamp
+    def get_symbol_price(self, symbol, ts=None):
+        ts = time.time() if ts is None else ts
+        base, quote = self.spot[symbol] if symbol in self.spot else self.futu[symbol]
+        return self.get_price(base, ts) / (1 if quote in ['USDT', 'BUSD'] else self.get_price(quote, ts))
+
+    # Return bid and ask around the last price
+    def get_bid_ask(self, symbol):
+        last = self.get_symbol_price(symbol)
+        return last * 0.9995, last * 1.0005
+
+    # Select balances, positions and orders of an API key
+    def select_account(self, key):
+        if key not in self.accounts:
+            self.accounts[key] = dict(balances={w: dict(b) for w, b in self.initial_balances.items()},
+                                      positions=dict(),
+                                      orders=dict())
+        self.balances = self.accounts[key]['balances']
+        self.positions = self.accounts[key]['positions']
+        self.orders = self.accounts[key]['orders']
+
+    ###############
+    # Rate limits #
+    ###############
+
+    # Return used weight after registering a request, raise when the limit is exceeded
+    def consume_weight(self, method, path, params):
+
+        now = time.time()
+        with self.lock:
+
+            if now < self.banned_until:
+                raise SimulatorError(-1003, 'Way too many requests; IP banned until {0}.'.format(
+                    int(self.banned_until * 1000)), status=418)
+
+            while self.requests and self.requests[0][0] < now - 60:
+                self.requests.popleft()
+
+            weight = weights.get((method, path), 1)
+            if path.endswith('/ticker/24hr') or path.endswith('/openOrders'):
+                if 'symbol' in params:
+                    weight = 1
+
+            used = sum(w for t, w in self.requests) + weight
+            if used > self.weight_limit:
+                self.overflows += 1
+                if self.overflows > self.ban_after:
+                    self.banned_until = now + self.ban_seconds
+                    self.overflows = 0
+                raise SimulatorError(-1003, 'Too many requests; current limit is {0} request weight per 1 MINUTE.'
+                                     .format(self.weight_limit), status=429)
+
+            self.overflows = 0
+            self.requests.append((now, weight))
+            return used
+
+    ############
+    # Dispatch #
+    ############
+
+    # Route a request of an API key and return a JSON-able response
+    def dispatch(self, method, path, params, key=None):
+
+        routes = {
+            ('GET', '/api/v3/ping'): lambda p: dict(),
+            ('GET', '/fapi/v1/ping'): lambda p: dict(),
+            ('GET', '/api/v3/time'): self.get_time,
+            ('GET', '/fapi/v1/time'): self.get_time,
+            ('GET', '/api/v3/exchangeInfo'): self.get_exchange_info_spot,
+            ('GET', '/fapi/v1/exchangeInfo'): self.get_exchange_info_futu,
+            ('GET', '/dapi/v1/exchangeInfo'): lambda p: dict(timezone='UTC', serverTime=self.now(), symbols=[]),
+            ('GET', '/sapi/v1/capital/config/getall'): lambda p: [],
+            ('GET', '/api/v3/ticker/24hr'): lambda p: self.get_tickers(self.spot, p),
+            ('GET', '/fapi/v1/ticker/24hr'): lambda p: self.get_tickers(self.futu, p),
+            ('GET', '/api/v3/klines'): self.get_klines,
+            ('GET', '/fapi/v1/klines'): self.get_klines,
+            ('GET', '/fapi/v1/premiumIndex'): self.get_premium_index,
+            ('GET', '/api/v3/account'): self.get_account_spot,
+            ('GET', '/fapi/v1/account'): self.get_account_futu,
+            ('GET', '/fapi/v2/account'): self.get_account_futu,
+            ('GET', '/fapi/v2/balance'): lambda p: self.get_account_futu(p)['assets'],
+            ('GET', '/fapi/v1/positionRisk'): self.get_position_risk,
+            ('GET', '/fapi/v2/positionRisk'): self.get_position_risk,
+            ('POST', '/api/v3/order'): lambda p: self.create_order('spot', p),
+            ('POST', '/fapi/v1/order'): lambda p: self.create_order('future', p),
+            ('GET', '/api/v3/order'): lambda p: self.fetch_order('spot', p),
+            ('GET', '/fapi/v1/order'): lambda p: self.fetch_order('future', p),
+            ('DELETE', '/api/v3/order'): lambda p: self.cancel_order('spot', p),
+            ('DELETE', '/fapi/v1/order'): lambda p: self.cancel_order('future', p),
+            ('GET', '/api/v3/openOrders'): lambda p: self.fetch_open_orders('spot', p),
+            ('GET', '/fapi/v1/openOrders'): lambda p: self.fetch_open_orders('future', p),
+            ('POST', '/sapi/v1/asset/transfer'): self.transfer,
+            ('POST', '/sapi/v1/futures/transfer'): self.transfer,
+        }
+
+        if (method, path) not in routes:
+            raise SimulatorError(-1000, 'Unsupported endpoint {0} {1}'.format(method, path), status=404)
+
+        with self.lock:
+            self.calls[(method, path)] += 1
+            self.select_account(key)
+            return routes[(method, path)](params)
+
+    def now(self):
+        return int(time.time() * 1000)
+
+    def get_time(self, params):
+        return dict(serverTime=self.now())
+
+    ###############
+    # Market data #
+    ###############
+
+    def get_filters(self, symbol):
+        price = self.get_symbol_price(symbol)
+        tick = 10 ** (math.floor(math.log10(price)) - 4)
+        return [
+            dict(filterType='PRICE_FILTER', minPrice='{0:.8f}'.format(tick), maxPrice='1000000.00000000',
+                 tickSize='{0:.8f}'.format(tick)),
+            dict(filterType='LOT_SIZE', minQty='0.00100000', maxQty='9000000.00000000', stepSize='0.00100000'),
+            dict(filterType='MARKET_LOT_SIZE', minQty='0.00100000', maxQty='9000000.00000000',
+                 stepSize='0.00100000'),
+            dict(filterType='MIN_NOTIONAL', minNotional='10.00000000', notional='5', applyToMarket=True,
+                 avgPriceMins=5),
+        ]
+
+    def get_exchange_info_spot(self, params):
+        symbols = []
+        for symbol, (base, quote) in self.spot.items():
+            symbols.append(dict(symbol=symbol, status='TRADING', baseAsset=base, baseAssetPrecision=8,
+                                quoteAsset=quote, quotePrecision=8, quoteAssetPrecision=8,
+                                baseCommissionPrecision=8, quoteCommissionPrecision=8,
+                                orderTypes=['LIMIT', 'LIMIT_MAKER', 'MARKET'], icebergAllowed=True,
+                                ocoAllowed=True, quoteOrderQtyMarketAllowed=True, isSpotTradingAllowed=True,
+                                isMarginTradingAllowed=False, filters=self.get_filters(symbol),
+                                permissions=['SPOT']))
+        return dict(timezone='UTC', serverTime=self.now(), rateLimits=[], exchangeFilters=[], symbols=symbols)
+
+    def get_exchange_info_futu(self, params):
+        symbols = []
+        for symbol, (base, quote) in self.futu.items():
+            symbols.append(dict(symbol=symbol, pair=symbol, contractType='PERPETUAL',
+                                deliveryDate=4133404800000, onboardDate=1569398400000, status='TRADING',
+                                maintMarginPercent='2.5000', requiredMarginPercent='5.0000', baseAsset=base,
+                                quoteAsset=quote, marginAsset=quote, pricePrecision=4, quantityPrecision=3,
+                                baseAssetPrecision=8, quotePrecision=8, underlyingType='COIN',
+                                underlyingSubType=[], settlePlan=0, triggerProtect='0.0500',
+                                filters=self.get_filters(symbol),
+                                orderTypes=['LIMIT', 'MARKET'], timeInForce=['GTC', 'IOC', 'FOK', 'GTX']))
+        return dict(timezone='UTC', serverTime=self.now(), rateLimits=[], exchangeFilters=[], assets=[],
+                    symbols=symbols)
+
+    def get_ticker(self, symbol):
+        now = time.time()
+        last = self.get_symbol_price(symbol, now)
+        open_ = self.get_symbol_price(symbol, now - 86400)
+        bid, ask = self.get_bid_ask(symbol)
+        volume = 1000000 / last
+        return dict(symbol=symbol, priceChange=str(last - open_), priceChangePercent=str((last / open_ - 1) * 100),
+                    weightedAvgPrice=str((last + open_) / 2), prevClosePrice=str(open_), lastPrice=str(last),
+                    lastQty='1', bidPrice=str(bid), bidQty='10', askPrice=str(ask), askQty='10',
+                    openPrice=str(open_), highPrice=str(max(last, open_)), lowPrice=str(min(last, open_)),
+                    volume=str(volume), quoteVolume=str(volume * last), openTime=int((now - 86400) * 1000),
+                    closeTime=int(now * 1000), firstId=0, lastId=1000, count=1000)
+
+    def get_tickers(self, markets, params):
+        if 'symbol' in params:
+            self.check_symbol(markets, params['symbol'])
+            return self.get_ticker(params['symbol'])
+        return [self.get_ticker(symbol) for symbol in markets]
+
+    def get_klines(self, params):
+
+        symbol = params['symbol']
+        if symbol not in self.spot and symbol not in self.futu:
+            raise SimulatorError(-1121, 'Invalid symbol.')
+
+        step = intervals[params.get('interval', '1h')]
+        limit = min(int(params.get('limit', 500)), 1500)
+        now = int(time.time()) // step * step
+
+        if 'startTime' in params:
+            start = int(params['startTime']) // 1000 // step * step
+        elif 'endTime' in params:
+            start = int(params['endTime']) // 1000 // step * step - (limit - 1) * step
+        else:
+            start = now - (limit - 1) * step
+        end = min(int(params['endTime']) // 1000, now) if 'endTime' in params else now
+
+        klines = []
+        for ts in range(start, end + 1, step):
+            if len(klines) == limit:
+                break
+            op = self.get_symbol_price(symbol, ts)
+            cl = self.get_symbol_price(symbol, ts + step)
+            mid = self.get_symbol_price(symbol, ts + step / 2)
+            volume = 1000000 / op * step / 3600
+            klines.append([ts * 1000, str(op), str(max(op, cl, mid)), str(min(op, cl, mid)), str(cl), str(volume),
+                           (ts + step) * 1000 - 1, str(volume * mid), 100, str(volume / 2), str(volume * mid / 2),
+                           '0'])
+        return klines
+
+    def get_premium_index(self, params):
+
+        def index(symbol):
+            mark = self.get_symbol_price(symbol)
+            funding = 0.0001 * math.sin(time.time() / 28800 + zlib.crc32(symbol.encode()))
+            next_funding = (int(time.time()) // 28800 + 1) * 28800 * 1000
+            return dict(symbol=symbol, markPrice=str(mark), indexPrice=str(mark), estimatedSettlePrice=str(mark),
+                        lastFundingRate=str(funding), interestRate='0.00010000', nextFundingTime=next_funding,
+                        time=self.now())
+
+        if 'symbol' in params:
+            self.check_symbol(self.futu, params['symbol'])
+            return index(params['symbol'])
+        return [index(symbol) for symbol in self.futu]
+
+    def check_symbol(self, markets, symbol):
+        if symbol not in markets:
+            raise SimulatorError(-1121, 'Invalid symbol.')
+
+    ###########
+    # Account #
+    ###########
+
+    def get_account_spot(self, params):
+        self.match_orders()
+        locked = self.get_locked('spot')
+        balances = [dict(asset=code, free=str(amount - locked.get(code, 0)), locked=str(locked.get(code, 0)))
+                    for code, amount in self.balances['spot'].items()]
+        return dict(makerCommission=10, takerCommission=10, buyerCommission=0, sellerCommission=0,
+                    canTrade=True, canWithdraw=True, canDeposit=True, updateTime=self.now(), accountType='SPOT',
+                    balances=balances, permissions=['SPOT'])
+
+    def get_account_futu(self, params):
+        self.match_orders()
+        positions = self.get_position_risk(dict())
+        margin = sum(abs(float(p['notional'])) / int(p['leverage']) for p in positions)
+        pnl = sum(float(p['unRealizedProfit']) for p in positions)
+
+        assets = []
+        for code, amount in self.balances['future'].items():
+            used = margin if code == 'USDT' else 0
+            upnl = pnl if code == 'USDT' else 0
+            assets.append(dict(asset=code, walletBalance=str(amount), unrealizedProfit=str(upnl),
+                               marginBalance=str(amount + upnl), maintMargin='0', initialMargin=str(used),
+                               positionInitialMargin=str(used), openOrderInitialMargin='0', maxWithdrawAmount=str(
+                                   amount - used), crossWalletBalance=str(amount), crossUnPnl=str(upnl),
+                               availableBalance=str(amount + upnl - used), marginAvailable=True,
+                               updateTime=self.now(), balance=str(amount)))
+
+        return dict(feeTier=0, canTrade=True, canDeposit=True, canWithdraw=True, updateTime=0,
+                    totalInitialMargin=str(margin), totalWalletBalance=str(self.balances['future'].get('USDT', 0)),
+                    totalUnrealizedProfit=str(pnl), assets=assets,
+                    positions=[dict(symbol=p['symbol'], initialMargin=str(abs(float(p['notional'])) / 20),
+                                    unrealizedProfit=p['unRealizedProfit'], leverage=p['leverage'],
+                                    isolated=False, entryPrice=p['entryPrice'], positionSide='BOTH',
+                                    positionAmt=p['positionAmt'], notional=p['notional'], updateTime=0)
+                               for p in positions])
+
+    def get_position_risk(self, params):
+        self.match_orders()
+        response = []
+        for symbol in self.futu:
+            if 'symbol' in params and params['symbol'] != symbol:
+                continue
+            amount, entry = self.positions.get(symbol, (0, 0))
+            mark = self.get_symbol_price(symbol)
+            liquidation = entry * (1 - 1 / 20) if amount > 0 else entry * (1 + 1 / 20) if amount < 0 else 0
+            response.append(dict(symbol=symbol, positionAmt=str(amount), entryPrice=str(entry), markPrice=str(mark),
+                                 unRealizedProfit=str((mark - entry) * amount), liquidationPrice=str(liquidation),
+                                 leverage='20', maxNotionalValue='1000000', marginType='cross',
+                                 isolatedMargin='0', isAutoAddMargin='false', positionSide='BOTH',
+                                 notional=str(amount * mark), isolatedWallet='0', updateTime=self.now()))
+        return response
+
+    def get_locked(self, wallet):
+        locked = dict()
+        for order in self.orders.values():
+            if order['wallet'] == wallet and wallet == 'spot' and order['status'] in ['NEW', 'PARTIALLY_FILLED']:
+                base, quote = self.spot[order['symbol']]
+                remaining = order['origQty'] - order['executedQty']
+                if order['side'] == 'BUY':
+                    locked[quote] = locked.get(quote, 0) + remaining * order['price']
+                else:
+                    locked[base] = locked.get(base, 0) + remaining
+        return locked
+
+    def transfer(self, params):
+
+        amount = float(params['amount'])
+        asset = params['asset']
+        if params['type'] in ['MAIN_UMFUTURE', '1']:
+            source, dest = 'spot', 'future'
+        elif params['type'] in ['UMFUTURE_MAIN', '2']:
+            source, dest = 'future', 'spot'
+        else:
+            raise SimulatorError(-1100, 'Illegal characters found in parameter type.')
+
+        if self.balances[source].get(asset, 0) < amount:
+            raise SimulatorError(-5013, 'Asset transfer failed: insufficient balance')
+
+        self.balances[source][asset] -= amount
+        self.balances[dest][asset] = self.balances[dest].get(asset, 0) + amount
+        self.transfer_id += 1
+        return dict(tranId=self.transfer_id)
+
+    ##########
+    # Orders #
+    ##########
+
+    def create_order(self, wallet, params):
+
+        markets = self.spot if wallet == 'spot' else self.futu
+        self.check_symbol(markets, params['symbol'])
+
+        bid, ask = self.get_bid_ask(params['symbol'])
+        quantity = float(params['quantity'])
+        order_type = params['type'].upper()
+        side = params['side'].upper()
+        price = float(params['price']) if order_type == 'LIMIT' else ask if side == 'BUY' else bid
+
+        if wallet == 'spot':
+            base, quote = self.spot[params['symbol']]
+            locked = self.get_locked('spot')
+            code, needed = (quote, quantity * price) if side == 'BUY' else (base, quantity)
+            if self.balances['spot'].get(code, 0) - locked.get(code, 0) < needed:
+                raise SimulatorError(-2010, 'Account has insufficient balance for requested action.')
+
+        self.order_id += 1
+        now = self.now()
+        order = dict(symbol=params['symbol'], orderId=self.order_id,
+                     clientOrderId=params.get('newClientOrderId', 'sim{0}'.format(self.order_id)),
+                     price=price, origQty=quantity, executedQty=0.0, cost=0.0, status='NEW',
+                     timeInForce=params.get('timeInForce', 'GTC'), type=order_type, side=side,
+                     reduceOnly=params.get('reduceOnly', 'false') == 'true', time=now, updateTime=now,
+                     wallet=wallet)
+        self.orders[self.order_id] = order
+
+        # Market orders and crossing limit orders are executed immediately
+        if order_type == 'MARKET' or (side == 'BUY' and price >= ask) or (side == 'SELL' and price <= bid):
+            self.match_order(order, created=True)
+
+        return self.format_order(order)
+
+    # Return an order from orderId or origClientOrderId
+    def get_order(self, wallet, params):
+        for order in self.orders.values():
+            if order['wallet'] == wallet and order['symbol'] == params.get('symbol'):
+                if str(order['orderId']) == str(params.get('orderId')) or \
+                        order['clientOrderId'] == params.get('origClientOrderId'):
+                    return order
+        raise SimulatorError(-2013, 'Order does not exist.')
+
+    def fetch_order(self, wallet, params):
+        order = self.get_order(wallet, params)
+        self.match_order(order)
+        return self.format_order(order)
+
+    def fetch_open_orders(self, wallet, params):
+        self.match_orders()
+        return [self.format_order(order) for order in self.orders.values()
+                if order['wallet'] == wallet and order['status'] in ['NEW', 'PARTIALLY_FILLED']
+                and params.get('symbol', order['symbol']) == order['symbol']]
+
+    def cancel_order(self, wallet, params):
+        order = self.get_order(wallet, params)
+        if order['status'] not in ['NEW', 'PARTIALLY_FILLED']:
+            raise SimulatorError(-2011, 'Unknown order sent.')
+        order['status'] = 'CANCELED'
+        order['updateTime'] = self.now()
+        return self.format_order(order)
+
+    def match_orders(self):
+        for order in self.orders.values():
+            self.match_order(order)
+
+    # Fill an open order according to the fill model
+    def match_order(self, order, created=False):
+
+        if order['status'] not in ['NEW', 'PARTIALLY_FILLED']:
+            return
+
+        if self.fill == 'never' and not created:
+            return
+
+        bid, ask = self.get_bid_ask(order['symbol'])
+        if order['type'] == 'LIMIT':
+            if (order['side'] == 'BUY' and order['price'] < ask) or (order['side'] == 'SELL' and order['price'] > bid):
+                return
+            price = order['price']
+        else:
+            price = ask if order['side'] == 'BUY' else bid
+
+        remaining = order['origQty'] - order['executedQty']
+        if self.fill == 'partial' and order['type'] == 'LIMIT':
+            quantity = remaining * self.fill_ratio if remaining * (1 - self.fill_ratio) >= 0.001 else remaining
+        elif self.fill == 'random' and order['type'] == 'LIMIT':
+            if self.random.random() > self.fill_probability:
+                return
+            quantity = remaining
+        else:
+            quantity = remaining
+
+        self.execute(order, quantity, price)
+
+    # Update order, balances and positions after a fill
+    def execute(self, order, quantity, price):
+
+        order['executedQty'] += quantity
+        order['cost'] += quantity * price
+        order['status'] = 'FILLED' if order['origQty'] - order['executedQty'] < 1e-12 else 'PARTIALLY_FILLED'
+        order['updateTime'] = self.now()
+        sign = 1 if order['side'] == 'BUY' else -1
+
+        if order['wallet'] == 'spot':
+            base, quote = self.spot[order['symbol']]
+            spot = self.balances['spot']
+            if sign > 0:
+                spot[base] = spot.get(base, 0) + quantity * (1 - self.fee)
+                spot[quote] = spot.get(quote, 0) - quantity * price
+            else:
+                spot[base] = spot.get(base, 0) - quantity
+                spot[quote] = spot.get(quote, 0) + quantity * price * (1 - self.fee)
+
+        else:
+            amount, entry = self.positions.get(order['symbol'], (0, 0))
+            new = amount + sign * quantity
+            futu = self.balances['future']
+
+            # Realize profit of the reduced part of a position
+            if amount * sign < 0:
+                closed = min(abs(amount), quantity)
+                futu['USDT'] = futu.get('USDT', 0) + closed * (price - entry) * (1 if amount > 0 else -1)
+
+            if abs(new) < 1e-12:
+                self.positions.pop(order['symbol'], None)
+            elif amount * new <= 0:
+                self.positions[order['symbol']] = (new, price)
+            elif abs(new) > abs(amount):
+                self.positions[order['symbol']] = (new, (entry * abs(amount) + price * quantity) / abs(new))
+            else:
+                self.positions[order['symbol']] = (new, entry)
+
+            futu['USDT'] = futu.get('USDT', 0) - quantity * price * self.fee
+
+    def format_order(self, order):
+        average = order['cost'] / order['executedQty'] if order['executedQty'] else 0
+        response = dict(symbol=order['symbol'], orderId=order['orderId'], clientOrderId=order['clientOrderId'],
+                        price=str(order['price'] if order['type'] == 'LIMIT' else 0), origQty=str(order['origQty']),
+                        executedQty=str(order['executedQty']), status=order['status'],
+                        timeInForce=order['timeInForce'], type=order['type'], side=order['side'],
+                        time=order['time'], updateTime=order['updateTime'], stopPrice='0')
+
+        if order['wallet'] == 'spot':
+            response.update(orderListId=-1, cummulativeQuoteQty=str(order['cost']), transactTime=order['time'],
+                            icebergQty='0', isWorking=True, origQuoteOrderQty='0', fills=[])
+        else:
+            response.update(avgPrice=str(average), cumQuote=str(order['cost']), reduceOnly=order['reduceOnly'],
+                            closePosition=False, positionSide='BOTH', workingType='CONTRACT_PRICE',
+                            priceProtect=False, origType=order['type'])
+        return response
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    #
+    # Serve Binance REST endpoints from a Simulator instance
+    #
+    simulator = None
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def handle_request(self, method):
+
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            params.update(parse_qsl(self.rfile.read(length).decode()))
+
+        simulator = self.simulator
+        if simulator.latency or simulator.jitter:
+            time.sleep(max(0, simulator.latency + simulator.random.uniform(-simulator.jitter,
+                                                                           simulator.jitter)) / 1000)
+
+        headers = dict()
+        try:
+            used = simulator.consume_weight(method, url.path, params)
+            headers['X-MBX-USED-WEIGHT'] = str(used)
+            headers['X-MBX-USED-WEIGHT-1M'] = str(used)
+            status, body = 200, simulator.dispatch(method, url.path, params, self.headers.get('X-MBX-APIKEY'))
+
+        except SimulatorError as e:
+            status, body = e.status, dict(code=e.code, msg=e.msg)
+            if e.status in [418, 429]:
+                headers['Retry-After'] = str(simulator.ban_seconds if e.status == 418 else 60)
+
+        except (KeyError, ValueError) as e:
+            status, body = 400, dict(code=-1102, msg='Mandatory parameter {0} was not sent, was empty/null, '
+                                                     'or malformed.'.format(e))
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+# Return a threaded HTTP server bound to a simulator
+def create_server(simulator, host='127.0.0.1', port=8090):
+    handler = type('Handler', (SimulatorHandler,), dict(simulator=simulator))
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,97 @@
+import math
+from django.db import transaction
+from django.db.models import Q, F, Max, Case, When, Value
+from capital.methods import *
+from marketsdata.models import Candles, Candle
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+# Return Candles objects never expanded or modified since their last expansion
+def get_unsynced(first=None, last=None, exid=None):
+
+    qs = Candles.objects.filter(Q(synced__isnull=True) | Q(synced__lt=F('dt_created')))
+
+    if first is not None:
+        qs = qs.filter(market_id__gte=first)
+    if last is not None:
+        qs = qs.filter(market_id__lte=last)
+    if exid:
+        qs = qs.filter(market__exchange__exid=exid)
+
+    return qs
+
+
+# Split markets with unsynced candles into ranges of market ids
+def get_market_ranges(workers, exid=None):
+
+    ids = sorted(set(get_unsynced(exid=exid).order_by().values_list('market_id', flat=True).distinct()))
+    if not ids:
+        return []
+
+    size = math.ceil(len(ids) / workers)
+    return [(ids[i], ids[min(i + size, len(ids)) - 1]) for i in range(0, len(ids), size)]
+
+
+# Return a Candle object for each OHLCV row after since
+def expand_candles(market_id, exchange_id, data, since=None):
+
+    candles = []
+    for dt_string, op, hi, lo, cl, volume in data:
+        dt = datetime.strptime(dt_string, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=pytz.UTC)
+        if since is None or dt > since:
+            candles.append(Candle(exchange_id=exchange_id, market_id=market_id, dt=dt, close=cl, volume=volume))
+
+    return candles
+
+
+# Stream Candles objects of a market range and insert their rows into Candle
+def sync_range(first=None, last=None, exid=None, batch_size=10000, chunk_size=20, full=False):
+
+    unsynced = get_unsynced(first, last, exid)
+
+    # Only insert rows newer than the latest candle of a market unless a full sync is requested
+    if full:
+        latest = dict()
+    else:
+        latest = dict(Candle.objects.filter(market_id__in=unsynced.order_by().values('market_id')
+                                            ).values('market_id').annotate(dt=Max('dt')).values_list('market_id', 'dt'))
+
+    qs = unsynced.order_by('market_id', 'year', 'semester').values_list('id', 'market_id', 'market__exchange_id',
+                                                                        'dt_created', 'data')
+
+    candles, synced = [], []
+    total = dict(objects=0, candles=0)
+
+    # Insert rows and mark objects as synced with the version that was expanded
+    def flush():
+        with transaction.atomic():
+            Candle.objects.bulk_create(candles, batch_size=batch_size, ignore_conflicts=True)
+            if synced:
+                Candles.objects.filter(pk__in=[pk for pk, dt in synced]
+                                       ).update(synced=Case(*[When(pk=pk, then=Value(dt)) for pk, dt in synced]))
+
+        total['objects'] += len(synced)
+        total['candles'] += len(candles)
+        candles.clear()
+        synced.clear()
+
+    # Server-side cursor on PostgreSQL
+    for pk, market_id, exchange_id, dt_created, data in qs.iterator(chunk_size=chunk_size):
+
+        rows = expand_candles(market_id, exchange_id, data or [], latest.get(market_id))
+        if rows:
+            latest[market_id] = max(c.dt for c in rows)
+
+        candles.extend(rows)
+        synced.append((pk, dt_created))
+
+        if len(candles) >= batch_size or len(synced) >= 1000:
+            flush()
+            log.info('Sync candles in progress', first=first, last=last, **total)
+
+    flush()
+
+    log.info('Sync candles complete', first=first, last=last, **total)
+    return total
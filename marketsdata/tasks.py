@@ -14,8 +14,11 @@ from capital.celery import app
 
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from capital.methods import *
+from capital.queries import ProfiledTask
+from capital.live import publish, get_prices_group
 from marketsdata.methods import *
 from marketsdata.models import Exchange, Market, Currency, Candles, Tickers
+from marketsdata.sync import sync_range, get_market_ranges
 from trading.models import Account
 
 log = structlog.get_logger(__name__)
@@ -29,7 +32,7 @@ config.read('capital/config.ini')
 
 
 # Create a custom task class
-class BaseTaskWithRetry(Task):
+class BaseTaskWithRetry(ProfiledTask):
     autoretry_for = (ccxt.DDoSProtection,
                      ccxt.RateLimitExceeded,
                      ccxt.RequestTimeout,
@@ -246,6 +249,8 @@ def update_prices(self, exid, wallet=None):
     symbols = list(dict.fromkeys(symbols))
 
     insert = 0
+    updated = []
+    prices = dict()
 
     log.info('Insert latest prices and volumes')
 
@@ -284,6 +289,8 @@ def update_prices(self, exid, wallet=None):
             raise Exception('Multiple markets found')
 
         else:
+            updated.append(market.id)
+            prices[symbol] = dic['last']
             try:
                 obj = Tickers.objects.get(year=dt.year, semester=semester, market=market)
 
@@ -302,6 +309,13 @@ def update_prices(self, exid, wallet=None):
                     obj.save()
                     insert += 1
 
+    # Flag markets as updated for the current hour
+    Market.objects.filter(id__in=updated).update(last_price_update_dt=dt)
+
+    # Push latest prices to live dashboards
+    publish(get_prices_group(exid), 'prices', dict(wallet=wallet, dt=dt_string, prices=prices),
+            key='prices_{0}'.format(wallet))
+
     log.info('Update prices complete')
     log.unbind('wallet', 'worker')
 
@@ -894,11 +908,30 @@ def fetch_candle_history(exid):
                                 log.warning('Market not fully update')
                                 del empty
                                 break
+
+        # Keep Candle table consistent with new candles
+        bulk_sync_candles.delay(exid)
+
     else:
 
         log.warning('Exchange {0} is not trading'.format(exchange.exid))
 
 
+# Expand Candles objects of a range of markets into Candle rows
+@app.task(name='Markets_____Sync_candles')
+def sync_candles(first=None, last=None, exid=None, full=False):
+    return sync_range(first, last, exid, full=full)
+
+
+# Sync candles with parallel workers per range of markets
+@app.task(name='Markets_____Bulk_sync_candles')
+def bulk_sync_candles(exid=None, workers=4, full=False):
+    ranges = get_market_ranges(workers, exid)
+    if ranges:
+        log.info('Sync candles of {0} range(s) of markets'.format(len(ranges)), exid=exid)
+        group(sync_candles.s(first, last, exid, full) for first, last in ranges).delay()
+
+
 @shared_task(base=BaseTaskWithRetry)
 def funding(exid):
     from marketsdata.models import Exchange, Market
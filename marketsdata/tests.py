@@ -1,3 +1,82 @@
-from django.test import TestCase
+from datetime import timedelta
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase, RequestFactory
+from capital.methods import *
+from capital.pagination import KeysetPaginator, encode_cursor
+from capital.queries import assert_max_queries
+from capital.schema import schema
+from marketsdata.models import Exchange, Currency, Market, Tickers
 
-# Create your tests here.
+
+class KeysetPaginatorTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Currency.objects.bulk_create([Currency(code='C{0:02d}'.format(i)) for i in range(25)])
+
+    def test_pages(self):
+        paginator = KeysetPaginator(Currency.objects.all(), ('-id',), 10)
+        ids = list(Currency.objects.order_by('-id').values_list('id', flat=True))
+
+        first = paginator.page()
+        self.assertEqual([c.id for c in first], ids[:10])
+        self.assertTrue(first.has_next())
+        self.assertFalse(first.has_previous())
+
+        second = paginator.page(first.next_cursor)
+        self.assertEqual([c.id for c in second], ids[10:20])
+
+        previous = paginator.page(second.previous_cursor, 'previous')
+        self.assertEqual([c.id for c in previous], ids[:10])
+
+        last = paginator.page(second.next_cursor)
+        self.assertEqual([c.id for c in last], ids[20:])
+        self.assertFalse(last.has_next())
+
+    def test_tampered_cursor(self):
+        paginator = KeysetPaginator(Currency.objects.all(), ('-id',), 10)
+        ids = list(Currency.objects.order_by('-id').values_list('id', flat=True))
+        for cursor in [encode_cursor(['x']), encode_cursor([None]), encode_cursor([1, 2]), 'garbage']:
+            self.assertEqual([c.id for c in paginator.page(cursor)], ids[:10])
+
+    def test_page_queries(self):
+        paginator = KeysetPaginator(Currency.objects.all(), ('-id',), 10)
+        cursor = paginator.page().next_cursor
+        with assert_max_queries(1, 'keyset page'):
+            list(paginator.page(cursor))
+
+
+class SchemaTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.exchange = Exchange.objects.create(exid='binance', name='Binance')
+        usdt = Currency.objects.create(code='USDT', stable_coin=True)
+        bases = Currency.objects.bulk_create([Currency(code='C{0:02d}'.format(i)) for i in range(20)])
+        Market.objects.bulk_create([Market(exchange=cls.exchange, type='spot', wallet='spot', base=base, quote=usdt,
+                                           symbol='{0}/USDT'.format(base.code)) for base in bases])
+
+    def execute(self, query):
+        request = RequestFactory().get('/graphql')
+        request.user = AnonymousUser()
+        result = schema.execute(query, context_value=request)
+        self.assertIsNone(result.errors)
+        return result.data
+
+    # Related objects are batched by loaders whatever the number of markets
+    def test_markets_queries(self):
+        with assert_max_queries(4, 'markets'):
+            data = self.execute('{ markets(first: 20) { symbol exchange { exid } base { code } quote { code } '
+                                'latest } }')
+        self.assertEqual(len(data['markets']), 20)
+        self.assertEqual(data['markets'][0]['exchange']['exid'], 'binance')
+
+    # Latest ticker falls back to the previous hour until prices of the current hour are ingested
+    def test_latest_previous_hour(self):
+        market = Market.objects.filter(exchange=self.exchange).first()
+        previous = dt_aware_now(0) - timedelta(hours=1)
+        Tickers.objects.create(market=market, year=previous.year, semester=1 if previous.month <= 6 else 2,
+                               data={previous.strftime(datetime_directive_ISO_8601): dict(last=42.0)})
+
+        data = self.execute('{{ market(id: {0}) {{ latest }} }}'.format(market.id))
+        self.assertEqual(data['market']['latest'], 42.0)
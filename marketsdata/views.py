@@ -3,6 +3,9 @@ from django.shortcuts import render
 from django.template.response import TemplateResponse
 from marketsdata.models import Market, Exchange, Currency
 from django.views import generic
+from django.db.models import Max
+from capital.caching import ConditionalMixin
+from capital.pagination import KeysetPaginationMixin
 
 
 class ExchangeListView(generic.ListView):
@@ -15,24 +18,38 @@ class ExchangeListView(generic.ListView):
         return Exchange.objects.all()
 
 
-class MarketListView(generic.ListView):
+class MarketListView(ConditionalMixin, KeysetPaginationMixin, generic.ListView):
     model = Market
     paginate_by = 10
     context_object_name = 'markets_list'
     template_name = 'marketsdata/markets.html'
+    cache_public = True
+    keyset = ('id',)
+    filters = dict(exchange='exchange__exid', type='type', quote='quote__code', status='status')
+    json_fields = ('id', 'exchange__exid', 'symbol', 'type', 'contract_type', 'base__code', 'quote__code', 'status',
+                   'trading')
 
     def get_queryset(self):
-        return Market.objects.all()
+        return self.filter_queryset(Market.objects.select_related('exchange', 'base', 'quote'
+                                                                  ).defer('exchange__df', 'exchange__data'))
 
+    # Markets change when they are updated and when prices of a new hour are ingested
+    def get_last_modified(self):
+        dts = Market.objects.aggregate(updated=Max('dt_created'), prices=Max('last_price_update_dt'))
+        return max([dt for dt in dts.values() if dt], default=None)
 
-class CurrencyListView(generic.ListView):
+
+class CurrencyListView(KeysetPaginationMixin, generic.ListView):
     model = Currency
     paginate_by = 10
     context_object_name = 'currencies_list'
     template_name = 'marketsdata/currencies.html'
+    keyset = ('id',)
+    filters = dict(exchange='exchange__exid')
+    json_fields = ('id', 'code', 'name', 'stable_coin')
 
     def get_queryset(self):
-        return Currency.objects.all()
+        return self.filter_queryset(Currency.objects.all())
 
 
 # def marketsdata_stats(request):
@@ -1,6 +1,6 @@
 from prettyjson import PrettyJSONWidget
 from django.contrib import admin
-from trading.models import Account, Fund, Position, Order, Asset, Stat
+from trading.models import Account, Fund, Position, Order, Asset, Stat, Metric
 from trading.tasks import *
 import structlog
 from celery import chain, group
@@ -15,6 +15,16 @@ from django.utils.safestring import mark_safe
 log = structlog.get_logger(__name__)
 
 
+# Select objects displayed in changelist rows without the pickled dataframes of accounts and exchanges
+def select_related_light(qs, *fields):
+    pickles = dict(account=['balances'], exchange=['df', 'data'])
+    deferred = []
+    for field in fields:
+        name = field.split('__')[-1]
+        deferred += ['{0}__{1}'.format(field, f) for f in pickles.get(name, [])]
+    return qs.select_related(*fields).defer(*deferred)
+
+
 @admin.register(Account)
 class CustomerAdmin(admin.ModelAdmin):
     list_display = ('name', 'exchange', 'strategy', 'limit_price_tolerance', 'busy', 'quote', 'active',
@@ -26,6 +36,9 @@ class CustomerAdmin(admin.ModelAdmin):
     save_as = True
     save_on_top = True
 
+    def get_queryset(self, request):
+        return select_related_light(super().get_queryset(request), 'exchange', 'strategy')
+
     # Actions
 
     def fetch_assets(self, request, queryset):
@@ -88,6 +101,9 @@ class CustomerAdmin(admin.ModelAdmin):
     )
     save_on_top = True
 
+    def get_queryset(self, request):
+        return select_related_light(super().get_queryset(request), 'account', 'exchange', 'currency')
+
     # Columns
 
     def get_owner(self, obj):
@@ -125,6 +141,24 @@ class CustomerAdmin(admin.ModelAdmin):
     list_display = ('account', 'exchange', 'strategy', 'dt_modified')
     readonly_fields = ('account', 'exchange', 'strategy', 'dt_created', 'dt_modified')
 
+    # Skip the history and the cache of the account page in the changelist
+    def get_queryset(self, request):
+        qs = select_related_light(super().get_queryset(request), 'account', 'exchange', 'strategy')
+        if request.resolver_match and request.resolver_match.url_name.endswith('changelist'):
+            qs = qs.defer('metrics', 'performance')
+        return qs
+
+
+@admin.register(Metric)
+class CustomerAdmin(admin.ModelAdmin):
+    list_display = ('account', 'resolution', 'dt', 'open', 'high', 'low', 'close', 'count')
+    readonly_fields = ('account', 'strategy', 'resolution', 'dt', 'open', 'high', 'low', 'close', 'count',
+                       'dt_modified')
+    list_filter = ('resolution', 'account')
+
+    def get_queryset(self, request):
+        return select_related_light(super().get_queryset(request), 'account')
+
 
 @admin.register(Order)
 class CustomerAdmin(admin.ModelAdmin):
@@ -144,6 +178,9 @@ class CustomerAdmin(admin.ModelAdmin):
         'type',
     )
 
+    def get_queryset(self, request):
+        return select_related_light(super().get_queryset(request), 'account', 'strategy', 'market__exchange')
+
     # Columns
 
     def get_cost(self, obj):
@@ -192,6 +229,9 @@ class CustomerAdmin(admin.ModelAdmin):
         ('market', admin.RelatedOnlyFieldListFilter)
     )
 
+    def get_queryset(self, request):
+        return select_related_light(super().get_queryset(request), 'account', 'exchange', 'market__exchange', 'settlement')
+
     def get_side(self, obj):
         return True if obj.side == 'buy' else False
 
@@ -0,0 +1,231 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from django.db import connections
+from django.db.models import Q
+from marketsdata.models import Market
+from trading.methods import format_decimal_array
+import structlog
+
+log = structlog.get_logger(__name__)
+
+# Backtest and signal of a sweep worker process
+worker = dict()
+
+
+# Return fees, limits and precision of spot and perpetual markets as arrays aligned on codes
+def get_market_arrays(exchange, codes, quote, default_fee=0.001):
+
+    n = len(codes)
+    index = {code: i for i, code in enumerate(codes)}
+    arrays = dict()
+    for wallet in ['spot', 'future']:
+        arrays[wallet] = dict(maker=np.full(n, default_fee),
+                              taker=np.full(n, default_fee),
+                              amount_min=np.zeros(n),
+                              cost_min=np.zeros(n),
+                              cost_max=np.full(n, np.inf),
+                              precision=np.full(n, np.nan),
+                              tradable=np.zeros(n, dtype=bool),
+                              margined_quote=np.zeros(n, dtype=bool)
+                              )
+
+    qs = Market.objects.filter(Q(type='spot') | Q(type='derivative', contract_type='perpetual'),
+                               exchange=exchange,
+                               base__code__in=codes,
+                               quote__code=quote
+                               ).select_related('base', 'margined')
+
+    for market in qs:
+
+        i = index[market.base.code]
+        dic = arrays['spot' if market.type == 'spot' else 'future']
+        limits = market.limits or dict()
+        precision = (market.precision or dict()).get('amount')
+
+        if precision is None:
+            continue
+
+        dic['maker'][i] = default_fee if market.maker is None else market.maker
+        dic['taker'][i] = default_fee if market.taker is None else market.taker
+        dic['amount_min'][i] = limits.get('amount', dict()).get('min') or 0
+        dic['cost_min'][i] = limits.get('cost', dict()).get('min') or 0
+        dic['cost_max'][i] = limits.get('cost', dict()).get('max') or np.inf
+        dic['precision'][i] = precision
+        dic['tradable'][i] = True
+        dic['margined_quote'][i] = bool(market.margined and market.margined.code == quote)
+
+    return arrays
+
+
+# Long the codes with the best trailing return and short the worst, equally weighted
+def momentum_weights(prices, volumes, window=168, top=5, bottom=0, exposure_long=1.0, exposure_short=0.0):
+
+    returns = prices / prices.shift(window) - 1
+    weights = pd.DataFrame(0.0, index=prices.index, columns=prices.columns)
+
+    if top:
+        weights[returns.rank(axis=1, ascending=False) <= top] = exposure_long / top
+    if bottom:
+        weights[returns.rank(axis=1, ascending=True) <= bottom] = -exposure_short / bottom
+
+    return weights
+
+
+class Backtest:
+    #
+    # Hourly rebalances of target weights over price matrices with the rules of the rebalance code
+    #
+    def __init__(self, bid, ask, last, markets, capital=10000, order_type='limit', dust=10, precision_mode=2):
+        self.bid = np.asarray(bid, dtype=float)
+        self.ask = np.asarray(ask, dtype=float)
+        self.last = np.asarray(last, dtype=float)
+        self.markets = markets
+        self.capital = capital
+        self.dust = dust
+        self.precision_mode = precision_mode
+
+        key = 'maker' if order_type == 'limit' else 'taker'
+        self.fees = dict(spot=markets['spot'][key], future=markets['future'][key])
+
+    # Return quantities of valid orders like validate_order()
+    def validate(self, wallet, qty, price, reduce_only=False):
+
+        market = self.markets[wallet]
+
+        # Format decimal, amounts above limit max pass like limit_amount() in validate_order()
+        qty = format_decimal_array(self.precision_mode, market['precision'], np.nan_to_num(qty))
+
+        with np.errstate(invalid='ignore'):
+            valid = market['tradable'] & (qty > 0) & (qty >= market['amount_min']) & np.isfinite(price)
+            cost = qty * price
+            min_notional = (cost >= market['cost_min']) & (cost <= market['cost_max'])
+
+        # Close short below min notional is sent with reduceOnly
+        if reduce_only:
+            min_notional |= market['margined_quote']
+
+        return np.where(valid & min_notional, qty, 0)
+
+    # Return account values and statistics of target weights (T x N array)
+    def run(self, weights):
+
+        weights = np.nan_to_num(np.asarray(weights, dtype=float))
+        hours, n = self.bid.shape
+
+        quote = float(self.capital)
+        long, short, entry = np.zeros(n), np.zeros(n), np.zeros(n)
+        values = np.empty(hours)
+        fees, turnover, orders = 0.0, 0.0, 0
+
+        for t in range(hours):
+
+            bid, ask, last, w = self.bid[t], self.ask[t], self.last[t], weights[t]
+
+            # Account value like assets_value() + positions_pnl()
+            value = quote + np.nansum(long * bid) + np.nansum(short * (entry - last))
+            values[t] = value
+
+            # Target quantities like get_target()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                target = np.nan_to_num(value * w / bid)
+            target_long, target_short = np.maximum(target, 0), np.maximum(-target, 0)
+
+            # Dust outside of targets is dropped like drop_dust_coins()
+            dust = (w == 0) & (np.nan_to_num(long * bid) <= self.dust)
+
+            # Release resources (sell spot, close short)
+            sell = self.validate('spot', np.where(dust, 0, np.maximum(long - target_long, 0)), bid)
+            close = self.validate('future', np.maximum(short - target_short, 0), last,
+                                  reduce_only=True)
+
+            sell_value = np.nansum(sell * bid)
+            close_value = np.nansum(close * last)
+            fee = np.nansum(sell * bid * self.fees['spot']) + np.nansum(close * last * self.fees['future'])
+
+            quote += sell_value + np.nansum(close * (entry - last)) - fee
+            long -= sell
+            short -= close
+            entry[short <= 0] = 0
+
+            fees += fee
+            turnover += sell_value + close_value
+            orders += np.count_nonzero(sell) + np.count_nonzero(close)
+
+            # Allocate free resources (open short, then buy spot) like free_margin()
+            free = quote - np.nansum(short * last)
+
+            need = np.maximum(target_short - short, 0)
+            opened = self.validate('future', need * min(1, self.get_ratio(free, need * last, self.fees['future'])),
+                                   last)
+            open_value = np.nansum(opened * last)
+            fee = np.nansum(opened * last * self.fees['future'])
+
+            with np.errstate(invalid='ignore'):
+                entry = np.where(opened > 0, (entry * short + last * opened) / (short + opened), entry)
+            short += opened
+            quote -= fee
+            free -= open_value + fee
+
+            need = np.maximum(target_long - long, 0)
+            bought = self.validate('spot', need * min(1, self.get_ratio(free, need * ask, self.fees['spot'])), ask)
+            buy_value = np.nansum(bought * ask)
+            fee_buy = np.nansum(bought * ask * self.fees['spot'])
+
+            long += bought
+            quote -= buy_value + fee_buy
+
+            fees += fee + fee_buy
+            turnover += open_value + buy_value
+            orders += np.count_nonzero(opened) + np.count_nonzero(bought)
+
+        return dict(values=values, stats=self.get_stats(values, fees, turnover, orders))
+
+    # Return the ratio of desired order values payable with free resources
+    @staticmethod
+    def get_ratio(free, values, fees):
+        total = np.nansum(values * (1 + fees))
+        return max(0, free) / total if total > 0 else 1
+
+    # Return total return, annualized Sharpe ratio and maximum drawdown of hourly account values
+    def get_stats(self, values, fees, turnover, orders):
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.diff(values) / values[:-1]
+            std = np.nanstd(returns)
+            sharpe = np.nanmean(returns) / std * np.sqrt(24 * 365) if std else 0
+            drawdown = np.nanmin(values / np.maximum.accumulate(values) - 1) if len(values) else 0
+
+        return dict(total_return=round(float(values[-1] / self.capital - 1), 4) if len(values) else 0,
+                    sharpe=round(float(sharpe), 3),
+                    max_drawdown=round(float(drawdown), 4),
+                    fees=round(float(fees), 2),
+                    turnover=round(float(turnover), 2),
+                    orders=int(orders)
+                    )
+
+
+def init_worker(backtest, signal, prices, volumes):
+    worker.update(backtest=backtest, signal=signal, prices=prices, volumes=volumes)
+
+
+def run_worker(params):
+    weights = worker['signal'](worker['prices'], worker['volumes'], **params)
+    return dict(params, **worker['backtest'].run(weights)['stats'])
+
+
+# Backtest a signal with all combinations of a parameters grid in parallel processes
+def sweep(backtest, signal, prices, volumes, grid, processes=None):
+
+    combinations = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    log.info('Sweep {0} parameter set(s)'.format(len(combinations)))
+
+    # Forked processes must not share database connections
+    connections.close_all()
+
+    with ProcessPoolExecutor(max_workers=processes,
+                             initializer=init_worker,
+                             initargs=(backtest, signal, prices, volumes)
+                             ) as executor:
+        return list(executor.map(run_worker, combinations))
@@ -0,0 +1,21 @@
+from channels.db import database_sync_to_async
+from capital.live import LiveConsumer, get_account_group
+from trading.models import Account
+
+
+class AccountConsumer(LiveConsumer):
+    #
+    # Push account value, exposure and order status transitions to the owner of an account
+    #
+    async def get_group(self):
+        user = self.scope.get('user')
+        pk = self.scope['url_route']['kwargs']['pk']
+        if not user or not user.is_authenticated:
+            return None
+
+        owner_id = await database_sync_to_async(
+            lambda: Account.objects.filter(pk=pk).values_list('owner_id', flat=True).first())()
+        if owner_id != user.id and not user.is_superuser:
+            return None
+
+        return get_account_group(pk)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from capital.methods import *
+from trading.models import Stat, Metric
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Copy account values of Stat.metrics into hourly, daily and weekly Metric rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, help='Id of an account (default all accounts)')
+
+    def handle(self, *args, **options):
+
+        stats = Stat.objects.filter(account__isnull=False).select_related('account', 'account__strategy')
+        if options['account']:
+            stats = stats.filter(account_id=options['account'])
+
+        for stat in stats:
+
+            inserted = 0
+            for dt_string, metric in sorted((stat.metrics or dict()).items()):
+                if 'acc_val' in metric:
+                    dt = datetime.strptime(dt_string, datetime_directive_ISO_8601).replace(tzinfo=pytz.UTC)
+                    inserted += Metric.record(stat.account, dt, metric['acc_val'])
+
+            # Rebuild the cache of the account page from the new rows
+            stat.performance = None
+            if stat.update_performance(stat.account.strategy):
+                stat.save(update_fields=['performance'])
+
+            log.info('Backfill metrics of {0} complete'.format(stat.account.name), rows=inserted)
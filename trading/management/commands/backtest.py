@@ -0,0 +1,104 @@
+import json
+from importlib import import_module
+from timeit import default_timer as timer
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from marketsdata.models import Exchange, Market
+from trading.backtest import Backtest, get_market_arrays, sweep
+from trading.replay import load_history, get_timestamp
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+# Return a function from its dotted path
+def get_signal(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)
+
+
+# Return a parameters grid from 'window=24,168;top=3,5'
+def get_grid(string):
+    grid = dict()
+    for item in filter(None, string.split(';')):
+        key, values = item.split('=')
+        grid[key.strip()] = [json.loads(v) for v in values.split(',')]
+    return grid
+
+
+class Command(BaseCommand):
+    help = 'Backtest hourly rebalances of target weights over stored prices, or sweep the parameters of a signal'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exchange', default='binance')
+        parser.add_argument('--quote', default='USDT')
+        parser.add_argument('--codes', help='Comma separated list of codes (default all spot markets of quote)')
+        parser.add_argument('--start', required=True, help='First hour (UTC) e.g. 2021-01-01')
+        parser.add_argument('--end', required=True, help='Last hour (UTC) e.g. 2021-12-31T23:00:00Z')
+        parser.add_argument('--source', default='tickers', choices=['tickers', 'candles'])
+        parser.add_argument('--weights', help='CSV file of target weights indexed by hour (one column per code)')
+        parser.add_argument('--signal', default='trading.backtest.momentum_weights',
+                            help='Dotted path of a function(prices, volumes, **params) returning weights')
+        parser.add_argument('--grid', default='window=24,72,168;top=3,5,10',
+                            help='Parameters of the signal e.g. "window=24,168;top=3,5"')
+        parser.add_argument('--capital', type=float, default=10000)
+        parser.add_argument('--order-type', default='limit', choices=['limit', 'market'])
+        parser.add_argument('--processes', type=int, help='Worker processes of a sweep (default all cores)')
+        parser.add_argument('--output', default='backtest.csv')
+
+    def handle(self, *args, **options):
+
+        exchange = Exchange.objects.get(exid=options['exchange'])
+        quote = options['quote']
+        weights = None
+
+        if options['weights']:
+            weights = pd.read_csv(options['weights'], index_col=0)
+            weights.index = pd.to_datetime(weights.index, utc=True)
+            codes = [c for c in weights.columns if c != quote]
+        elif options['codes']:
+            codes = options['codes'].split(',')
+        else:
+            codes = sorted(set(Market.objects.filter(exchange=exchange, type='spot', quote__code=quote
+                                                     ).values_list('base__code', flat=True)))
+
+        if not codes:
+            raise CommandError('No code to backtest')
+
+        start, end = get_timestamp(options['start']), get_timestamp(options['end'])
+
+        history = load_history(exchange, codes, quote, start, end, options['source'])
+        columns = pd.MultiIndex.from_product([['spot', 'future'], ['bid', 'ask', 'last', 'quoteVolume'], codes])
+        history = history.reindex(columns=columns)
+
+        backtest = Backtest(bid=history['spot']['bid'].values,
+                            ask=history['spot']['ask'].values,
+                            last=history['future']['last'].values,
+                            markets=get_market_arrays(exchange, codes, quote),
+                            capital=options['capital'],
+                            order_type=options['order_type'],
+                            precision_mode=exchange.precision_mode
+                            )
+
+        begin = timer()
+
+        if weights is not None:
+            weights = weights.reindex(index=history.index, columns=codes).ffill()
+            result = backtest.run(weights.values)
+            results = [result['stats']]
+
+            pd.Series(result['values'], index=history.index).to_csv(options['output'].replace('.csv', '_values.csv'))
+
+        else:
+            results = sweep(backtest, get_signal(options['signal']),
+                            history['spot']['last'], history['spot']['quoteVolume'],
+                            get_grid(options['grid']), options['processes'])
+
+        log.info('Backtest of {0} set(s) over {1}h complete in {2}s'.format(len(results), len(history),
+                                                                           round(timer() - begin, 1)))
+
+        df = pd.DataFrame(results).sort_values('sharpe', ascending=False)
+        df.to_csv(options['output'], index=False)
+
+        for row in df.head(10).to_dict('records'):
+            log.info('Backtest result', **row)
@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+from functools import wraps
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.signals import pre_save
+from picklefield.fields import dbsafe_encode
+from marketsdata.benchmark import Benchmark, scratch_database, running_simulator, get_synthetic_codes, \
+    create_synthetic_exchange, seed_history, eager_tasks
+from marketsdata.models import Exchange
+from marketsdata.simulator import Simulator
+from marketsdata.tasks import update_prices
+from trading.methods import get_rebalance_context
+from trading.models import Account
+from trading.tasks import rebalance, update_orders
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+# Return long and short weights of synthetic targets
+def get_synthetic_targets(codes, short_ratio, exposure_long=0.7, exposure_short=0.3):
+    shorts = codes[len(codes) - int(len(codes) * short_ratio):] if short_ratio else []
+    longs = [code for code in codes if code not in shorts]
+    targets = {code: exposure_long / len(longs) for code in longs}
+    targets.update({code: -exposure_short / len(shorts) for code in shorts})
+    return pd.Series(targets, dtype=float)
+
+
+# Queue rebalances triggered by update_orders instead of running them inline
+@contextmanager
+def deferred_rebalances():
+    queue = []
+
+    def delay(*args, **kwargs):
+        queue.append((args, kwargs))
+
+    rebalance.delay = delay
+    try:
+        yield queue
+    finally:
+        del rebalance.delay
+
+
+# Count bytes of pickled balances written by Account.save()
+@contextmanager
+def pickle_counter():
+    written = [0]
+
+    def receiver(sender, instance, **kwargs):
+        if instance.balances is not None:
+            written[0] += len(dbsafe_encode(instance.balances))
+
+    pre_save.connect(receiver, sender=Account, dispatch_uid='benchmark_pickle_counter')
+    try:
+        yield lambda: written[0]
+    finally:
+        pre_save.disconnect(sender=Account, dispatch_uid='benchmark_pickle_counter')
+
+
+# Measure every call of an Account method as a benchmark step
+@contextmanager
+def measured_method(benchmark, name, step, labels):
+    method = getattr(Account, name)
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with benchmark.measure(step, **labels):
+            return method(*args, **kwargs)
+
+    setattr(Account, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(Account, name, method)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the rebalance loop of N accounts x M coins against the local exchange simulator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', default='1,10,50', help='Comma separated list of account counts')
+        parser.add_argument('--coins', default='10,30', help='Comma separated list of coin counts')
+        parser.add_argument('--iterations', type=int, default=5, help='Rebalances per account')
+        parser.add_argument('--short-ratio', type=float, default=0.25, help='Fraction of coins with short targets')
+        parser.add_argument('--capital', type=float, default=100000, help='Initial spot balance in USDT')
+        parser.add_argument('--latency', type=float, default=0, help='Simulator latency in milliseconds')
+        parser.add_argument('--jitter', type=float, default=0, help='Simulator latency jitter in milliseconds')
+        parser.add_argument('--fill', default='partial', choices=['instant', 'partial', 'random', 'never'],
+                            help='Simulator fill model of limit orders')
+        parser.add_argument('--output', default='benchmark_rebalance.json')
+        parser.add_argument('--baseline', help='Previous results file to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Tolerated slowdown versus baseline')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the scratch database between runs')
+
+    def handle(self, *args, **options):
+
+        accounts = [int(i) for i in options['accounts'].split(',')]
+        coins = [int(i) for i in options['coins'].split(',')]
+
+        params = {k: options[k] for k in ['iterations', 'short_ratio', 'capital', 'latency', 'jitter', 'fill']}
+        benchmark = Benchmark('rebalance', params=dict(params, accounts=accounts, coins=coins))
+
+        with scratch_database(options['keepdb']), eager_tasks(), deferred_rebalances() as queue, \
+                pickle_counter() as pickle_bytes:
+
+            benchmark.counters['pickle_bytes'] = pickle_bytes
+
+            for m in coins:
+                for n in accounts:
+                    self.run(benchmark, queue, n, m, options)
+
+        benchmark.save(options['output'])
+
+        for row in benchmark.summary():
+            log.info('{0} p50={1}s p95={2}s p99={3}s queries={4} api={5} pickle={6}B'.format(
+                row['step'], row['seconds_p50'], row['seconds_p95'], row['seconds_p99'], row['queries_p50'],
+                row['api_calls_p50'], row['pickle_bytes_p50']), accounts=row['accounts'], coins=row['coins'])
+
+        if options['baseline']:
+            regressions = benchmark.compare(options['baseline'], options['threshold'])
+            for r in regressions:
+                log.warning('Regression {0}'.format(r['step']), **r)
+            if regressions:
+                raise CommandError('{0} regression(s) versus {1}'.format(len(regressions), options['baseline']))
+
+    def run(self, benchmark, queue, n, m, options):
+
+        labels = dict(accounts=n, coins=m)
+        codes = get_synthetic_codes(m)
+        simulator = Simulator(codes=codes,
+                              quotes=['USDT'],
+                              balances=dict(spot=dict(USDT=options['capital']), future=dict(USDT=0)),
+                              latency=options['latency'],
+                              jitter=options['jitter'],
+                              fill=options['fill'],
+                              weight_limit=10 ** 9)
+
+        benchmark.counters['api_calls'] = lambda: sum(simulator.calls.values())
+
+        with running_simulator(simulator) as url:
+
+            # Exchange with markets and prices of the current hour
+            exchange = create_synthetic_exchange(simulator, url, hours=2)
+            seed_history(exchange, simulator, 2)
+            exchange.load_data(2, codes)
+            for wallet in exchange.get_wallets():
+                update_prices(exchange.exid, wallet)
+
+            accounts = [Account.objects.create(name='Benchmark {0}'.format(i),
+                                               exchange=exchange,
+                                               quote='USDT',
+                                               api_key='benchmark-{0}'.format(i),
+                                               api_secret='benchmark',
+                                               active=True
+                                               ) for i in range(n)]
+
+            targets = get_synthetic_targets(codes, options['short_ratio'])
+
+            with measured_method(benchmark, 'offset_order_filled', 'fill_offset', labels):
+                for iteration in range(options['iterations']):
+
+                    log.info('Iteration {0} with {1} accounts and {2} coins'.format(iteration, n, m))
+                    context = get_rebalance_context(exchange, None, 'USDT', targets=targets)
+
+                    for account in accounts:
+
+                        # Accounts have no strategy, codes are read from the context targets
+                        # so the snapshot is built like create_balances() with the context set
+                        account = Account.objects.get(id=account.id)
+                        account.context = context
+
+                        with benchmark.measure('create_balances', **labels):
+                            account.create_snapshot()
+
+                        with benchmark.measure('get_target', **labels):
+                            account.get_target()
+
+                        with benchmark.measure('calculate_delta', **labels):
+                            account.calculate_delta()
+
+                        with benchmark.measure('rebalance', **labels):
+                            rebalance(account.id, context=context)
+
+                        with benchmark.measure('update_orders', **labels):
+                            update_orders(account.id)
+
+                        # Rebalances triggered by fills
+                        while queue:
+                            args, kwargs = queue.pop(0)
+                            with benchmark.measure('rebalance_after_fill', **labels):
+                                rebalance(*args, context=context, **kwargs)
+
+            Account.objects.filter(exchange=exchange).delete()
+            Exchange.objects.filter(id=exchange.id).delete()
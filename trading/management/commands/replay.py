@@ -0,0 +1,80 @@
+import json
+import logging
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from marketsdata.models import Exchange
+from strategy.models import Strategy
+from trading.models import Stat
+from trading.replay import Replay, StrategyTargets, WeightTargets, get_timestamp
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Replay hourly rebalances of a strategy or of a weights file from stored tickers or candles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exchange', default='binance')
+        parser.add_argument('--strategy', type=int, help='Id of a strategy computing targets from exchange.data')
+        parser.add_argument('--weights', help='CSV file of target weights indexed by hour (one column per code)')
+        parser.add_argument('--quote', default='USDT')
+        parser.add_argument('--start', required=True, help='First hour (UTC) e.g. 2021-01-01')
+        parser.add_argument('--end', required=True, help='Last hour (UTC) e.g. 2021-12-31T23:00:00Z')
+        parser.add_argument('--source', default='tickers', choices=['tickers', 'candles'])
+        parser.add_argument('--lookback', type=int, default=0, help='Hours of exchange.data before the first hour')
+        parser.add_argument('--capital', type=float, default=10000, help='Initial spot balance in quote')
+        parser.add_argument('--fee', type=float, default=0.001, help='Fee rate of a fill')
+        parser.add_argument('--slippage', type=float, default=0, help='Slippage rate of a fill')
+        parser.add_argument('--fill-ratio', type=float, default=1, help='Filled fraction of an order')
+        parser.add_argument('--output', default='replay.json')
+        parser.add_argument('--stat', action='store_true', help='Save account values in a Stat of the strategy')
+        parser.add_argument('--verbose-rebalance', action='store_true', help='Keep logs of the rebalance code')
+
+    def handle(self, *args, **options):
+
+        exchange = Exchange.objects.get(exid=options['exchange'])
+        strategy = None
+
+        if options['strategy']:
+            strategy = Strategy.objects.get(id=options['strategy'])
+            strategy.exchange = exchange
+            codes = strategy.get_codes()
+            targets = StrategyTargets(strategy, options['quote'])
+
+        elif options['weights']:
+            weights = pd.read_csv(options['weights'], index_col=0)
+            weights.index = pd.to_datetime(weights.index, utc=True)
+            codes = [c for c in weights.columns if c != options['quote']]
+            targets = WeightTargets(weights)
+
+        else:
+            raise CommandError('--strategy or --weights is required')
+
+        start, end = get_timestamp(options['start']), get_timestamp(options['end'])
+
+        replay = Replay(exchange, codes, targets,
+                        quote=options['quote'],
+                        strategy=strategy,
+                        capital=options['capital'],
+                        fee=options['fee'],
+                        slippage=options['slippage'],
+                        fill_ratio=options['fill_ratio'],
+                        source=options['source'],
+                        lookback=options['lookback']
+                        )
+
+        # Rebalance code logs every order
+        if not options['verbose_rebalance']:
+            logging.getLogger('trading.models').setLevel(logging.WARNING)
+            logging.getLogger('trading.tasks').setLevel(logging.WARNING)
+
+        metrics = replay.run(start, end)
+
+        with open(options['output'], 'w') as f:
+            json.dump(dict(metrics=metrics, trades=replay.broker.trades), f, indent=2, default=float)
+        log.info('Replay results saved to {0}'.format(options['output']))
+
+        if options['stat']:
+            stat = Stat.objects.create(exchange=exchange, strategy=strategy, metrics=metrics)
+            log.info('Replay account values saved to stat {0}'.format(stat.pk))
@@ -2,7 +2,7 @@ import numpy as np
 
 from capital.methods import *
 from trading.error import *
-from marketsdata.models import Market, Currency
+from marketsdata.models import Market, Currency, Tickers
 from django.utils import timezone
 import structlog
 from datetime import timedelta, datetime
@@ -13,6 +13,8 @@ import itertools
 import random
 
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db.models import Q
+from django.db.models.fields.json import KeyTransform
 
 log = structlog.get_logger(__name__)
 
@@ -26,6 +28,91 @@ def convert_balance(row, wallet, quote):
     return row[wallet] * price
 
 
+# Return strategy targets with quote as stablecoin
+def get_targets(strategy, quote):
+
+    target_pct = strategy.load_targets()
+
+    if quote == 'BUSD':
+        # Set BUSD as strategy stablecoin
+        i = target_pct.index.tolist()
+        i = [quote if x == 'USDT' else x for x in i]
+        target_pct.set_axis(i, inplace=True)
+
+    return target_pct
+
+
+# Create targets, prices and markets dictionary shared by accounts of a strategy
+def get_rebalance_context(exchange, strategy, quote, targets=None):
+
+    if targets is None:
+        targets = get_targets(strategy, quote)
+    codes = [c for c in targets.index.tolist() if c != quote]
+
+    log.info('Create rebalance context for {0} code(s)'.format(len(codes)), quote=quote)
+
+    # Prices
+    spot, futu = exchange.get_latest_prices(codes, quote)
+
+    # Spot and perpetual markets with a single query
+    qs = Market.objects.filter(Q(base__code__in=codes, quote__code=quote) |
+                               Q(base__code=quote, quote__code__in=codes),
+                               Q(type='spot') | Q(type='derivative', contract_type='perpetual'),
+                               exchange=exchange
+                               ).select_related('base', 'quote', 'margined')
+
+    markets = dict(spot=dict(), future=dict())
+    for market in qs:
+
+        flip = market.base.code == quote
+        code = market.quote.code if flip else market.base.code
+        wallet = 'spot' if market.type == 'spot' else 'future'
+
+        # Market with the desired quote has priority over flipped market
+        if flip and code in markets[wallet]:
+            continue
+
+        markets[wallet][code] = dict(id=market.id,
+                                     symbol=market.symbol,
+                                     response_id=market.response['id'] if market.response else None,
+                                     type=market.type,
+                                     wallet=market.wallet,
+                                     limits=market.limits,
+                                     precision=market.precision,
+                                     base=[market.base.id, market.base.code],
+                                     margined=[market.margined.id, market.margined.code] if market.margined else None,
+                                     flip=flip
+                                     )
+
+    return dict(dt=dt_aware_now(0).strftime(datetime_directive_ISO_8601),
+                targets=targets.to_dict(),
+                prices=dict(spot=spot, future=futu),
+                markets=markets
+                )
+
+
+# Return a dictionary of prices of a spot market at hours (ISO 8601 strings) without loading tickers objects
+def get_hourly_prices(exid, symbol, dts, key='last', chunk=500):
+
+    prices = dict()
+    for n in range(0, len(dts), chunk):
+
+        # Select a bounded number of hours per query
+        hours = dts[n:n + chunk]
+        annotations = {'h{0}'.format(i): KeyTransform(key, KeyTransform(dt, 'data')) for i, dt in enumerate(hours)}
+        qs = Tickers.objects.filter(market__symbol=symbol,
+                                    market__type='spot',
+                                    market__exchange__exid=exid,
+                                    year__in=list({int(dt[:4]) for dt in hours})
+                                    ).annotate(**annotations).values(*annotations.keys())
+
+        for row in qs:
+            for i, dt in enumerate(hours):
+                if row['h{0}'.format(i)] is not None:
+                    prices[dt] = row['h{0}'.format(i)]
+    return prices
+
+
 # Format decimal
 def format_decimal(counting_mode, precision, n):
     # Rounding mode
@@ -53,6 +140,24 @@ def format_decimal(counting_mode, precision, n):
                                            ))
 
 
+# Truncate arrays of quantities to the amount precision of markets like format_decimal() in all counting modes
+def format_decimal_array(counting_mode, precision, n):
+    SIGNIFICANT_DIGITS = 3
+    TICK_SIZE = 4
+
+    n = np.asarray(n, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if counting_mode == TICK_SIZE:
+            return np.trunc(n / precision + np.sign(n) * 1e-9) * precision
+
+        # Number of significant digits becomes a number of decimals depending on the magnitude
+        if counting_mode == SIGNIFICANT_DIGITS:
+            precision = precision - np.floor(np.log10(np.abs(n))) - 1
+
+        factor = 10.0 ** precision
+        return np.where(n == 0, 0, np.trunc(n * factor + np.sign(n) * 1e-9) / factor)
+
+
 # Return amount limit min or amount limit max if condition is not satisfy
 def limit_amount(market, amount):
     # Check amount limits
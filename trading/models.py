@@ -1,11 +1,13 @@
 import ccxt
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
-from django.db.models import Q, Avg, Sum
+from django.db.models import Q, F, Avg, Sum, Count, Value
+from django.db.models.functions import Greatest, Least
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
 from capital.methods import *
+from capital.live import publish, get_account_group
 from strategy.models import Strategy
 from marketsdata.models import Exchange, Market, Currency
 from trading.error import *
@@ -27,6 +29,7 @@ import random
 import string
 from gibberish import Gibberish
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
@@ -47,6 +50,7 @@ class Account(models.Model):
     valid_credentials = models.BooleanField(null=True, default=None)
     active = models.BooleanField(null=True, blank=False, default=False)
     busy = models.BooleanField(null=True, blank=False, default=False)
+    rebalance_pending = models.BooleanField(null=True, blank=False, default=False)
     order_type = models.CharField(max_length=10, null=True, choices=(('limit', 'limit'), ('market', 'market')),
                                   default='limit')
     limit_price_tolerance = models.DecimalField(default=0, max_digits=4, decimal_places=3)
@@ -70,6 +74,15 @@ class Account(models.Model):
         null=True
     )
 
+    # Pending amounts of open orders loaded by load_open_orders()
+    open_orders = None
+
+    # Targets, prices and markets shared by accounts of a strategy
+    context = None
+
+    # Virtual hour of a replay
+    clock = None
+
     class Meta:
         verbose_name_plural = "Accounts"
 
@@ -89,17 +102,26 @@ class Account(models.Model):
         #
         log.info('Get assets balance')
 
-        # Reset attribute
-        self.balances = pd.DataFrame()
-        self.save()
-
         client = self.exchange.get_ccxt_client(self)
 
         # Iterate through exchange's wallets
+        responses = dict()
         for wallet in self.exchange.get_wallets():
-
             client.options['defaultType'] = wallet
-            response = client.fetchBalance()
+            responses[wallet] = client.fetchBalance()
+
+        self.set_assets_balances(responses)
+        self.save()
+
+        log.info('Get assets balance complete')
+
+    # Create balances dataframe from fetchBalance responses of each wallet
+    def set_assets_balances(self, responses):
+
+        # Reset attribute
+        self.balances = pd.DataFrame()
+
+        for wallet, response in responses.items():
             for key in ['total', 'free', 'used']:
 
                 # Exclude LBTC from dictionary (staking or earning account)
@@ -122,10 +144,6 @@ class Account(models.Model):
         now = dt.strftime(datetime_directive_s)
         self.balances.index.set_names(now, inplace=True)
 
-        self.save()
-
-        log.info('Get assets balance complete')
-
     # Fetch and update open positions in balances dataframe
     def get_open_positions(self):
 
@@ -136,15 +154,31 @@ class Account(models.Model):
         client.options['defaultType'] = 'future'
 
         #  and query all futures positions
-        response = client.fapiPrivateGetPositionRisk()
+        self.set_open_positions(client.fapiPrivateGetPositionRisk())
+
+        self.save()
+        log.info('Get open positions complete')
+
+    # Insert open positions from a positionRisk response in balances dataframe
+    def set_open_positions(self, response):
+
         opened = [i for i in response if float(i['positionAmt']) != 0]
-        closed = [i for i in response if float(i['positionAmt']) == 0]
 
         if opened:
 
+            if self.has_context():
+                # Select codes from rebalance context
+                codes = {dic['response_id']: code for code, dic in self.context['markets']['future'].items()}
+            else:
+                # Select markets with a single query
+                markets = Market.objects.filter(exchange=self.exchange,
+                                                response__id__in=[p['symbol'] for p in opened],
+                                                type='derivative'
+                                                ).select_related('base')
+                codes = {market.response['id']: market.base.code for market in markets}
+
             for position in opened:
-                market = Market.objects.get(exchange=self.exchange, response__id=position['symbol'], type='derivative')
-                code = market.base.code
+                code = codes[position['symbol']]
 
                 quantity = float(position['positionAmt'])
                 self.balances.loc[code, ('position', 'open', 'quantity')] = quantity
@@ -154,13 +188,118 @@ class Account(models.Model):
                 self.balances.loc[code, ('position', 'open', 'unrealized_pnl')] = float(position['unRealizedProfit'])
                 self.balances.loc[code, ('position', 'open', 'liquidation')] = float(position['liquidationPrice'])
 
+    # Fetch balances of all wallets and open positions concurrently
+    def fetch_snapshot(self):
+
+        # Create one client per request in the main thread without saving the exchange each time
+        wallets = self.exchange.get_wallets()
+        clients = {wallet: self.exchange.get_ccxt_client(self, wallet=wallet, save=False) for wallet in wallets}
+        client_position = self.exchange.get_ccxt_client(self, wallet='future', save=False)
+
+        with ThreadPoolExecutor(max_workers=len(wallets) + 1) as executor:
+            balances = {wallet: executor.submit(client.fetchBalance) for wallet, client in clients.items()}
+            positions = executor.submit(client_position.fapiPrivateGetPositionRisk)
+
+            return {wallet: future.result() for wallet, future in balances.items()}, positions.result()
+
+    # Create balances dataframe in one pass and save it once
+    def create_snapshot(self):
+
+        log.info('Create balances snapshot')
+
+        balances, positions = self.fetch_snapshot()
+
+        self.set_assets_balances(balances)
+        self.set_open_positions(positions)
+
+        # Add missing codes and insert prices
+        self.add_missing_coin()
+        self.set_prices()
+
+        # Calculate assets value
+        self.calculate_assets_value(save=False)
+
+        self.drop_dust_coins(save=False)
+        self.check_columns(save=False)
         self.save()
-        log.info('Get open positions complete')
+        self.publish_ledger()
+
+        log.info('Create balances snapshot complete')
+
+    # Insert bid/ask of spot markets and last price of perpetual markets with a single query
+    def set_prices(self):
+
+        codes = self.balances.index.tolist()
+
+        if self.has_context():
+
+            # Select prices from rebalance context and query missing codes
+            spot = dict(self.context['prices']['spot'])
+            futu = dict(self.context['prices']['future'])
+            missing = [c for c in codes if c not in spot and c != self.quote]
+            if missing:
+                missing_spot, missing_futu = self.exchange.get_latest_prices(missing, self.quote)
+                spot.update(missing_spot)
+                futu.update(missing_futu)
+
+        else:
+            spot, futu = self.exchange.get_latest_prices(codes, self.quote)
+
+        for code in codes:
+            if code == self.quote:
+                bid, ask = 1, 1
+            else:
+                bid, ask = spot.get(code, (np.nan, np.nan))
+
+            self.balances.loc[code, ('price', 'spot', 'bid')] = bid
+            self.balances.loc[code, ('price', 'spot', 'ask')] = ask
+            self.balances.loc[code, ('price', 'future', 'last')] = futu.get(code, np.nan)
+
+    # Return True if a rebalance context of the current hour is set
+    def has_context(self):
+        if self.context:
+            now = self.clock or dt_aware_now(0)
+            return self.context['dt'] == now.strftime(datetime_directive_ISO_8601)
+        else:
+            return False
+
+    # Return a spot or perp market and flip, from rebalance context if possible
+    def get_market(self, wallet, code):
+
+        if self.has_context():
+            if code in self.context['markets'][wallet]:
+                dic = self.context['markets'][wallet][code]
+
+                # Create an unsaved instance to avoid a query
+                market = Market(id=dic['id'],
+                                exchange=self.exchange,
+                                symbol=dic['symbol'],
+                                type=dic['type'],
+                                wallet=dic['wallet'],
+                                limits=dic['limits'],
+                                precision=dic['precision'],
+                                base=Currency(id=dic['base'][0], code=dic['base'][1]),
+                                margined=Currency(id=dic['margined'][0],
+                                                  code=dic['margined'][1]) if dic['margined'] else None
+                                )
+                return market, dic['flip']
+
+        if wallet == 'spot':
+            return self.exchange.get_spot_market(code, self.quote)
+        else:
+            return self.exchange.get_perp_market(code, self.quote)
+
+    # Return codes of the strategy, from rebalance context if possible
+    def get_strategy_codes(self):
+        if self.has_context():
+            return [code for code in self.context['targets'] if code != self.quote]
+        else:
+            return self.strategy.get_codes()
 
     # Check coins of the strategy and quote are present
     def add_missing_coin(self):
 
-        codes = self.strategy.get_codes()
+        codes = self.get_strategy_codes()
         codes.append(self.quote)
         for code in list(set(codes)):
             if code not in self.balances.index.tolist():
@@ -187,7 +326,7 @@ class Account(models.Model):
                     bid, ask = currency.get_latest_price(self.exchange, self.quote, ['bid', 'ask'])
                 except TypeError as e:
                     log.warning('Unable to select spot price of market {0}/{1}'.format(currency.code, self.quote))
-                    if currency.code not in self.strategy.get_codes():
+                    if currency.code not in self.get_strategy_codes():
                         log.info('Asset {0} should be sold by the user in another market'.format(currency.code))
                 else:
                     # Insert prices
@@ -208,7 +347,7 @@ class Account(models.Model):
         self.save()
 
     # Convert quantity in dollar in balances dataframe
-    def calculate_assets_value(self):
+    def calculate_assets_value(self, save=True):
 
         # Iterate through wallets, free, used and total quantities
         for wallet in self.exchange.get_wallets():
@@ -224,10 +363,11 @@ class Account(models.Model):
                     value = price * value
                     self.balances.loc[coin, (wallet, tp, 'value')] = value
 
-        self.save()
+        if save:
+            self.save()
 
     # Drop dust coins
-    def drop_dust_coins(self):
+    def drop_dust_coins(self, save=True):
 
         # Keep assets with more than $10
         nodust = self.balances.loc[:, (['spot', 'future'], 'total', 'value')].sum(axis=1) > 10
@@ -240,22 +380,24 @@ class Account(models.Model):
             posidx = []
 
         # Keep assets from our strategy and quote
-        strat = self.strategy.get_codes()
+        strat = self.get_strategy_codes()
         strat.append(self.quote)
 
         keep = list(set(posidx + nodust + strat))
         self.balances = self.balances.loc[keep, :]
-        self.save()
+        if save:
+            self.save()
 
     # Check and reorder columns
-    def check_columns(self):
+    def check_columns(self, save=True):
         for i in ['total', 'free', 'used']:
             for wallet in ['spot', 'future']:
                 if (wallet, i, 'value') not in self.balances.columns:
                     self.balances[(wallet, i, 'value')] = np.nan
 
         self.balances.sort_index(1, inplace=True)
-        self.save()
+        if save:
+            self.save()
 
     # Return account total value
     def assets_value(self):
@@ -290,19 +432,31 @@ class Account(models.Model):
         else:
             return self.assets_value()
 
+    # Push account value and exposure of codes to live dashboards, not during replays
+    def publish_ledger(self):
+        if self.clock is not None or not isinstance(self.balances, pd.DataFrame):
+            return
+        try:
+            if ('account', 'current', 'percent') in self.balances.columns:
+                exposure = self.balances.account.current.percent.dropna().round(4).to_dict()
+            else:
+                exposure = dict()
+            data = dict(value=round(self.account_value(), 2), exposure=exposure)
+        except Exception as e:
+            log.warning('Unable to publish ledger', exception=str(e))
+        else:
+            transaction.on_commit(lambda: publish(get_account_group(self.pk), 'ledger', data))
+
     # Create columns with targets
     def get_target(self):
 
         try:
 
             # Insert percentage
-            target_pct = self.strategy.load_targets()
-
-            if self.quote == 'BUSD':
-                # Set BUSD as strategy stablecoin
-                i = target_pct.index.tolist()
-                i = [self.quote if x == 'USDT' else x for x in i]
-                target_pct.set_axis(i, inplace=True)
+            if self.has_context():
+                target_pct = pd.Series(self.context['targets'], dtype=float)
+            else:
+                target_pct = get_targets(self.strategy, self.quote)
 
             for coin, pct in target_pct.items():
                 self.balances.loc[coin, ('account', 'target', 'percent')] = pct
@@ -530,10 +684,7 @@ class Account(models.Model):
 
         log.info('Validate order to {0} {1} in {2}'.format(side, code, wallet))
 
-        if wallet == 'spot':
-            market, flip = self.exchange.get_spot_market(code, self.quote)
-        else:
-            market, flip = self.exchange.get_perp_market(code, self.quote)
+        market, flip = self.get_market(wallet, code)
 
         if market:
             # Format decimal
@@ -587,10 +738,7 @@ class Account(models.Model):
     def create_object(self, wallet, code, side, action, qty, price):
 
         # Select market
-        if wallet == 'spot':
-            market, flip = self.exchange.get_spot_market(code, self.quote)
-        elif wallet == 'future':
-            market, flip = self.exchange.get_perp_market(code, self.quote)
+        market, flip = self.get_market(wallet, code)
 
         # Generate order_id
         alphanumeric = 'abcdefghijklmnopqrstuvwABCDEFGHIJKLMNOPQRSTUVWWXYZ01234689'
@@ -665,33 +813,7 @@ class Account(models.Model):
                 log.info('Update order {0}'.format(order.clientid))
                 log.info('------------------')
 
-            # Get traded amount
-            filled_prev = order.filled
-            filled_total = response['filled']
-
-            # Determine new trade
-            if filled_total > filled_prev:
-
-                filled_new = filled_total - filled_prev
-                log.info('> Trade of {0} {1} detected'.format(round(filled_new, 4), order.market.base.code))
-
-                if filled_total < order.amount:
-                    log.info('> Order {0} is partially filled'.format(order.clientid))
-                else:
-                    log.info('> Order {0} is filled'.format(order.clientid))
-
-            else:
-                filled_new = 0
-
-            order.response = response
-            order.status = status
-            order.price = response['price']
-            order.cost = response['cost']
-            order.response = response
-            order.average = response['average']
-            order.fee = response['fee']
-            order.remaining = response['remaining']
-            order.filled = filled_total
+            filled_new = order.set_response(response)
             order.save()
 
             if filled_new:
@@ -701,6 +823,33 @@ class Account(models.Model):
             else:
                 return False, False
 
+    # Update order objects from a dictionary of responses and save them at once
+    def update_order_objects(self, orders, responses):
+
+        updated, trades = [], []
+        for order in orders:
+            if order.orderid in responses:
+
+                filled_new = order.set_response(responses[order.orderid])
+                order.dt_modified = timezone.now()
+                updated.append(order)
+
+                if filled_new:
+                    log.info('> Update status to {0}'.format(order.status))
+                    trades.append((order, filled_new, order.average))
+
+        if updated:
+            Order.objects.bulk_update(updated, ['status', 'price', 'cost', 'response', 'average', 'fee',
+                                                'remaining', 'filled', 'dt_modified'])
+            log.info('Update {0} order object(s)'.format(len(updated)))
+
+            # bulk_update() skips save(), publish fills and cancels here (not during replays)
+            if self.clock is None:
+                for order in updated:
+                    order.publish_transition()
+
+        return trades
+
     # Offset transfer
     def offset_transfer(self, source, destination, amount, transfer_id):
 
@@ -733,6 +882,7 @@ class Account(models.Model):
         # Restore nan
         self.balances.replace(0, np.nan, inplace=True)
         self.save()
+        self.publish_ledger()
 
     # Offset quantity after a trade
     def offset_order_filled(self, clientid, code, action, filled, average):
@@ -860,6 +1010,7 @@ class Account(models.Model):
                 log.info('Delta___ for {0} is now {1}'.format(c, round(dta, 4)))
 
         self.save()
+        self.publish_ledger()
 
     # Offset used resources after an order is opened
     def offset_order_new(self, code, action, qty, val):
@@ -925,9 +1076,90 @@ class Account(models.Model):
     def offset_order_cancelled(self, code, side, qty, val, filled=0):
         pass
 
+    # Load pending amounts of open orders grouped by code, wallet, side and action
+    def load_open_orders(self):
+
+        now = dt_aware_now()
+        start = dt_aware_now(0)
+
+        qs = Order.objects.filter(account=self,
+                                  status__in=['open', 'preparation'],
+                                  dt_created__range=[start, now]
+                                  ).values('market__base__code',
+                                           'market__quote__code',
+                                           'market__wallet',
+                                           'side',
+                                           'action'
+                                           ).annotate(amount=Sum('amount'),
+                                                      price=Sum('price'),
+                                                      count=Count('price', filter=Q(price__gt=0))
+                                                      ).order_by()
+
+        self.open_orders = dict()
+        for row in qs:
+            self.add_open_order(row['market__base__code'], row['market__quote__code'], row['market__wallet'],
+                                row['side'], row['action'], row['amount'], row['price'], row['count'])
+
+        for (code, wallet, side, action), entry in self.open_orders.items():
+            log.info('Found open orders to {0} {1} {2} in {3}'.format(action.replace('_', ' '),
+                                                                     round(entry['amount'], 4), code, wallet))
+
+    # Add an open order to the pending amounts
+    def add_open_order(self, base, quote, wallet, side, action, amount, price, count=1):
+
+        # Determine code and flip from market
+        if quote == self.quote:
+            code, flip = base, False
+        elif base == self.quote:
+            code, flip = quote, True
+        else:
+            return
+
+        key = (code, wallet, side, action)
+        if key not in self.open_orders:
+            self.open_orders[key] = dict(amount=0, price=0, count=0, flip=flip)
+
+        self.open_orders[key]['amount'] += amount if amount else 0
+
+        # Average price only counts orders with a price
+        if price:
+            self.open_orders[key]['price'] += price
+            self.open_orders[key]['count'] += count
+
+    # Add a newly placed order to the pending amounts if it's still open
+    def track_open_order(self, clientid):
+
+        if self.open_orders is None:
+            return
+
+        order = Order.objects.select_related('market__base', 'market__quote').filter(account=self,
+                                                                                      clientid=clientid
+                                                                                      ).last()
+        if order and order.status in ['open', 'preparation']:
+            self.add_open_order(order.market.base.code, order.market.quote.code, order.market.wallet,
+                                order.side, order.action, order.amount, order.price)
+
+    # Return pending amount from loaded open orders
+    def get_pending_amount(self, code, wallet, side, action):
+
+        entry = self.open_orders.get((code, wallet, side, action))
+        if not entry or not entry['amount']:
+            return 0
+
+        if entry['flip']:
+            if not entry['price'] or not entry['count']:
+                log.warning('Unable to convert pending amount of {0} without order price'.format(code))
+                return 0
+            return entry['amount'] / (entry['price'] / entry['count'])
+        else:
+            return entry['amount']
+
     # Return sum of open orders size
     def get_open_orders_spot(self, code, side, action):
 
+        if self.open_orders is not None:
+            return self.get_pending_amount(code, 'spot', side, action)
+
         now = dt_aware_now()
         start = dt_aware_now(0)
 
@@ -965,6 +1197,9 @@ class Account(models.Model):
     # Return sum of open orders size
     def get_open_orders_futu(self, code, side, action):
 
+        if self.open_orders is not None:
+            return self.get_pending_amount(code, 'future', side, action)
+
         now = dt_aware_now()
         start = dt_aware_now(0)
 
@@ -1001,30 +1236,21 @@ class Account(models.Model):
 
     # Return True if all markets needed to synchronize the account are update
     def is_tradable(self):
+        return self.exchange.are_strategy_markets_updated(self.strategy, self.quote)
 
-        symbols_long = [c + '/' + self.quote for c in self.strategy.get_codes_long()]
-        symbols_short = [c + '/' + self.quote for c in self.strategy.get_codes_short()]
-        update = []
-
-        for symbol in symbols_long:
-            market = Market.objects.get(exchange=self.exchange,
-                                        symbol=symbol,
-                                        type='spot'
-                                        )
-            update.append(market.is_updated())
-
-        for symbol in symbols_short:
-            market = Market.objects.get(exchange=self.exchange,
-                                        symbol=symbol,
-                                        type='derivative',
-                                        contract_type='perpetual'
-                                        )
-            update.append(market.is_updated())
-
-        if False in update:
-            return False
-        else:
-            return True
+
+class ReplayAccount(Account):
+    #
+    # Account of a replay, balances are kept in memory and never written to the database
+    #
+    class Meta:
+        proxy = True
+
+    def save(self, *args, **kwargs):
+        pass
+
+    def refresh_from_db(self, *args, **kwargs):
+        pass
 
 
 class Asset(models.Model):
@@ -1107,13 +1333,34 @@ class Order(models.Model):
 
     class Meta:
         verbose_name_plural = "Orders"
+        indexes = [models.Index(fields=['account', '-id']), models.Index(fields=['account', 'dt_modified'])]
+
+    # Remember the status loaded from the database to detect transitions
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.status_loaded = instance.__dict__.get('status')
+        return instance
 
     def save(self, *args, **kwargs):
         if not self.pk:
             self.dt_created = timezone.now()
 
         self.dt_modified = timezone.now()
-        return super(Order, self).save(*args, **kwargs)
+        result = super(Order, self).save(*args, **kwargs)
+
+        self.publish_transition()
+        return result
+
+    # Push a status transition to live dashboards once the transaction is committed
+    def publish_transition(self):
+        if self.account_id and self.status != getattr(self, 'status_loaded', None):
+            self.status_loaded = self.status
+            data = dict(id=self.pk, clientid=self.clientid, market_id=self.market_id, status=self.status,
+                        side=self.side, action=self.action, amount=self.amount, filled=self.filled,
+                        average=self.average, dt_modified=self.dt_modified.strftime(datetime_directive_ISO_8601))
+            group, key = get_account_group(self.account_id), 'order_{0}'.format(self.pk)
+            transaction.on_commit(lambda: publish(group, 'order', data, key=key))
 
     def __str__(self):
         if self.clientid:
@@ -1121,6 +1368,38 @@ class Order(models.Model):
         else:
             return str(self.pk)
 
+    # Set fields from an exchange response and return new traded quantity
+    def set_response(self, response):
+
+        # Get traded amount
+        filled_prev = self.filled if self.filled else 0
+        filled_total = response['filled']
+
+        # Determine new trade
+        if filled_total > filled_prev:
+
+            filled_new = filled_total - filled_prev
+            log.info('> Trade of {0} {1} detected'.format(round(filled_new, 4), self.market.base.code))
+
+            if filled_total < self.amount:
+                log.info('> Order {0} is partially filled'.format(self.clientid))
+            else:
+                log.info('> Order {0} is filled'.format(self.clientid))
+
+        else:
+            filled_new = 0
+
+        self.response = response
+        self.status = response['status'].lower()
+        self.price = response['price']
+        self.cost = response['cost']
+        self.average = response['average']
+        self.fee = response['fee']
+        self.remaining = response['remaining']
+        self.filled = filled_total
+
+        return filled_new
+
 
 class Position(models.Model):
     objects = models.Manager()
@@ -1161,6 +1440,7 @@ class Stat(models.Model):
     exchange = models.ForeignKey(Exchange, on_delete=models.CASCADE, related_name='stats', null=True)
     strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='stats', null=True)
     metrics = models.JSONField(null=True)
+    performance = models.JSONField(null=True, blank=True)
     dt_created = models.DateTimeField(null=True)
     dt_modified = models.DateTimeField(null=True)
 
@@ -1175,3 +1455,138 @@ class Stat(models.Model):
             self.dt_created = timezone.now()
         self.dt_modified = timezone.now()
         return super(Stat, self).save(*args, **kwargs)
+
+    # Append hourly metrics newer than the cache to the series of the account and benchmarks, then
+    # recalculate cumulative returns and the table of returns displayed by the account page
+    def update_performance(self, strategy=None, hours=7 * 24):
+
+        cache = self.performance or dict(dt=None, index=[], account=[], btc=[], eth=[], strategy=[])
+        series = Metric.get_series(self.account, '1h', start=cache['dt'], exclude_start=True).tail(hours)
+        new = series.index.strftime(datetime_directive_ISO_8601).tolist()
+
+        if new:
+            btc = get_hourly_prices('binance', 'BTC/USDT', new)
+            eth = get_hourly_prices('binance', 'ETH/USDT', new)
+
+            cache['index'] += new
+            cache['account'] += series.tolist()
+            cache['btc'] += [btc.get(dt) for dt in new]
+            cache['eth'] += [eth.get(dt) for dt in new]
+            cache['strategy'] += [None] * len(new)
+
+        # Fill new hours and trailing hours cached before the strategy return was available
+        filled = False
+        if strategy is not None and strategy.returns is not None:
+            missing = 0
+            while missing < len(cache['strategy']) and cache['strategy'][-missing - 1] is None:
+                missing += 1
+            if missing:
+                returns = strategy.returns['Returns'].reindex(pd.to_datetime(cache['index'][-missing:]))
+                returns = [None if pd.isna(v) else v for v in returns.tolist()]
+                filled = any(v is not None for v in returns)
+                cache['strategy'][-missing:] = returns
+
+        if not new and not filled:
+            return False
+
+        for key in ['index', 'account', 'btc', 'eth', 'strategy']:
+            cache[key] = cache[key][-hours:]
+
+        df = pd.DataFrame({key: cache[key] for key in ['account', 'btc', 'eth', 'strategy']},
+                          index=pd.to_datetime(cache['index'])).astype(float)
+        df[['btc', 'eth']] = df[['btc', 'eth']].ffill()
+
+        # Calculate hourly and cumulative returns
+        ret = df[['account', 'btc', 'eth']].pct_change(1)
+        lines = ((1 + ret).cumprod() - 1).fillna(0) * 100
+        strateg = df['strategy'].copy()
+        strateg.iloc[0] = 0
+        lines['strategy'] = ((1 + strateg).cumprod() - 1) * 100
+
+        # Data for the table
+        acc_1h = round(ret['account'], 2).dropna()[::-1].tolist()
+        acc_24h = round(df['account'].pct_change(24) * 100, 2)[::-1].tolist()
+        acc_7d = round(df['account'].pct_change(24 * 7) * 100, 2)[::-1].tolist()
+        dt = ret[::-1].index.strftime(datetime_directive_s).tolist()
+
+        def clean(values):
+            return [None if pd.isna(v) else v for v in values]
+
+        cache['lines'] = {key: clean(lines[key].tolist()) for key in lines.columns}
+        cache['returns'] = [{"Datetime": c0, "ret_1h": c1, "ret_24h": c2, "ret_7d": c3}
+                            for c0, c1, c2, c3 in zip(dt, clean(acc_1h), clean(acc_24h), clean(acc_7d))]
+        cache['strategy'] = clean(cache['strategy'])
+        cache['dt'] = cache['index'][-1]
+
+        self.performance = cache
+        return True
+
+
+class Metric(models.Model):
+    objects = models.Manager()
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='metrics')
+    strategy = models.ForeignKey(Strategy, on_delete=models.SET_NULL, related_name='metrics', null=True)
+    resolution = models.CharField(max_length=2, choices=[('1h', 'Hour'), ('1d', 'Day'), ('1w', 'Week')])
+    dt = models.DateTimeField()  # start of the period
+    open, high, low, close = [models.FloatField(null=True) for i in range(4)]
+    count = models.IntegerField(default=1)  # hours aggregated
+    dt_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Metrics"
+        unique_together = ['account', 'resolution', 'dt']
+        ordering = ['dt']
+        get_latest_by = 'dt'
+
+    def __str__(self):
+        return str(self.pk)
+
+    # Return the start of the daily and weekly periods of an hour
+    @staticmethod
+    def get_periods(dt):
+        day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        return {'1h': dt.replace(minute=0, second=0, microsecond=0),
+                '1d': day,
+                '1w': day - timedelta(days=day.weekday())}
+
+    # Insert the account value of an hour and update daily and weekly rollups with a constant number of queries
+    @classmethod
+    def record(cls, account, dt, value):
+
+        periods = cls.get_periods(dt)
+
+        with transaction.atomic():
+            hour, created = cls.objects.get_or_create(account=account, resolution='1h', dt=periods['1h'],
+                                                      defaults=dict(strategy=account.strategy, open=value, high=value,
+                                                                    low=value, close=value))
+            if not created:
+                return False
+
+            for resolution in ['1d', '1w']:
+                obj, created = cls.objects.get_or_create(account=account, resolution=resolution,
+                                                         dt=periods[resolution],
+                                                         defaults=dict(strategy=account.strategy, open=value,
+                                                                       high=value, low=value, close=value))
+                if not created:
+                    cls.objects.filter(pk=obj.pk).update(high=Greatest('high', Value(value)),
+                                                         low=Least('low', Value(value)),
+                                                         close=value,
+                                                         count=F('count') + 1)
+        return True
+
+    # Return a series of account values (close) at a resolution between two datetimes or ISO 8601 strings
+    @classmethod
+    def get_series(cls, account, resolution='1h', start=None, end=None, exclude_start=False):
+
+        qs = cls.objects.filter(account=account, resolution=resolution)
+        if isinstance(start, str):
+            start = datetime.strptime(start, datetime_directive_ISO_8601).replace(tzinfo=pytz.UTC)
+        if isinstance(end, str):
+            end = datetime.strptime(end, datetime_directive_ISO_8601).replace(tzinfo=pytz.UTC)
+        if start:
+            qs = qs.filter(dt__gt=start) if exclude_start else qs.filter(dt__gte=start)
+        if end:
+            qs = qs.filter(dt__lte=end)
+
+        rows = list(qs.order_by('dt').values_list('dt', 'close'))
+        return pd.Series([v for dt, v in rows], index=pd.DatetimeIndex([dt for dt, v in rows]), dtype=float)
@@ -0,0 +1,295 @@
+from datetime import timedelta
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+from django.db.models import Q
+from capital.methods import *
+from marketsdata.models import Tickers, Candles
+from trading.methods import get_targets, get_rebalance_context
+from trading.models import ReplayAccount
+from trading.tasks import allocate
+import structlog
+
+log = structlog.get_logger(__name__)
+
+
+# Return an aware timestamp in UTC from a date string
+def get_timestamp(string):
+    dt = pd.Timestamp(string)
+    return dt.tz_localize('UTC') if dt.tzinfo is None else dt.tz_convert('UTC')
+
+
+# Return hourly bid, ask, last and quote volume of spot and perpetual markets from stored tickers or candles
+def load_history(exchange, codes, quote, start, end, source='tickers'):
+
+    log.info('Load {0} history of {1} code(s)'.format(source, len(codes)))
+
+    model = Tickers if source == 'tickers' else Candles
+    qs = model.objects.filter(Q(market__type='spot') | Q(market__type='derivative',
+                                                         market__contract_type='perpetual'),
+                              market__exchange=exchange,
+                              market__base__code__in=codes,
+                              market__quote__code=quote,
+                              year__in=get_list_years(start, end)
+                              ).values_list('market__type', 'market__base__code', 'data')
+
+    columns = dict()
+    for market_type, code, data in qs.iterator():
+        wallet = 'spot' if market_type == 'spot' else 'future'
+
+        if source == 'tickers':
+            for dt, ticker in data.items():
+                for field in ['bid', 'ask', 'last', 'quoteVolume']:
+                    columns.setdefault((wallet, field, code), dict())[dt] = ticker.get(field)
+
+        else:
+            # Price of an hour is the open of its candle
+            for dt, op, hi, lo, cl, volume in data:
+                for field, value in [('bid', op), ('ask', op), ('last', op), ('quoteVolume', volume * op)]:
+                    columns.setdefault((wallet, field, code), dict())[dt] = value
+
+    df = pd.DataFrame(columns, dtype=float)
+    df.index = pd.to_datetime(df.index, format=datetime_directive_ISO_8601, utc=True)
+    df = df.sort_index().sort_index(axis=1)
+
+    # Forward fill missing hours
+    index = pd.date_range(start, end, freq='H')
+    df = df[~df.index.duplicated(keep='last')].reindex(index).ffill()
+
+    log.info('History ready with {0}h for {1} code(s)'.format(len(df), len(codes)))
+    return df
+
+
+class StrategyTargets:
+    #
+    # Targets of a strategy computed from exchange.data of the virtual hour
+    #
+    def __init__(self, strategy, quote):
+        self.strategy = strategy
+        self.quote = quote
+
+    def __call__(self, dt, data):
+        self.strategy.exchange.data = data
+        return get_targets(self.strategy, self.quote)
+
+
+class WeightTargets:
+    #
+    # Targets from a dataframe of weights indexed by hour
+    #
+    def __init__(self, weights):
+        self.weights = weights.sort_index()
+
+    def __call__(self, dt, data):
+        weights = self.weights.loc[:dt]
+        if weights.empty:
+            return pd.Series(dtype=float)
+        return weights.iloc[-1].dropna()
+
+
+class SimulatedBroker:
+    #
+    # Fill orders of a replay at the prices of the virtual hour and keep wallets and positions
+    #
+    def __init__(self, quote, capital, fee=0.001, slippage=0, fill_ratio=1):
+        self.quote = quote
+        self.fee = fee
+        self.slippage = slippage
+        self.fill_ratio = fill_ratio
+        self.wallets = dict(spot={quote: capital}, future={quote: 0})
+        self.positions = dict()
+        self.entries = dict()
+        self.trades = []
+        self.context = None
+
+    # Return fetchBalance responses of each wallet and a positionRisk response
+    def fetch_snapshot(self):
+
+        responses = dict()
+        for wallet, assets in self.wallets.items():
+            total = {code: qty for code, qty in assets.items() if qty > 0}
+            used = dict()
+            if wallet == 'future':
+                margin = sum(abs(qty) * self.get_price('future', code) for code, qty in self.positions.items())
+                used[self.quote] = min(margin, total.get(self.quote, 0))
+            free = {code: qty - used.get(code, 0) for code, qty in total.items()}
+            responses[wallet] = dict(total=total, free=free, used=used)
+
+        positions = []
+        for code, qty in self.positions.items():
+            market = self.context['markets']['future'].get(code)
+            price = self.get_price('future', code)
+            if market and market['response_id'] and qty and not np.isnan(price):
+                positions.append(dict(symbol=market['response_id'],
+                                      positionAmt=qty,
+                                      markPrice=price,
+                                      leverage=1,
+                                      unRealizedProfit=(price - self.entries[code]) * qty,
+                                      liquidationPrice=0
+                                      ))
+        return responses, positions
+
+    # Return bid, ask or last price of a code in the context
+    def get_price(self, wallet, code, side=None):
+        if wallet == 'spot':
+            bid, ask = self.context['prices']['spot'].get(code, (np.nan, np.nan))
+            return ask if side == 'buy' else bid
+        else:
+            return self.context['prices']['future'].get(code, np.nan)
+
+    # Update a signed position and return realized PnL
+    def trade_position(self, code, qty, price):
+
+        position = self.positions.get(code, 0)
+        pnl = 0
+
+        if position and np.sign(position) != np.sign(qty):
+            closed = min(abs(qty), abs(position)) * np.sign(position)
+            pnl = (price - self.entries[code]) * closed
+            position -= closed
+            qty += closed
+
+        if qty:
+            entry = self.entries.get(code, price) if position else price
+            self.entries[code] = (entry * position + price * qty) / (position + qty)
+            position += qty
+
+        if position:
+            self.positions[code] = position
+        else:
+            self.positions.pop(code, None)
+            self.entries.pop(code, None)
+
+        return pnl
+
+    def order(self, account, wallet, code, side, action, qty, price, reduce_only=False):
+
+        filled = qty * self.fill_ratio
+        average = self.get_price(wallet, code, side)
+        if np.isnan(average) or not filled:
+            return
+
+        average *= 1 + self.slippage if side == 'buy' else 1 - self.slippage
+        cost = filled * average
+        fee = cost * self.fee
+
+        spot, futu = self.wallets['spot'], self.wallets['future']
+        if wallet == 'spot':
+            if side == 'buy':
+                spot[code] = spot.get(code, 0) + filled
+                spot[self.quote] -= cost + fee
+            else:
+                spot[code] = spot.get(code, 0) - filled
+                spot[self.quote] += cost - fee
+        else:
+            pnl = self.trade_position(code, filled if side == 'buy' else -filled, average)
+            futu[self.quote] += pnl - fee
+
+        clientid = 'replay{0}'.format(len(self.trades))
+        self.trades.append(dict(dt=self.context['dt'], clientid=clientid, code=code, wallet=wallet, side=side,
+                                action=action, filled=filled, average=average, fee=fee))
+
+        # Offset balances like update_orders() does after a trade
+        account.offset_order_filled(clientid, code, action, filled, average)
+
+    # Return True if the transfer succeeded
+    def transfer(self, account, source, destination, amount):
+
+        amount = min(amount, self.wallets[source].get(self.quote, 0))
+        if amount > 1:
+            self.wallets[source][self.quote] -= amount
+            self.wallets[destination][self.quote] = self.wallets[destination].get(self.quote, 0) + amount
+            account.offset_transfer(source, destination, amount, 'replay')
+            return True
+        return False
+
+
+class Replay:
+    #
+    # Advance a virtual clock hour by hour and rebalance an in-memory account with the production planning code
+    #
+    def __init__(self, exchange, codes, targets, quote='USDT', strategy=None, capital=10000, fee=0.001,
+                 slippage=0, fill_ratio=1, source='tickers', lookback=0):
+        self.exchange = exchange
+        self.codes = codes
+        self.targets = targets
+        self.quote = quote
+        self.strategy = strategy
+        self.broker = SimulatedBroker(quote, capital, fee, slippage, fill_ratio)
+        self.source = source
+        self.lookback = lookback
+        self.metrics = dict()
+
+    # Return an account value series in the Stat.metrics format
+    def run(self, start, end):
+
+        history = load_history(self.exchange, self.codes, self.quote,
+                               start - timedelta(hours=self.lookback), end, self.source)
+
+        # exchange.data like update_dataframe()
+        columns = pd.MultiIndex.from_product([['spot'], ['last', 'quoteVolume'], self.codes])
+        data = history.reindex(columns=columns)['spot'].dropna(axis=1, how='all')
+
+        # Markets of all codes with a single query
+        markets = get_rebalance_context(self.exchange, self.strategy, self.quote,
+                                        targets=pd.Series({code: 0 for code in self.codes}))['markets']
+
+        account = ReplayAccount(name='Replay', exchange=self.exchange, strategy=self.strategy, quote=self.quote)
+
+        # Prices of all codes (NaN if not listed) to avoid database lookups
+        columns = pd.MultiIndex.from_product([['spot', 'future'], ['bid', 'ask', 'last'], self.codes])
+        prices = history.reindex(columns=columns)
+
+        begin = timer()
+        index = history.loc[start:end].index
+        for dt in index:
+
+            row = prices.loc[dt]
+            spot = dict(zip(self.codes, zip(row['spot']['bid'].tolist(), row['spot']['ask'].tolist())))
+            futu = dict(zip(self.codes, row['future']['last'].tolist()))
+
+            targets = self.targets(dt, data.loc[:dt])
+
+            account.clock = dt
+            account.context = self.broker.context = dict(dt=dt.strftime(datetime_directive_ISO_8601),
+                                                         targets=targets.to_dict(),
+                                                         prices=dict(spot=spot, future=futu),
+                                                         markets=markets
+                                                         )
+
+            value = self.step(account)
+            self.metrics[account.context['dt']] = dict(acc_val=round(value, 1))
+
+        elapsed = timer() - begin
+        log.info('Replay of {0}h complete in {1}s'.format(len(index), round(elapsed, 1)),
+                 trades=len(self.broker.trades))
+
+        return self.metrics
+
+    # Rebalance the account at the virtual hour and return its value before trading
+    def step(self, account):
+
+        balances, positions = self.broker.fetch_snapshot()
+        account.set_assets_balances(balances)
+        account.set_open_positions(positions)
+
+        account.add_missing_coin()
+        account.set_prices()
+        account.calculate_assets_value(save=False)
+        account.drop_dust_coins(save=False)
+        account.check_columns(save=False)
+
+        value = account.account_value()
+
+        account.get_target()
+        account.calculate_delta()
+
+        # Orders are filled or cancelled within the hour
+        account.open_orders = dict()
+        allocate(account, self.broker)
+
+        return value
+
+    # Return the account value series
+    def to_series(self):
+        return json_to_df(self.metrics)['acc_val']
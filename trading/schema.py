@@ -0,0 +1,105 @@
+import graphene
+from graphene_django import DjangoObjectType
+from promise import Promise
+from promise.dataloader import DataLoader
+from capital.graphql import get_loader, GroupLoader
+from marketsdata.schema import ExchangeType, MarketType, exchange_loader, market_loader, MAX_ROWS
+from trading.models import Account, Order, Position
+
+# Orders of an account a query can request
+MAX_ORDERS = 100
+
+
+class OrderLoader(DataLoader):
+    #
+    # Load the latest orders of accounts with one query per (first, status), keys are (account_id, first, status)
+    #
+    def batch_load_fn(self, keys):
+
+        orders = dict()
+        for first, status in set(key[1:] for key in keys):
+            ids = sorted(set(key[0] for key in keys if key[1:] == (first, status)))
+
+            # Number orders of each account newest first and keep the first rows
+            sql = '''SELECT * FROM (SELECT o.*, row_number() OVER (PARTITION BY o.account_id ORDER BY o.id DESC) AS rn
+                     FROM {0} o WHERE o.account_id = ANY(%s){1}) t
+                     WHERE t.rn <= %s ORDER BY t.account_id, t.id DESC'''.format(Order._meta.db_table,
+                                                                                 ' AND o.status = %s' if status else '')
+            params = [ids] + ([status] if status else []) + [first]
+
+            groups = {i: [] for i in ids}
+            for order in Order.objects.raw(sql, params):
+                groups[order.account_id].append(order)
+
+            for account_id in ids:
+                orders[(account_id, first, status)] = groups[account_id]
+
+        return Promise.resolve([orders[key] for key in keys])
+
+
+class OrderType(DjangoObjectType):
+    class Meta:
+        model = Order
+        fields = ('id', 'clientid', 'orderid', 'status', 'type', 'side', 'action', 'amount', 'price', 'average',
+                  'cost', 'filled', 'remaining', 'dt_created', 'dt_modified')
+
+    market = graphene.Field(MarketType)
+
+    def resolve_market(self, info):
+        return market_loader(info).load(self.market_id) if self.market_id else None
+
+
+class PositionType(DjangoObjectType):
+    class Meta:
+        model = Position
+        fields = ('id', 'side', 'size', 'entry_price', 'last', 'liquidation_price', 'notional_value',
+                  'initial_margin', 'unrealized_pnl', 'realized_pnl', 'margin_mode', 'leverage', 'dt_modified')
+
+    market = graphene.Field(MarketType)
+
+    def resolve_market(self, info):
+        return market_loader(info).load(self.market_id) if self.market_id else None
+
+
+class AccountType(DjangoObjectType):
+    class Meta:
+        model = Account
+        fields = ('id', 'name', 'pseudonym', 'quote', 'active', 'order_type', 'dt_modified')
+
+    exchange = graphene.Field(ExchangeType)
+    orders = graphene.List(OrderType, first=graphene.Int(default_value=20), status=graphene.String())
+    positions = graphene.List(PositionType)
+
+    def resolve_exchange(self, info):
+        return exchange_loader(info).load(self.exchange_id) if self.exchange_id else None
+
+    def resolve_orders(self, info, first, status=None):
+        loader = get_loader(info, 'orders', OrderLoader)
+        return loader.load((self.id, min(max(first, 1), MAX_ORDERS), status))
+
+    def resolve_positions(self, info):
+        loader = get_loader(info, 'positions', lambda: GroupLoader(Position.objects.order_by('id'), 'account_id'))
+        return loader.load(self.id)
+
+
+# Return accounts visible by the user of a request
+def get_accounts(info):
+    user = info.context.user
+    qs = Account.objects.defer('balances').order_by('id')
+    if not user.is_authenticated:
+        return qs.none()
+    return qs if user.is_superuser else qs.filter(owner=user)
+
+
+class Query(graphene.ObjectType):
+    accounts = graphene.List(AccountType, active=graphene.Boolean(), first=graphene.Int(default_value=100))
+    account = graphene.Field(AccountType, id=graphene.Int(required=True))
+
+    def resolve_accounts(self, info, first, active=None):
+        qs = get_accounts(info)
+        if active is not None:
+            qs = qs.filter(active=active)
+        return qs[:min(first, MAX_ROWS)]
+
+    def resolve_account(self, info, id):
+        return get_accounts(info).filter(id=id).first()
@@ -3,6 +3,7 @@ from django.db.backends.signals import connection_created
 from django.dispatch import receiver
 
 import marketsdata.tasks
+from marketsdata.signals import markets_updated
 from trading.models import Account
 from trading.tasks import *
 from celery.signals import task_success, task_postrun, task_failure
@@ -66,3 +67,18 @@ def task_failure_notifier(sender=None, task_id=None, args=None, exception=None,
 @receiver(pre_delete, sender=Order)
 def cancel_order(sender, instance, **kwargs):
     pass
+
+
+@receiver(markets_updated)
+def markets_updated_handler(sender, strategy_id=None, quote=None, **kwargs):
+
+    # Rebalance accounts waiting for these markets
+    accounts = Account.objects.filter(exchange=sender,
+                                      strategy__id=strategy_id,
+                                      quote=quote,
+                                      active=True,
+                                      rebalance_pending=True
+                                      )
+    for account in accounts:
+        log.info('Markets updated, release account', account=account.name)
+        release_pending_rebalance(account.id)
@@ -23,9 +23,10 @@ from billiard.process import current_process
 from capital.celery import app
 from capital.error import *
 from capital.methods import *
+from capital.queries import query_budget, ProfiledTask
 from marketsdata.models import Market, Currency, Exchange
 from trading.methods import *
-from trading.models import Account, Order, Fund, Position, Asset, Stat
+from trading.models import Account, Order, Fund, Position, Asset, Stat, Metric
 import threading
 import random
 import math
@@ -33,7 +34,7 @@ import math
 log = structlog.get_logger(__name__)
 
 
-class BaseTaskWithRetry(Task):
+class BaseTaskWithRetry(ProfiledTask):
     autoretry_for = (ccxt.DDoSProtection,
                      ccxt.RateLimitExceeded,
                      ccxt.RequestTimeout,
@@ -77,14 +78,39 @@ def bulk_prepare_accounts():
 # Bulk rebalance assets of all accounts
 @app.task(name='Trading_Bulk_rebalance_accounts')
 def bulk_rebalance(strategy_id, reload=False):
-    accounts = Account.objects.filter(strategy__id=strategy_id, active=True)
+    accounts = Account.objects.filter(strategy__id=strategy_id, active=True).select_related('exchange', 'strategy')
+
+    # Check markets and create context once per exchange and quote
+    tradable, contexts = dict(), dict()
     for account in accounts:
 
-        while not account.is_tradable():
+        key = (account.exchange_id, account.quote)
+        if key not in tradable:
+            tradable[key] = account.is_tradable()
+
+        if tradable[key]:
+            if key not in contexts:
+                contexts[key] = get_rebalance_context(account.exchange, account.strategy, account.quote)
+
+            rebalance.delay(account.id, reload, context=contexts[key])
+
+        else:
+            # Account is released by markets_updated signal
             log.warning('Wait {0} markets update before sync. the account'.format(account.quote))
-            time.sleep(0.1)
+            Account.objects.filter(id=account.id).update(rebalance_pending=True)
 
-        rebalance.delay(account.id, reload)
+            # Markets could have been updated in the meantime
+            if account.is_tradable():
+                release_pending_rebalance(account.id)
+
+
+# Rebalance an account that was waiting for markets update
+def release_pending_rebalance(account_id):
+
+    # Clear flag atomically so that the account is rebalanced once. Balances
+    # are fetched again because the account waited for the markets update.
+    if Account.objects.filter(id=account_id, rebalance_pending=True).update(rebalance_pending=False):
+        rebalance.delay(account_id, reload=True)
 
 
 # Bulk update stats
@@ -199,22 +225,8 @@ def create_balances(self, account_id):
     if self.request.id:
         log.bind(worker=current_process().index)
 
-    # Fetch account
-    account.get_assets_balances()
-    account.get_open_positions()
-
-    # Add missing codes
-    account.add_missing_coin()
-
-    # Fetch prices
-    account.get_spot_prices()
-    account.get_futu_prices()
-
-    # Calculate assets value
-    account.calculate_assets_value()
-
-    account.drop_dust_coins()
-    account.check_columns()
+    # Fetch account and prices and create dataframe in one pass
+    account.create_snapshot()
 
 
 # Create or update stats object
@@ -259,32 +271,27 @@ def update_metrics(account_id):
     log.bind(account=account.name)
 
     try:
-        stat = Stat.objects.get(account=account, exchange=account.exchange, strategy=account.strategy)
+        stat = Stat.objects.defer('metrics').get(account=account, exchange=account.exchange,
+                                                 strategy=account.strategy)
 
     except ObjectDoesNotExist:
         stat = Stat.objects.create(account=account, exchange=account.exchange, strategy=account.strategy)
 
     finally:
 
-        dt = dt_aware_now(0).strftime(datetime_directive_ISO_8601)
-
-        if not isinstance(stat.metrics, dict):
-            stat.metrics = dict()
-
         assets = round(account.assets_value(), 1)
         positions = round(account.positions_pnl(), 1)
         account_value = round(assets + positions, 1)
 
-        if dt not in stat.metrics:
-            stat.metrics[dt] = dict(acc_val=account_value)
+        # Append hourly row and update daily and weekly rollups
+        if Metric.record(account, dt_aware_now(0), account_value):
+            log.info("Metric 'acc_val' updated")
         else:
-            if 'acc_val' not in stat.metrics[dt]:
-                stat.metrics[dt]['acc_val'] = account_value
-            else:
-                log.info("Metric 'acc_val' is already in the dictionary")
+            log.info("Metric 'acc_val' is already recorded")
 
-        log.info("Metric 'acc_val' updated")
-        stat.save()
+        # Refresh the cache of the account page
+        if stat.update_performance(account.strategy):
+            stat.save(update_fields=['performance', 'dt_modified'])
         log.unbind('account')
 
 
@@ -327,9 +334,10 @@ def stats_benchmark(account_id):
 
 # Rebalance fund of an account
 @app.task(bind=True, name='Trading_____Rebalance_account')
-def rebalance(self, account_id, reload=False, release=True):
+def rebalance(self, account_id, reload=False, release=True, context=None):
     #
     account = Account.objects.get(id=account_id)
+    account.context = context
 
     # Mark the account as busy to avoid concurrent
     # rebalancing after a new trade is detected
@@ -354,19 +362,21 @@ def rebalance(self, account_id, reload=False, release=True):
     account.add_missing_coin()
 
     # Update prices
-    account.get_spot_prices(update=True)
-    account.get_futu_prices(update=True)
+    account.set_prices()
 
     # Re-calculate assets value
-    account.calculate_assets_value()
+    account.calculate_assets_value(save=False)
 
-    account.drop_dust_coins()
+    account.drop_dust_coins(save=False)
     account.check_columns()
 
     # Calculate new delta
     account.get_target()
     account.calculate_delta()
 
+    # Load pending amounts of open orders
+    account.load_open_orders()
+
     log.info(' ')
     log.info('Account')
     log.info('*******')
@@ -425,6 +435,22 @@ def rebalance(self, account_id, reload=False, release=True):
         log.info('Delta qty for {0}: {1}'.format(coin, round(val, 4)))
     log.info('---------------------------')
 
+    # Place orders
+    allocate(account, ExchangeBroker(), release)
+
+    log.info(' ')
+    log.info('Synchronization complete for {0}'.format(account.name))
+
+    log.info('Set busy=False')
+    log.unbind('account')
+
+    account.busy = False
+    account.save()
+
+
+# Release and allocate resources of an account with orders and transfers placed by a broker
+def allocate(account, broker, release=True):
+    #
     if release:
 
         # Release resources
@@ -460,9 +486,7 @@ def rebalance(self, account_id, reload=False, release=True):
                 # Format decimal and validate order
                 valid, qty, reduce_only = account.validate_order('spot', 'sell', code, qty, price, 'sell_spot')
                 if valid:
-                    # Create object, place order and apply offset
-                    clientid = account.create_object('spot', code, 'sell', 'sell_spot', qty, price)
-                    send_create_order(account.id, clientid, 'sell_spot', 'sell', 'spot', code, qty, reduce_only)
+                    broker.order(account, 'spot', code, 'sell', 'sell_spot', qty, price, reduce_only)
 
                 # Refresh obj
                 account.refresh_from_db()
@@ -499,9 +523,7 @@ def rebalance(self, account_id, reload=False, release=True):
                     # Format decimal and validate order
                     valid, qty, reduce_only = account.validate_order('future', 'buy', code, qty, price, 'close_short')
                     if valid:
-                        # Create object and place order
-                        clientid = account.create_object('future', code, 'buy', 'close_short', qty, price)
-                        send_create_order(account.id, clientid, 'close_short', 'buy', 'future', code, qty, reduce_only)
+                        broker.order(account, 'future', code, 'buy', 'close_short', qty, price, reduce_only)
 
                     account.refresh_from_db()
                 log.unbind('action')
@@ -542,11 +564,9 @@ def rebalance(self, account_id, reload=False, release=True):
             if val < desired_val:
 
                 amount = min(desired_val - val, account.balances.spot.free.quantity[account.quote])
-                transfer_id = send_transfer(account.id, 'spot', 'future', amount)
-                if transfer_id:
-                    log.info('Order value after transfer is {0} {1}'.format(round(val, 1), account.quote))
-                    account.offset_transfer('spot', 'future', amount, transfer_id)
+                if broker.transfer(account, 'spot', 'future', amount):
                     val += amount
+                    log.info('Order value after transfer is {0} {1}'.format(round(val, 1), account.quote))
 
             # Determine quantity from available resources
             qty = math.floor(val) / price
@@ -555,9 +575,7 @@ def rebalance(self, account_id, reload=False, release=True):
             # Format decimal and validate order
             valid, qty, reduce_only = account.validate_order('future', 'sell', code, qty, price, 'open_short')
             if valid:
-                # Create object and place order
-                clientid = account.create_object('future', code, 'sell', 'open_short', qty, price)
-                send_create_order(account.id, clientid, 'open_short', 'sell', 'future', code, qty)
+                broker.order(account, 'future', code, 'sell', 'open_short', qty, price, reduce_only)
 
             account.refresh_from_db()
         log.unbind('action')
@@ -602,9 +620,7 @@ def rebalance(self, account_id, reload=False, release=True):
                 free_margin = account.free_margin()
                 log.info('Free margin in future is {0} {1}'.format(round(free_margin, 1), account.quote))
                 amount = min(desired_val - val, account.free_margin())
-                transfer_id = send_transfer(account.id, 'future', 'spot', amount)
-                if transfer_id:
-                    account.offset_transfer('future', 'spot', amount, transfer_id)
+                if broker.transfer(account, 'future', 'spot', amount):
                     val += amount
                     log.info('Order value after transfer is {0} {1}'.format(round(val, 1), account.quote))
 
@@ -615,83 +631,99 @@ def rebalance(self, account_id, reload=False, release=True):
             # Format decimal and validate order
             valid, qty, reduce_only = account.validate_order('spot', 'buy', code, qty, price, 'buy_spot')
             if valid:
-                # Create object and place order
-                clientid = account.create_object('spot', code, 'buy', 'buy_spot', qty, price)
-                send_create_order(account.id, clientid, 'buy_spot', 'buy', 'spot', code, qty, reduce_only)
+                broker.order(account, 'spot', code, 'buy', 'buy_spot', qty, price, reduce_only)
 
             account.refresh_from_db()
         log.unbind('action')
 
-    log.info(' ')
-    log.info('Synchronization complete for {0}'.format(account.name))
 
-    log.info('Set busy=False')
-    log.unbind('account')
+class ExchangeBroker:
+    #
+    # Create order objects, place orders and transfers on the exchange
+    #
+    def order(self, account, wallet, code, side, action, qty, price, reduce_only=False):
+        clientid = account.create_object(wallet, code, side, action, qty, price)
+        send_create_order(account.id, clientid, action, side, wallet, code, qty, reduce_only)
+        account.track_open_order(clientid)
 
-    account.busy = False
-    account.save()
+    # Return True if the transfer succeeded
+    def transfer(self, account, source, destination, amount):
+        transfer_id = send_transfer(account.id, source, destination, amount)
+        if transfer_id:
+            account.offset_transfer(source, destination, amount, transfer_id)
+            return True
+        return False
 
 
 # Update open orders of an account
 @app.task(bind=True, name='Trading_____Update_orders')
+@query_budget(30)
 def update_orders(self, account_id):
     #
     account = Account.objects.get(id=account_id)
-    orders = Order.objects.filter(account=account, status__in=['open', 'unknown'])
+    orders = Order.objects.filter(account=account,
+                                  status__in=['open', 'unknown'],
+                                  orderid__isnull=False
+                                  ).select_related('market', 'market__base')
 
     if self.request.id:
         log.bind(worker=current_process().index)
-    # log.info('Update order of {0}'.format(account.name))
 
-    if orders.exists():
-        for order in orders:
+    if not orders.exists():
+        return
+
+    # Fetch open orders of each wallet with a single call
+    orders = list(orders)
+    responses = send_fetch_open_orders(account_id, list(set(order.market.wallet for order in orders)))
+
+    # Fetch orders that are no longer open (filled, canceled or expired)
+    client = account.exchange.get_ccxt_client(account)
+    for order in orders:
+        if order.orderid not in responses:
 
             log.bind(clientid=order.clientid)
-            # log.info('Update order {0}'.format(order.clientid))
+            client.options['defaultType'] = order.market.wallet
 
             try:
-                response = send_fetch_orderid(account_id, order.orderid)
+                response = client.fetchOrder(id=order.orderid, symbol=order.market.symbol)
             except ccxt.OrderNotFound:
                 log.error('Update order {0} failed. Order not found'.format(order.clientid))
-
+            except Exception as e:
+                log.error('Unknown exception when fetching order {}'.format(order.clientid), e=str(e))
             else:
                 if response:
+                    responses[order.orderid] = response
+                else:
+                    log.error('fetchOrder() failed, exchange replied with None for order {0}'.format(order.clientid))
 
-                    account.refresh_from_db()
-                    filled, average = account.update_order_object(order.market.wallet, response)
+            log.unbind('clientid')
 
-                    if filled:
+    # Update objects in bulk
+    trades = account.update_order_objects(orders, responses)
 
-                        log.info('Trade detected {0}'.format(order.clientid))
+    if trades:
 
-                        # Offset trade when account is not busy
-                        code = order.market.base.code
-                        account.offset_order_filled(order.clientid, code, order.action, filled, average)
+        account.refresh_from_db()
+        for order, filled, average in trades:
 
-                        t = 0
-                        while account.busy:
+            log.info('Trade detected {0}'.format(order.clientid))
 
-                            account.refresh_from_db()
-                            log.info('Account {0} is busy...'.format(account.name))
-                            time.sleep(1)
+            # Offset trade when account is not busy
+            account.offset_order_filled(order.clientid, order.market.base.code, order.action, filled, average)
 
-                            t += 1
-                            if t > 10:
-                                raise Exception('Account {0} is busy after more than 10s'.format(account.name))
+        t = 0
+        while account.busy:
 
-                        log.info('Sync. account after a trade')
-                        rebalance.delay(account_id, reload=False)
-                    else:
-                        pass
-                        # log.info('Update order {0} done. No trade'.format(order.clientid))
-                else:
-                    log.error('fetchOrder() failed, exchange replied with None for order {0}'.format(order.clientid))
+            account.refresh_from_db()
+            log.info('Account {0} is busy...'.format(account.name))
+            time.sleep(1)
 
-        # log.info('Open order update complete in account {0}'.format(account.name))
+            t += 1
+            if t > 10:
+                raise Exception('Account {0} is busy after more than 10s'.format(account.name))
 
-    else:
-        pass
-        # log.info('Open order not found in account {0}'.format(account.name))
+        log.info('Sync. account after a trade')
+        rebalance.delay(account_id, reload=False)
 
 
 # Check an account credential
@@ -761,6 +793,7 @@ def market_close(account_id):
 
 # Fetch assets
 @app.task(base=BaseTaskWithRetry, name='Trading_____Fetch_assets')
+@query_budget(60)
 def fetch_assets(account_id, wallet=None):
     #
     account = Account.objects.get(id=account_id)
@@ -784,23 +817,31 @@ def fetch_assets(account_id, wallet=None):
 
     assets_value = account.assets_value()
 
+    # Select currencies, assets and prices with a single query each
+    currencies = {c.code: c for c in Currency.objects.filter(code__in=lst_total)}
+    assets = {a.currency_id: a for a in Asset.objects.filter(exchange=account.exchange,
+                                                              account=account,
+                                                              wallet=wallet)}
+    prices, _ = account.exchange.get_latest_prices(lst_total, account.quote, key='last')
+
     # Update objects
     for k, v in total.items():
-        try:
-            currency = Currency.objects.get(code=k)
-        except ObjectDoesNotExist:
+        if k not in currencies:
             log.error('Can not create new asset, code {0} not in database'.format(k))
         else:
 
-            price = currency.get_latest_price(exchange=account.exchange, quote=account.quote, key='last')
+            currency = currencies[k]
+            if k == account.quote:
+                price = 1
+            elif k in prices:
+                price = prices[k]
+            else:
+                log.error('No price found for {0}'.format(k))
+                price = 0
 
-            try:
-                obj = Asset.objects.get(currency=currency,
-                                        exchange=account.exchange,
-                                        account=account,
-                                        wallet=wallet
-                                        )
-            except ObjectDoesNotExist:
+            if currency.id in assets:
+                obj = assets[currency.id]
+            else:
                 log.info('Create new asset {0}'.format(currency.code))
                 obj = Asset.objects.create(currency=currency,
                                            exchange=account.exchange,
@@ -808,24 +849,23 @@ def fetch_assets(account_id, wallet=None):
                                            wallet=wallet
                                            )
 
-            finally:
-                obj.total = v
-                obj.total_value = round(v * price, 1)
-                if assets_value:
-                    obj.weight = round((v * price) / assets_value, 3)
+            obj.total = v
+            obj.total_value = round(v * price, 1)
+            if assets_value:
+                obj.weight = round((v * price) / assets_value, 3)
 
-                if k in free.keys():
-                    obj.free = free[k]
-                else:
-                    obj.free = 0
+            if k in free.keys():
+                obj.free = free[k]
+            else:
+                obj.free = 0
 
-                if k in used.keys():
-                    obj.used = used[k]
-                else:
-                    obj.used = 0
+            if k in used.keys():
+                obj.used = used[k]
+            else:
+                obj.used = 0
 
-                obj.dt_returned = response['datetime']
-                obj.save()
+            obj.dt_returned = response['datetime']
+            obj.save()
 
     log.unbind('account')
 
@@ -1111,6 +1151,26 @@ def send_fetch_orderid(self, account_id, order_id):
         return response
 
 
+# Fetch open orders of an account wallets and return a dictionary keyed by orderid
+@app.task(base=BaseTaskWithRetry, name='Trading_____Send_fetch_open_orders')
+def send_fetch_open_orders(account_id, wallets=None):
+    account = Account.objects.get(id=account_id)
+    client = account.exchange.get_ccxt_client(account)
+    client.options["warnOnFetchOpenOrdersWithoutSymbol"] = False
+
+    if not wallets:
+        wallets = account.exchange.get_wallets()
+
+    responses = dict()
+    for wallet in wallets:
+        client.options['defaultType'] = wallet
+        for response in client.fetchOpenOrders():
+            responses[response['id']] = response
+
+    log.info('Found {0} open order(s) in {1} wallet(s)'.format(len(responses), len(wallets)))
+    return responses
+
+
 # Fetch all open orders of an account
 @app.task(base=BaseTaskWithRetry, name='Trading_____Send_fetch_all_open_orders')
 def send_fetch_all_open_orders(account_id):
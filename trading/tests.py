@@ -1,3 +1,79 @@
-from django.test import TestCase
+from unittest import mock
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, RequestFactory
+from capital.queries import assert_max_queries
+from capital.schema import schema
+from marketsdata.models import Exchange, Currency, Market
+from trading.methods import format_decimal, format_decimal_array
+from trading.models import Account, Order, Position
 
-# Create your tests here.
+
+class FormatDecimalTestCase(SimpleTestCase):
+
+    # Backtests size orders like validate_order() in every counting mode
+    def test_array_matches_format_decimal(self):
+        quantities = [0, 0.000123456, 0.98765, 1.5, 123.456789, 98765.4321]
+        for mode, precision in [(2, 3), (3, 4), (4, 0.01)]:
+            expected = [format_decimal(mode, precision, q) for q in quantities]
+            result = format_decimal_array(mode, np.full(len(quantities), precision), np.array(quantities))
+            np.testing.assert_allclose(result, expected, rtol=1e-12, err_msg='counting mode {0}'.format(mode))
+
+
+class OpenOrdersTestCase(TestCase):
+
+    def test_pending_amount_of_orders_without_price(self):
+        account = Account(quote='USDT')
+        account.open_orders = dict()
+        account.add_open_order('USDT', 'EUR', 'spot', 'buy', 'buy_spot', 100, None)
+        self.assertEqual(account.get_pending_amount('EUR', 'spot', 'buy', 'buy_spot'), 0)
+
+        account.add_open_order('USDT', 'EUR', 'spot', 'buy', 'buy_spot', 100, 2)
+        self.assertEqual(account.get_pending_amount('EUR', 'spot', 'buy', 'buy_spot'), 200 / 2)
+
+
+class OrderTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_superuser('owner', 'owner@example.com', 'password')
+        cls.exchange = Exchange.objects.create(exid='binance', name='Binance')
+        usdt = Currency.objects.create(code='USDT', stable_coin=True)
+        bases = Currency.objects.bulk_create([Currency(code='C{0:02d}'.format(i)) for i in range(5)])
+        cls.markets = Market.objects.bulk_create([Market(exchange=cls.exchange, type='spot', wallet='spot',
+                                                         base=base, quote=usdt, symbol='{0}/USDT'.format(base.code))
+                                                  for base in bases])
+        cls.accounts = [Account.objects.create(name='Account {0}'.format(i), exchange=cls.exchange,
+                                               owner=cls.owner) for i in range(5)]
+        for account in cls.accounts:
+            for i, market in enumerate(cls.markets):
+                Order.objects.create(account=account, market=market, orderid=str(i), clientid='{0}-{1}'.format(
+                    account.id, i), status='open', side='buy', action='buy_spot', amount=1, filled=0)
+                Position.objects.create(account=account, exchange=cls.exchange, market=market, side='buy')
+
+    # Fills written with bulk_update are published once committed
+    def test_update_order_objects_publishes_transitions(self):
+        account = self.accounts[0]
+        orders = list(Order.objects.filter(account=account).select_related('market__base'))
+        responses = {order.orderid: dict(filled=1, status='closed', price=1, cost=1, average=1, fee=None,
+                                         remaining=0) for order in orders[:2]}
+
+        with mock.patch('trading.models.publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            trades = account.update_order_objects(orders, responses)
+
+        self.assertEqual(len(trades), 2)
+        self.assertEqual(publish.call_count, 2)
+        self.assertEqual({c.args[2]['status'] for c in publish.call_args_list}, {'closed'})
+
+    # Orders and positions of accounts are batched by loaders whatever the number of accounts
+    def test_accounts_queries(self):
+        request = RequestFactory().get('/graphql')
+        request.user = self.owner
+
+        with assert_max_queries(4, 'accounts'):
+            result = schema.execute('{ accounts { name orders(first: 3) { clientid market { symbol } } '
+                                    'positions { side } } }', context_value=request)
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data['accounts']), 5)
+        self.assertEqual(len(result.data['accounts'][0]['orders']), 3)
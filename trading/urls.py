@@ -1,10 +1,14 @@
 from django.urls import path
 from django.conf.urls import url, include
 
-from trading.views import AccountDetailView, AccountListView
+from trading.views import AccountDetailView, AccountListView, AccountOrderListView, account_detail_async, \
+    account_series
 
 
 urlpatterns = [
     path('', AccountListView.as_view(), name='trading_accounts'),
     path('<int:pk>', AccountDetailView.as_view(), name='trading_account'),
+    path('<int:pk>/async', account_detail_async, name='trading_account_async'),
+    path('<int:pk>/series', account_series, name='trading_account_series'),
+    path('<int:pk>/orders', AccountOrderListView.as_view(), name='trading_account_orders'),
 ]
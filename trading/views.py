@@ -1,11 +1,21 @@
+import asyncio
 from django.http import HttpResponse
 from django.db.models import Sum
 from django.shortcuts import render
 from django.template.response import TemplateResponse
 from capital.methods import *
 from strategy.models import Strategy
-from trading.models import Account, Order, Position, Asset, Stat
+from trading.models import Account, Order, Position, Asset, Stat, Metric
+from trading.methods import get_hourly_prices
 from django.views import generic
+from django.http import JsonResponse, HttpResponseForbidden
+from django.db.models import F, Q, Max, OuterRef, Subquery
+from capital.caching import ConditionalMixin, seconds_to_next_hour
+from capital.concurrency import run_sync
+from capital.downsample import downsample, get_resolution, to_chart
+from django.conf import settings
+from django.core.cache import cache
+from capital.pagination import KeysetPaginator, KeysetPaginationMixin
 from django.shortcuts import get_object_or_404
 from trading.tables import OrderTable, AssetTable, PositionTable, ReturnTable
 from django_tables2 import SingleTableMixin, LazyPaginator
@@ -16,6 +26,7 @@ import plotly.graph_objects as go
 from marketsdata.models import Tickers
 from capital.methods import get_year, get_semester
 import numpy as np
+import pandas as pd
 
 
 class HomePage(generic.TemplateView):
@@ -37,8 +48,86 @@ class AccountListView(generic.ListView):
         return Account.objects.filter(active=True)
 
 
-class AccountDetailView(SingleTableMixin, generic.DetailView):
+# Filter orders of an account with query parameters
+def filter_orders(request, qs):
+    for param, lookup in dict(status='status', type='type', market='market__type', quote='market__quote__code'
+                              ).items():
+        if request.GET.get(param):
+            qs = qs.filter(**{lookup: request.GET[param]})
+    return qs
+
+
+# Return the latest modification of a model related to the outer account
+def latest_modified(model):
+    return Subquery(model.objects.filter(account=OuterRef('pk')).order_by().values('account').annotate(
+        dt=Max('dt_modified')).values('dt')[:1])
+
+
+# Return the datetime of the latest change of an account, its ledger, orders, positions and statistics
+def get_account_modified(pk):
+    row = Account.objects.filter(pk=pk).annotate(stat=latest_modified(Stat),
+                                                 order=latest_modified(Order),
+                                                 asset=latest_modified(Asset),
+                                                 position=latest_modified(Position)
+                                                 ).values_list('dt_modified', 'stat', 'order', 'asset',
+                                                               'position').first()
+    return max([dt for dt in row if dt], default=None) if row else None
+
+
+# Return statistics of an account and its current strategy (or no strategy), building the performance cache if missing
+def get_account_stat(pk):
+    stats = Stat.objects.defer('metrics').get(Q(strategy_id=F('account__strategy_id')) |
+                                              Q(strategy__isnull=True, account__strategy__isnull=True),
+                                              account_id=pk)
+    if not stats.performance:
+        if stats.update_performance(stats.strategy):
+            stats.save(update_fields=['performance'])
+    return stats
+
+
+# Return the chart and the table of returns of a performance cache
+def get_performance_charts(performance):
+
+    performance = performance or dict(index=[], lines=dict(), returns=[])
+    index = pd.to_datetime(performance['index'])
+    names = dict(account='Account', btc='BTC/USDT', eth='ETH/USDT', strategy='Strategy')
+
+    # Send at most CHART_POINTS points per series
+    chart_returns = []
+    for key, name in names.items():
+        line = pd.Series(performance['lines'].get(key, [None] * len(index)), index=index, dtype=float)
+        x, y = to_chart(downsample(line, settings.CHART_POINTS))
+        chart_returns.append(go.Line(x=x, y=y, name=name, line=dict(width=2)))
+
+    yaxis = dict(title='Balance')
+    yaxis2 = dict(title='Bitcoin',
+                  overlaying='y',
+                  side='right')
+
+    layout = {
+        'yaxis_title': 'Return (%)',
+        'height': 520,
+        'width': 1100,
+        'plot_bgcolor': "#f8f9fa",
+        # 'title_text': "Double Y Axis Example",
+        # 'yaxis': yaxis,
+        # 'yaxis2': yaxis2
+    }
+
+    plot_div_1 = plot({'data': chart_returns, 'layout': layout}, output_type='div',)
+
+    # Table of returns
+    table_returns = ReturnTable(performance['returns'])
+
+    return plot_div_1, table_returns
+
+
+class AccountDetailView(ConditionalMixin, SingleTableMixin, generic.DetailView):
     model = Account
+    query_budget = 40
+
+    def get_last_modified(self):
+        return get_account_modified(self.kwargs['pk'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -47,104 +136,22 @@ class AccountDetailView(SingleTableMixin, generic.DetailView):
         # Create tables
         table_asset = AssetTable(Asset.objects.filter(account=self.object, total_value__gte=1).order_by('wallet'))
         table_position = PositionTable(Position.objects.filter(account=self.object).order_by('market__symbol'))
-        table_order = OrderTable(Order.objects.filter(account=self.object).order_by('-dt_created'))
 
-        # Configure pagination
-        table_order.paginate(page=self.request.GET.get("page", 1), per_page=10)
-        table_order.paginator_class = LazyPaginator
+        # Paginate orders after a cursor, newest first
+        page_order = KeysetPaginator(filter_orders(self.request, orders.select_related('market')), ('-id',),
+                                     10).page_request(self.request)
+        table_order = OrderTable(page_order.object_list, orderable=False)
         table_order.localize = True
 
-        # Create chart
-        stats = Stat.objects.get(account=self.object, strategy=self.object.strategy)
-        strat = Strategy.objects.get(id=self.object.strategy.id)
-        btcusdt = Tickers.objects.get(market__symbol='BTC/USDT',
-                                      market__type='spot',
-                                      market__exchange__exid='binance',
-                                      year=get_year(),
-                                      semester=get_semester()
-                                      )
-        ethusdt = Tickers.objects.get(market__symbol='ETH/USDT',
-                                      market__type='spot',
-                                      market__exchange__exid='binance',
-                                      year=get_year(),
-                                      semester=get_semester()
-                                      )
-        acc_val = json_to_df(stats.metrics)['acc_val'].tail(7 * 24)
-
-        btcusdt = json_to_df(btcusdt.data)['last']
-        btcusdt = btcusdt.resample('H').fillna('ffill')
-        btcusdt = btcusdt.loc[acc_val.index]
-
-        ethusdt = json_to_df(ethusdt.data)['last']
-        ethusdt = ethusdt.resample('H').fillna('ffill')
-        ethusdt = ethusdt.loc[acc_val.index]
-
-        # Calculate hourly returns
-        ret_acc = acc_val.pct_change(1)
-        ret_btc = btcusdt.pct_change(1)
-        ret_eth = ethusdt.pct_change(1)
-
-        strateg = strat.returns['Returns']
-        strateg = strateg.loc[acc_val.index]
-        strateg.iloc[0] = 0
-
-        # Data for line chart
-        # acc_line = np.exp(np.log1p(ret_acc).cumsum())
-        # btc_line = np.exp(np.log1p(ret_btc).cumsum())
-        acc_line = ((1 + ret_acc).cumprod() - 1).fillna(0) * 100
-        btc_line = ((1 + ret_btc).cumprod() - 1).fillna(0) * 100
-        eth_line = ((1 + ret_eth).cumprod() - 1).fillna(0) * 100
-        str_line = ((1 + strateg).cumprod() - 1) * 100
-
-        chart_returns = [go.Line(x=acc_line.index.tolist(),
-                                 y=acc_line.squeeze().values.tolist(),
-                                 name='Account',
-                                 line=dict(width=2)),
-                         go.Line(x=btc_line.index.tolist(),
-                                 y=btc_line.squeeze().values.tolist(),
-                                 name='BTC/USDT',
-                                 line=dict(width=2)),
-                         go.Line(x=eth_line.index.tolist(),
-                                 y=eth_line.squeeze().values.tolist(),
-                                 name='ETH/USDT',
-                                 line=dict(width=2)),
-                         go.Line(x=str_line.index.tolist(),
-                                 y=str_line.squeeze().values.tolist(),
-                                 name='Strategy',
-                                 line=dict(width=2))
-                         ]
-
-        yaxis = dict(title='Balance')
-        yaxis2 = dict(title='Bitcoin',
-                      overlaying='y',
-                      side='right')
-
-        layout = {
-            'yaxis_title': 'Return (%)',
-            'height': 520,
-            'width': 1100,
-            'plot_bgcolor': "#f8f9fa",
-            # 'title_text': "Double Y Axis Example",
-            # 'yaxis': yaxis,
-            # 'yaxis2': yaxis2
-        }
-
-        plot_div_1 = plot({'data': chart_returns, 'layout': layout}, output_type='div',)
-
-        # Data for the table
-        acc_1h = round(ret_acc, 2).dropna()[::-1].squeeze().tolist()
-        acc_24h = round(acc_val.pct_change(24) * 100, 2)[::-1].squeeze().tolist()
-        acc_7d = round(acc_val.pct_change(24 * 7) * 100, 2)[::-1].squeeze().tolist()
-        dt = ret_acc[::-1].index.strftime(datetime_directive_s).tolist()
-        dic = [{"Datetime": c0, "ret_1h": c1, "ret_24h": c2, "ret_7d": c3} for c0, c1, c2, c3 in zip(dt, acc_1h, acc_24h, acc_7d)]
-
-        # Table of returns
-        table_returns = ReturnTable(dic)
+        # Create chart from the performance cache refreshed by update_metrics()
+        stats = get_account_stat(self.object.pk)
+        plot_div_1, table_returns = get_performance_charts(stats.performance)
 
         context['plot_div_1'] = plot_div_1
         context['table_asset'] = table_asset
         context['table_position'] = table_position
         context['table_order'] = table_order
+        context['page_order'] = page_order
         context['table_returns'] = table_returns
         context['last_update'] = stats.dt_modified.strftime(datetime_directive_literal) + ' UTC'
         context['owner'] = self.object.owner
@@ -153,3 +160,147 @@ class AccountDetailView(SingleTableMixin, generic.DetailView):
         context['positions_pnl'] = round(self.object.positions_pnl(), 2)
         context['orders_open'] = orders.filter(status='open')
         return context
+
+
+# Account dashboard gathering its queries and computations concurrently in the pool of ORM threads
+async def account_detail_async(request, pk):
+
+    orders = filter_orders(request, Order.objects.filter(account_id=pk).select_related('market'))
+
+    account, assets, positions, page_order, orders_open, stats = await asyncio.gather(
+        run_sync(get_object_or_404, Account.objects.select_related('owner'), pk=pk),
+        run_sync(list, Asset.objects.filter(account_id=pk, total_value__gte=1).select_related('currency'
+                                                                                             ).order_by('wallet')),
+        run_sync(list, Position.objects.filter(account_id=pk).select_related('market').order_by('market__symbol')),
+        run_sync(KeysetPaginator(orders, ('-id',), 10).page_request, request),
+        run_sync(list, Order.objects.filter(account_id=pk, status='open')),
+        run_sync(get_account_stat, pk)
+    )
+
+    # Values of the ledger and the chart are computed in memory
+    plot_div_1, table_returns = get_performance_charts(stats.performance)
+
+    table_order = OrderTable(page_order.object_list, orderable=False)
+    table_order.localize = True
+
+    context = dict(object=account,
+                   account=account,
+                   plot_div_1=plot_div_1,
+                   table_asset=AssetTable(assets),
+                   table_position=PositionTable(positions),
+                   table_order=table_order,
+                   page_order=page_order,
+                   table_returns=table_returns,
+                   last_update=stats.dt_modified.strftime(datetime_directive_literal) + ' UTC',
+                   owner=account.owner,
+                   assets_value=round(account.assets_value(), 2),
+                   has_position=account.has_opened_short(),
+                   positions_pnl=round(account.positions_pnl(), 2),
+                   orders_open=orders_open)
+
+    return await run_sync(render, request, 'trading/account_detail.html', context)
+
+
+# Return returns (%) of an account, benchmarks and strategy between start and end reduced to points,
+# for charts zooming in
+def account_series(request, pk):
+
+    account = get_object_or_404(Account, pk=pk)
+    if not request.user.is_authenticated or not (request.user == account.owner or request.user.is_superuser):
+        return HttpResponseForbidden()
+
+    try:
+        end = pd.Timestamp(request.GET['end']) if request.GET.get('end') else pd.Timestamp(dt_aware_now(0))
+        start = pd.Timestamp(request.GET['start']) if request.GET.get('start') else end - timedelta(days=7)
+        origin = pd.Timestamp(request.GET['origin']) if request.GET.get('origin') else start
+        points = min(int(request.GET.get('points', settings.CHART_POINTS)), 5000)
+    except ValueError:
+        return JsonResponse(dict(error='Parameters start, end and origin must be dates'), status=400)
+
+    # Align the range on hours so that zooms share cached results
+    start, end, origin = [(dt if dt.tzinfo else dt.tz_localize('UTC')).floor('H').to_pydatetime()
+                          for dt in [start, end, origin]]
+    resolution = get_resolution(start, end, points)
+
+    key = 'series:account:{0}:{1}:{2}:{3}:{4}:{5}'.format(pk, resolution, int(start.timestamp()),
+                                                           int(end.timestamp()), int(origin.timestamp()), points)
+    data = cache.get(key)
+    if data is None:
+        lines = get_series_lines(account, resolution, start, end, origin)
+        data = dict(resolution=resolution, origin=origin.strftime(datetime_directive_ISO_8601), series=dict())
+        for name, line in lines.items():
+            x, y = to_chart(downsample(line, points))
+            data['series'][name] = dict(x=x, y=y)
+        cache.set(key, data, seconds_to_next_hour())
+
+    return JsonResponse(data)
+
+
+# Return returns (%) of the account, benchmarks and strategy over a range, rebased on the origin of the
+# chart like the lines of Stat.performance so that zoomed traces stay aligned with the others
+def get_series_lines(account, resolution, start, end, origin):
+
+    values = Metric.get_series(account, resolution, start, end)
+    index = values.index
+    empty = pd.Series([], index=pd.DatetimeIndex([]), dtype=float)
+    if not len(index):
+        return dict(account=empty, btc=empty, eth=empty, strategy=empty)
+
+    # Account value at the first hour of the chart
+    base = Metric.objects.filter(account=account, resolution='1h', dt__gte=origin
+                                 ).order_by('dt').values_list('close', flat=True).first()
+    lines = dict(account=(values / base - 1) * 100 if base else values * np.nan)
+
+    # Metrics of days and weeks close at the last hour of their period (the latest hour for the current
+    # period), benchmarks and strategy are read at that hour and plotted at the start of the period
+    length = {'1h': timedelta(hours=1), '1d': timedelta(days=1), '1w': timedelta(weeks=1)}[resolution]
+    closes = index + (length - timedelta(hours=1))
+    now = pd.Timestamp(dt_aware_now(0))
+    closes = closes.where(closes <= now, now)
+
+    # Benchmarks
+    dts = closes.strftime(datetime_directive_ISO_8601).tolist()
+    origin_string = origin.strftime(datetime_directive_ISO_8601)
+    for name, symbol in [('btc', 'BTC/USDT'), ('eth', 'ETH/USDT')]:
+        prices = get_hourly_prices('binance', symbol, [origin_string] + dts)
+        line = pd.Series([prices.get(dt) for dt in dts], index=index, dtype=float).ffill()
+        lines[name] = (line / prices[origin_string] - 1) * 100 if prices.get(origin_string) else line * np.nan
+
+    # Cumulative hourly returns of the strategy after the origin
+    strategy = account.strategy
+    if strategy is not None and strategy.returns is not None:
+        returns = strategy.returns['Returns'].astype(float)
+        returns.index = pd.to_datetime(returns.index, utc=True)
+        returns = returns.sort_index()[(returns.index > origin) & (returns.index <= end)]
+        cumulative = (1 + returns).cumprod()
+        cumulative = pd.Series(cumulative.reindex(closes, method='ffill').values, index=index, dtype=float)
+        lines['strategy'] = (cumulative.fillna(1) - 1) * 100
+    else:
+        lines['strategy'] = pd.Series(np.nan, index=index, dtype=float)
+
+    return lines
+
+
+class AccountOrderListView(ConditionalMixin, KeysetPaginationMixin, generic.ListView):
+    model = Order
+    paginate_by = 50
+    keyset = ('-id',)
+    json_fields = ('id', 'clientid', 'market__symbol', 'market__type', 'status', 'type', 'side', 'action', 'amount',
+                   'price', 'cost', 'filled', 'average', 'dt_created', 'dt_modified')
+
+    def get_queryset(self):
+        return filter_orders(self.request, Order.objects.filter(account_id=self.kwargs['pk']
+                                                                ).select_related('market'))
+
+    def get_last_modified(self):
+        return Order.objects.filter(account_id=self.kwargs['pk']).aggregate(dt=Max('dt_modified'))['dt']
+
+    # Check permission before validating the client copy
+    def dispatch(self, request, *args, **kwargs):
+        account = get_object_or_404(Account, pk=kwargs['pk'])
+        if not request.user.is_authenticated or not (request.user == account.owner or request.user.is_superuser):
+            return HttpResponseForbidden()
+        return super().dispatch(request, *args, **kwargs)
+
+    def render_to_response(self, context, **response_kwargs):
+        return self.render_json(context)